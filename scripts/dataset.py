@@ -1,98 +1,278 @@
-import pickle
+import os
+import sys
 import json
+import time
+import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from scipy.spatial import KDTree
 import pandas as pd
 
-GRAPH_PATH = "data/processed/graph_with_strava_and_dplus.gpickle"
-MATCHED_DIR = Path("data/matched_traces")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.snap_index import EdgeSnapIndex, SNAP_INDEX_DIR
+from src.data_collection.edge_features import EdgeFeatureStore, EDGE_FEATURES_DIR
+from src.data_collection.trace_store import TraceStore, HMM_TRACES_DIR, VALHALLA_TRACES_DIR, CHUNK_TRACES
+from src.utils.workers import default_workers
+
 OUT_DIR = Path("data/final_dataset")
-OUT_DIR.mkdir(exist_ok=True)
-
-with open(GRAPH_PATH, "rb") as fg:
-    G = pickle.load(fg)
-node_ids = []
-node_coords = []
-for nid, data in G.nodes(data=True):
-    lat = data.get("y")
-    lon = data.get("x")
-    if lat is not None and lon is not None:
-        node_ids.append(nid)
-        node_coords.append([lat, lon])
-node_coords = np.array(node_coords)
-kdtree = KDTree(node_coords)
-
-def find_nearest_node(coord):
-    dist, idx = kdtree.query(coord)
-    return node_ids[idx]
-
-def extract_shape_points(data):
-    points = []
-    for leg in data.get("trip", {}).get("legs", []):
-        shape_raw = leg.get("shape", "")
-        if isinstance(shape_raw, str):
-            import polyline
-            decoded = polyline.decode(shape_raw)
-            if any(abs(lat) > 90 or abs(lon) > 180 for lat, lon in decoded):
-                decoded = [(lat / 10, lon / 10) for lat, lon in decoded]
-            points.extend(decoded)
-        elif isinstance(shape_raw, list):
-            points.extend(shape_raw)
-    return points
-
-MAX_DIST = 0.002  # ~200 m, à ajuster selon la densité
-
-rows = []
-
-for json_file in MATCHED_DIR.glob("*_matched.json"):
-    with open(json_file, "r") as f:
-        data = json.load(f)
-    shape_points = extract_shape_points(data)
-    if not shape_points or len(shape_points) < 2:
-        continue
-    print(f"\n=== Trace : {json_file.name} ===")
-    n_match, n_fail = 0, 0
-    for i in range(len(shape_points) - 1):
-        pt1, pt2 = shape_points[i], shape_points[i+1]
-        u = find_nearest_node(pt1)
-        v = find_nearest_node(pt2)
-        if u == v:
-            continue  # Ignore segments "à l'arrêt"
-        lat1, lon1 = G.nodes[u]['y'], G.nodes[u]['x']
-        lat2, lon2 = G.nodes[v]['y'], G.nodes[v]['x']
-        dist = np.hypot(lat1 - lat2, lon1 - lon2)
-        found = False
-        # Cherche dans les deux sens (u,v) et (v,u)
-        for dir_ in [(u, v), (v, u)]:
-            if G.has_edge(*dir_) and dist < MAX_DIST:
-                for k, edge_data in G[dir_[0]][dir_[1]].items():
-                    if edge_data.get("dplus") is not None and edge_data.get("distance") is not None:
-                        print(f"[MATCH] {dir_} k={k} : dplus={edge_data.get('dplus')}, distance={edge_data.get('distance')}, popularity={edge_data.get('popularity')}, surface={edge_data.get('surface')}")
-                        rows.append({
-                            "trace_file": json_file.name,
-                            "edge_id": [int(dir_[0]), int(dir_[1]), int(k)],
-                            "from_node": int(dir_[0]),
-                            "to_node": int(dir_[1]),
-                            "distance": float(edge_data.get("distance")),
-                            "dplus": float(edge_data.get("dplus")),
-                            "surface": str(edge_data.get("surface")),
-                            "popularity": float(edge_data.get("popularity"))
-                        })
-                        n_match += 1
-                        found = True
-                        break
-                if found:
-                    break
-        if not found:
-            print(f"[FAIL] Pas de match enrichi pour ({u}, {v}) ou trop loin (Δlat={abs(lat1-lat2):.5f}, Δlon={abs(lon1-lon2):.5f}, dist={dist:.5f})")
-            n_fail += 1
-    print(f"Total matches: {n_match}, fails: {n_fail}")
-
-df = pd.DataFrame(rows)
-print(f"\nShape du DataFrame final : {df.shape}")
-print(df.head(10))
-print("\nValeurs manquantes par colonne :\n", df.isnull().mean())
-
-df.to_pickle(OUT_DIR / "final_edge_dataset.pkl")
-df.to_csv(OUT_DIR / "final_edge_dataset.csv", index=False)
+DATASET_DIR = OUT_DIR / "final_edge_dataset"   # partitions part-XXXXX.parquet + _manifest.json
+FORMAT_VERSION = 3
+
+MAX_SNAP_DIST = 30.0  # m, distance maximale entre un point de la trace et le graphe
+N_WORKERS = default_workers()
+
+# === Colonnes du jeu de données (une ligne par arête parcourue)
+EDGE_COLUMNS = ("edge_index", "from_node", "to_node", "key",
+                "distance", "dplus", "grade", "popularity", "highway", "surface")
+
+# === Graphe, index d'accrochage et stores de traces propres à chaque processus worker
+_worker = {}
+
+
+def _init_worker(store_dir, snap_dir, features_dir, hmm_dir, valhalla_dir, verbose=False):
+    # Tout est mappé en mémoire : les pages sont partagées entre workers
+    _worker["store"] = GraphStore.load(store_dir)
+    _worker["features"] = EdgeFeatureStore.load(features_dir, graph_version=_worker["store"].version)
+    _worker["snap_index"] = EdgeSnapIndex.load(snap_dir)
+    _worker["traces"] = {"hmm": TraceStore(hmm_dir), "valhalla": TraceStore(valhalla_dir)}
+    _worker["verbose"] = verbose
+
+
+def snapped_edges(store, snap_index, lat, lon):
+    """
+    Arêtes parcourues par une géométrie recalée : chaque point est accroché
+    au nœud le plus proche (un seul appel vectorisé), puis chaque paire de
+    nœuds successifs distincts est résolue en arête par edge_index(), dans
+    le sens (u, v) puis, à défaut, (v, u).
+    Renvoie (arêtes, nombre d'échecs).
+    """
+    nodes = snap_index.nearest_nodes(store, lon, lat, MAX_SNAP_DIST)
+    n_fail = int((nodes < 0).sum())
+    nodes = nodes[nodes >= 0]
+    if len(nodes) < 2:
+        return np.empty(0, dtype=np.int64), n_fail
+    nodes = nodes[np.concatenate(([True], nodes[1:] != nodes[:-1]))]
+    edges = store.edge_index(nodes[:-1], nodes[1:])
+    missing = edges < 0
+    edges[missing] = store.edge_index(nodes[1:][missing], nodes[:-1][missing])
+    n_fail += int((edges < 0).sum())
+    return edges[edges >= 0], n_fail
+
+
+def edge_columns(features, edges):
+    """Attributs des arêtes lus en bloc dans le feature store ; arêtes sans distance ou D+ écartées."""
+    edges = np.asarray(edges, dtype=np.int64)
+    valid = ~(np.isnan(features.column("dplus", edges)) | np.isnan(features.column("distance", edges)))
+    edges = edges[valid]
+    uvk = features.edge_ids(edges)
+    columns = {
+        "edge_index": edges,
+        "from_node": uvk[:, 0],
+        "to_node": uvk[:, 1],
+        "key": uvk[:, 2],
+        **{name: features.column(name, edges) for name in ("distance", "dplus", "grade", "popularity")},
+        "highway": features.highway[edges],
+        "surface": features.surface[edges],
+    }
+    return columns, int((~valid).sum())
+
+
+def process_trace(job):
+    """Lignes d'une trace (source, nom) : renvoie (nom, colonnes, nombre d'échecs)."""
+    source, name = job
+    store = _worker["store"]
+    trace = _worker["traces"][source].get(name)
+    if source == "hmm":
+        # Séquence d'arêtes déjà identifiée par hmm_map_matching.py
+        edges, n_fail = trace.edges, 0
+    else:
+        edges, n_fail = snapped_edges(store, _worker["snap_index"], trace.lat, trace.lon)
+    columns, n_missing = edge_columns(_worker["features"], edges)
+    n_fail += n_missing
+
+    if _worker["verbose"]:
+        surfaces, highways = store.surface_names(), store.highway_names()
+        print(f"\n=== Trace : {name} ({source}) ===")
+        for i, e in enumerate(columns["edge_index"]):
+            print(f"[MATCH] ({columns['from_node'][i]}, {columns['to_node'][i]}) k={columns['key'][i]} : "
+                  f"dplus={columns['dplus'][i]}, distance={columns['distance'][i]}, grade={columns['grade'][i]:.3f}, "
+                  f"popularity={columns['popularity'][i]}, highway={highways[e]}, surface={surfaces[e]}")
+        print(f"Total matches: {len(columns['edge_index'])}, fails: {n_fail}")
+    return name, columns, n_fail
+
+
+def list_jobs(store, hmm, valhalla):
+    """Traces à traiter : recalage HMM (sur la version courante du graphe) en priorité, Valhalla sinon."""
+    jobs, stale = [], 0
+    for name in hmm.names():
+        if hmm.get(name).graph_version == store.version:
+            jobs.append(("hmm", name))
+        else:
+            stale += 1
+    if stale:
+        print(f"⚠️  {stale} traces HMM recalées sur une autre version du graphe, ignorées")
+    hmm_names = {name for _, name in jobs}
+    jobs += [("valhalla", name) for name in valhalla.names() if name not in hmm_names]
+    return jobs
+
+
+def to_dataframe(store, names, parts):
+    """Concatène les colonnes des traces en un DataFrame (highway et surface catégorielles)."""
+    counts = [len(p["edge_index"]) for p in parts]
+    data = {"trace_file": pd.Categorical(np.repeat(np.asarray(names, dtype=object), counts))}
+    for col in EDGE_COLUMNS:
+        data[col] = np.concatenate([p[col] for p in parts]) if parts else np.empty(0)
+    data["highway"] = pd.Categorical.from_codes(data["highway"].astype(np.int64), categories=store.highway_labels)
+    data["surface"] = pd.Categorical.from_codes(data["surface"].astype(np.int64), categories=store.surface_labels)
+    return pd.DataFrame(data)
+
+
+class DatasetManifest:
+    """
+    Manifeste du jeu de données partitionné : version du graphe et
+    paramètres de construction, et pour chaque trace sa source, son hash
+    (TraceStore.content_hash, enregistré à l'écriture de la trace) et la
+    partition qui contient ses lignes. Écrit (atomiquement) après les
+    partitions : une partition absente du manifeste est orpheline et
+    supprimée à l'ouverture.
+    """
+
+    def __init__(self, directory=DATASET_DIR):
+        self.directory = Path(directory)
+        self.path = self.directory / "_manifest.json"   # préfixe "_" : ignoré par les lecteurs Parquet
+        self.data = {"settings": None, "traces": {}}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+        self.traces = self.data["traces"]
+        self.remove_orphans()
+
+    def remove_orphans(self):
+        referenced = set(self.parts())
+        for part in self.directory.glob("part-*.parquet"):
+            if part.name not in referenced:
+                part.unlink()
+
+    def parts(self):
+        return sorted({entry["part"] for entry in self.traces.values()})
+
+    def new_part(self):
+        existing = [int(p.stem.split("-")[1]) for p in self.directory.glob("part-*.parquet")]
+        return f"part-{max(existing, default=-1) + 1:05d}.parquet"
+
+    def reset(self, settings):
+        """Nouvelle version du graphe ou des paramètres : toutes les partitions sont à refaire."""
+        self.traces.clear()
+        self.data["settings"] = settings
+        self.save()
+        self.remove_orphans()
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+def drop_traces(manifest, names):
+    """
+    Retire les lignes de traces supprimées ou modifiées : les autres lignes
+    de leur partition sont recopiées dans une nouvelle partition (l'ancienne
+    devient orpheline une fois le manifeste enregistré), rien n'est recopié
+    si la partition ne contenait qu'elles.
+    """
+    by_part = {}
+    for name in names:
+        by_part.setdefault(manifest.traces.pop(name)["part"], set()).add(name)
+    kept = {part for part in manifest.parts() if part in by_part}
+    for part in kept:
+        df = pd.read_parquet(manifest.directory / part)
+        df = df[~df["trace_file"].isin(by_part[part])]
+        df["trace_file"] = df["trace_file"].cat.remove_unused_categories()
+        new_part = manifest.new_part()
+        df.to_parquet(manifest.directory / new_part, index=False)
+        for entry in manifest.traces.values():
+            if entry["part"] == part:
+                entry["part"] = new_part
+    manifest.save()
+    manifest.remove_orphans()
+    return len(by_part)
+
+
+def load_dataset(dataset_dir=DATASET_DIR):
+    """Jeu de données complet : partitions référencées par le manifeste."""
+    manifest = DatasetManifest(dataset_dir)
+    return pd.read_parquet([manifest.directory / part for part in manifest.parts()])
+
+
+def build_rows(jobs, n_workers, verbose, initargs):
+    """Lignes des traces (source, nom) : renvoie [(nom, colonnes, échecs)] dans l'ordre des jobs."""
+    if n_workers <= 1 or len(jobs) <= 1:
+        _init_worker(*initargs, verbose)
+        return list(map(process_trace, jobs))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(*initargs, verbose)) as pool:
+        return list(pool.map(process_trace, jobs, chunksize=max(1, len(jobs) // (n_workers * 4))))
+
+
+def main(n_workers=N_WORKERS, verbose=False, full=False, store_dir=GRAPH_STORE_DIR, snap_dir=SNAP_INDEX_DIR,
+         features_dir=EDGE_FEATURES_DIR, hmm_dir=HMM_TRACES_DIR, valhalla_dir=VALHALLA_TRACES_DIR,
+         dataset_dir=DATASET_DIR):
+    """
+    Construction incrémentale : seules les traces nouvelles ou modifiées
+    (hash) sont traitées et ajoutées dans une nouvelle partition ; les lignes
+    des traces supprimées ou modifiées sont retirées de leur partition. Un
+    changement de version du graphe ou de paramètres (ou full=True) refait
+    tout le jeu de données.
+    """
+    start = time.time()
+    store = GraphStore.load(store_dir)
+    stores = {"hmm": TraceStore(hmm_dir), "valhalla": TraceStore(valhalla_dir)}
+    manifest = DatasetManifest(dataset_dir)
+    settings = {"format_version": FORMAT_VERSION, "graph_version": store.version, "max_snap_dist": MAX_SNAP_DIST}
+    if full or manifest.data["settings"] != settings:
+        print("♻️  Reconstruction complète du jeu de données")
+        manifest.reset(settings)
+
+    jobs = list_jobs(store, stores["hmm"], stores["valhalla"])
+    # Hash lus dans les métadonnées des stores : aucune trace n'est relue
+    hashes = {name: (source, stores[source].content_hash(name)) for source, name in jobs}
+    stale = [name for name, entry in manifest.traces.items()
+             if hashes.get(name) != (entry["source"], entry["sha256"])]
+    jobs = [(source, name) for source, name in jobs if name not in manifest.traces or name in stale]
+    n_removed = sum(name not in hashes for name in stale)
+    n_rewritten = drop_traces(manifest, stale)
+    print(f"🔄 {len(jobs)} traces nouvelles ou modifiées, {n_removed} supprimées "
+          f"({n_rewritten} partitions réécrites, {n_workers} processus)")
+
+    initargs = (str(store_dir), str(snap_dir), str(features_dir), str(hmm_dir), str(valhalla_dir))
+    n_rows, n_fail = 0, 0
+    manifest.directory.mkdir(parents=True, exist_ok=True)
+    for a in range(0, len(jobs), CHUNK_TRACES):
+        results = build_rows(jobs[a:a + CHUNK_TRACES], n_workers, verbose, initargs)
+        names = [name for name, _, _ in results]
+        df = to_dataframe(store, names, [columns for _, columns, _ in results])
+        part = manifest.new_part()
+        df.to_parquet(manifest.directory / part, index=False)
+        for (source, name), (_, columns, _) in zip(jobs[a:a + CHUNK_TRACES], results):
+            manifest.traces[name] = {"source": source, "sha256": hashes[name][1], "part": part,
+                                     "rows": int(len(columns["edge_index"]))}
+        manifest.save()
+        n_rows += len(df)
+        n_fail += sum(fail for _, _, fail in results)
+    manifest.save()
+
+    n_total = sum(entry["rows"] for entry in manifest.traces.values())
+    print(f"⏱️  Terminé en {time.time() - start:.1f} s : {n_rows} arêtes ajoutées ({n_fail} échecs)")
+    print(f"💾 {len(manifest.traces)} traces, {n_total} arêtes, {len(manifest.parts())} partitions dans {manifest.directory}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Jeu de données d'arêtes (incrémental) à partir des traces recalées")
+    parser.add_argument("--jobs", type=int, default=N_WORKERS, help="processus de traitement des traces")
+    parser.add_argument("--verbose", action="store_true", help="affiche chaque arête retenue")
+    parser.add_argument("--full", action="store_true", help="reconstruit tout le jeu de données")
+    args = parser.parse_args()
+    main(n_workers=args.jobs, verbose=args.verbose, full=args.full)
@@ -1,22 +1,23 @@
+import shutil
 from pathlib import Path
 
-FOLDER = Path("data/gpx_clean")
+FOLDER = Path("data/processed/traces/clean")
 
 def main():
     if not FOLDER.exists():
         print("📂 Dossier inexistant :", FOLDER)
         return
 
-    files = list(FOLDER.glob("*.pkl"))
-    if not files:
+    chunks = list(FOLDER.glob("chunk_*"))
+    if not chunks:
         print("✅ Dossier déjà vide.")
         return
 
-    for file in files:
-        file.unlink()
-        print(f"🗑️ Supprimé : {file.name}")
+    for chunk in chunks:
+        shutil.rmtree(chunk)
+        print(f"🗑️ Supprimé : {chunk.name}")
 
-    print(f"\n✅ {len(files)} fichier(s) supprimé(s) de {FOLDER}")
+    print(f"\n✅ {len(chunks)} bloc(s) supprimé(s) de {FOLDER}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import pickle
+from pathlib import Path
+import numpy as np
+from shapely.geometry import LineString
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.utils.geo import flatten_geometries, geodesic_lengths
+
+# === Fichiers ===
+GRAPH_INPUT = Path("data/processed/osm_graph_filtered_clean.gpickle")
+GRAPH_OUTPUT = Path("data/processed/graph_with_distance.gpickle")
+
+def edge_geometries(G, edges):
+    """
+    Géométrie de chaque arête ; à défaut, segment droit entre ses deux nœuds
+    (distance à vol d'oiseau, comme l'ancien calcul).
+    """
+    geoms = []
+    for u, v, _, data in edges:
+        geom = data.get("geometry")
+        if not isinstance(geom, LineString):
+            try:
+                geom = LineString([
+                    (G.nodes[u]["x"], G.nodes[u]["y"]),
+                    (G.nodes[v]["x"], G.nodes[v]["y"]),
+                ])
+            except KeyError:
+                geom = None
+        geoms.append(geom)
+    return geoms
+
+def add_distance(G):
+    """
+    Écrit l'attribut distance (m, géodésique WGS84) sur toutes les arêtes.
+    Renvoie le nombre d'arêtes sans distance calculable.
+    """
+    edges = list(G.edges(keys=True, data=True))
+    geoms = edge_geometries(G, edges)
+    coords, offsets = flatten_geometries(geoms)
+    lengths = geodesic_lengths(coords, offsets)
+    has_geom = np.diff(offsets) >= 2
+
+    missing = 0
+    for (_, _, _, data), length, ok in zip(edges, lengths, has_geom):
+        if ok:
+            data["distance"] = float(length)  # En mètres
+        else:
+            data["distance"] = None
+            missing += 1
+    return missing
+
+if __name__ == "__main__":
+    print(f"📥 Chargement du graphe : {GRAPH_INPUT}")
+    with open(GRAPH_INPUT, "rb") as f:
+        G = pickle.load(f)
+
+    print("📏 Calcul des distances géodésiques (passage vectorisé)...")
+    missing = add_distance(G)
+    print(f"✅ Distances calculées : {G.number_of_edges() - missing} / {G.number_of_edges()}")
+
+    print(f"💾 Sauvegarde du graphe : {GRAPH_OUTPUT}")
+    with open(GRAPH_OUTPUT, "wb") as f:
+        pickle.dump(G, f)
+
+    print("✅ Terminé.")
@@ -1,6 +1,9 @@
 import os
+import shutil
 from pathlib import Path
 
+MATCHED_FOLDERS = ("data/processed/traces/hmm", "data/processed/traces/valhalla")
+
 def clean_matched_traces_folder(folder_path="data/matched_traces"):
     folder = Path(folder_path)
     if not folder.exists():
@@ -17,10 +20,14 @@ def clean_matched_traces_folder(folder_path="data/matched_traces"):
             if file.is_file():
                 file.unlink()
                 print(f"Supprimé : {file.name}")
+            elif file.is_dir():
+                shutil.rmtree(file)
+                print(f"Supprimé : {file.name}/")
         except Exception as e:
             print(f"Erreur lors de la suppression de {file.name} : {e}")
 
     print(f"Nettoyage terminé du dossier {folder_path}.")
 
 if __name__ == "__main__":
-    clean_matched_traces_folder()
+    for folder in MATCHED_FOLDERS:
+        clean_matched_traces_folder(folder)
@@ -1,55 +1,105 @@
+import io
+import os
+import sys
 import numpy as np
 from PIL import Image
 import rasterio
+from rasterio.enums import Resampling
 from rasterio.transform import from_bounds
-import os
+from rasterio.windows import Window
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.tile_utils import tile_bounds_3857
+from src.data_collection.download_strava import download_heatmap_area, open_tile_cache
 
-# === Coordonnées et dimensions
+# === Zone (mêmes paramètres que download_strava.py)
 CENTER_LAT = 48.4
 CENTER_LON = 2.4
-AREA_KM = 130  # correspond à ton image téléchargée
+AREA_KM = 130
+MAX_TILES = 150
+ACTIVITY = "ride"
 
 # === Fichiers
-INPUT_PNG = "data/processed/heatmap_130km_48_4_2_4.png"
 OUTPUT_TIF = "data/strava_tiles/heatmap.tif"
 
-# === Résolution approximative
-deg_per_km = 1.0 / 111  # ~0.009°
-pixel_size = (AREA_KM * deg_per_km) / 256  # pour 256 px de base
-
-# === Charger l’image PNG
-img = Image.open(INPUT_PNG).convert("RGBA")
-width, height = img.size
-
-# === Définir la transformation spatiale (géoréférencement)
-transform = from_bounds(
-    CENTER_LON - (width / 2) * pixel_size,
-    CENTER_LAT - (height / 2) * pixel_size,
-    CENTER_LON + (width / 2) * pixel_size,
-    CENTER_LAT + (height / 2) * pixel_size,
-    width,
-    height
-)
-
-# === Convertir chaque canal en numpy array
-r, g, b, a = [np.array(c) for c in img.split()]
-
-# === Écriture GeoTIFF
-os.makedirs(os.path.dirname(OUTPUT_TIF), exist_ok=True)
-with rasterio.open(
-    OUTPUT_TIF,
-    "w",
-    driver="GTiff",
-    height=height,
-    width=width,
-    count=4,
-    dtype="uint8",
-    crs="EPSG:4326",
-    transform=transform
-) as dst:
-    dst.write(r, 1)
-    dst.write(g, 2)
-    dst.write(b, 3)
-    dst.write(a, 4)
-
-print(f"✅ Fichier GeoTIFF généré : {OUTPUT_TIF}")
+# === Format de sortie
+TILE_SIZE = 256
+OVERVIEW_FACTORS = (2, 4, 8, 16)
+GEOTIFF_PROFILE = {
+    "driver": "GTiff",
+    "count": 1,
+    "dtype": "uint8",
+    "crs": "EPSG:3857",
+    "tiled": True,
+    "blockxsize": TILE_SIZE,
+    "blockysize": TILE_SIZE,
+    "compress": "deflate",
+    "predictor": 2,
+    "BIGTIFF": "IF_SAFER",
+}
+
+
+def tile_intensity(data):
+    """
+    Intensité d'une tuile PNG : canal rouge (la bande 1 lue jusqu'ici par
+    StravaHeatmapProcessor), mise à 0 là où la tuile est transparente.
+    """
+    with Image.open(io.BytesIO(data)) as tile_image:
+        rgba = np.asarray(tile_image.convert("RGBA"))
+    return np.where(rgba[..., 3] > 0, rgba[..., 0], 0).astype(np.uint8)
+
+
+def write_heatmap_geotiff(cache, zoom, x_min, x_max, y_min, y_max, output_path=OUTPUT_TIF):
+    """
+    Écrit la plage de tuiles du cache dans un GeoTIFF EPSG:3857 mono-bande,
+    tuilé et compressé, une ligne de tuiles à la fois : la mémoire ne dépend
+    pas de la taille de la zone. L'emprise est celle, exacte, des tuiles
+    (num2deg), sans approximation en degrés par kilomètre.
+    Les tuiles absentes restent à 0 ; des aperçus internes (moyenne) sont
+    ajoutés pour les lectures à basse résolution.
+    """
+    width = (x_max - x_min + 1) * TILE_SIZE
+    height = (y_max - y_min + 1) * TILE_SIZE
+    transform = from_bounds(*tile_bounds_3857(x_min, y_min, x_max, y_max, zoom), width, height)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    written = 0
+    with rasterio.open(output_path, "w", width=width, height=height,
+                       transform=transform, **GEOTIFF_PROFILE) as dst:
+        for y in range(y_min, y_max + 1):
+            row = cache.get_range(zoom, x_min, x_max, y, y)
+            for (x, _), data in sorted(row.items()):
+                try:
+                    intensity = tile_intensity(data)
+                except Exception as e:
+                    print(f"Erreur pour la tuile {zoom}/{x}/{y} : {e}")
+                    continue
+                if intensity.shape != (TILE_SIZE, TILE_SIZE):
+                    print(f"Tuile {zoom}/{x}/{y} ignorée : taille {intensity.shape}")
+                    continue
+                window = Window((x - x_min) * TILE_SIZE, (y - y_min) * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+                dst.write(intensity, 1, window=window)
+                written += 1
+
+        factors = [f for f in OVERVIEW_FACTORS if min(width, height) // f >= TILE_SIZE]
+        if factors:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns="rio_overview", resampling="average")
+    return written
+
+
+def main():
+    zoom, x_min, x_max, y_min, y_max = download_heatmap_area(
+        lat=CENTER_LAT, lon=CENTER_LON, area_km=AREA_KM, max_tiles=MAX_TILES, activity=ACTIVITY
+    )
+    cache = open_tile_cache(ACTIVITY)
+    try:
+        written = write_heatmap_geotiff(cache, zoom, x_min, x_max, y_min, y_max, OUTPUT_TIF)
+    finally:
+        cache.close()
+    print(f"✅ Fichier GeoTIFF généré : {OUTPUT_TIF} ({written} tuiles)")
+
+
+if __name__ == "__main__":
+    main()
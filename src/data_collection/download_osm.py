@@ -58,6 +58,6 @@ if __name__ == "__main__":
     G = download_osm_graph(
         filepath="data/raw_osm/osm_graph_zone_interet",
         center=(48.55, 2.8),
-        dist=65000,  # ✅ pour une zone ~90x90 km, rayon de 65 km.
+        side_km=130,  # ✅ zone de 130x130 km (rayon de 65 km).
         network_type="bike"
     )
@@ -1,75 +1,54 @@
 import os
 import sys
-import requests
-from PIL import Image
-import io
-import math
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from src.data_collection.tile_utils import deg2num, get_zoom_for_area
+from src.data_collection.tile_utils import tile_range_for_area
+from src.data_collection.tile_downloader import TileDownloader, TileManifest, TILE_DIR
+from src.data_collection.tile_cache import MBTilesCache, TILE_CACHE_PATH, MAX_CACHE_BYTES
 
-def download_heatmap_area(lat, lon, area_km=10, max_tiles=100, activity="run", output_path=None):
+def open_tile_cache(activity="run"):
+    """Cache MBTiles des tuiles de l'activité (data/strava_tiles/strava_{activity}.mbtiles)."""
+    return MBTilesCache(str(TILE_CACHE_PATH).format(activity=activity), metadata={
+        "name": f"strava-heatmap-{activity}", "format": "png",
+    })
+
+def download_heatmap_area(lat, lon, area_km=10, max_tiles=100, activity="run"):
     """
-    Télécharge une image heatmap Strava centrée sur (lat, lon) couvrant area_km x area_km.
-    Les tuiles sont mises en cache dans data/strava_tiles/.
-    L'image finale est enregistrée automatiquement dans data/processed/
-    avec un nom basé sur la coordonnée et la taille de la zone.
+    Met à jour le cache MBTiles avec les tuiles heatmap Strava couvrant
+    area_km x area_km autour de (lat, lon) : seules les tuiles absentes ou
+    périmées sont téléchargées.
+    Renvoie la plage de tuiles (zoom, x_min, x_max, y_min, y_max) ; le GeoTIFF
+    est produit depuis le cache par convert_heatmap_to_geotiff.py, sans
+    assembler d'image en mémoire.
     """
-    zoom = get_zoom_for_area(area_km=area_km, max_tiles=max_tiles, lat=lat)
+    zoom, x_min, x_max, y_min, y_max = tile_range_for_area(lat, lon, area_km, max_tiles)
     print(f"Zoom sélectionné : {zoom}")
 
-    center_x, center_y = deg2num(lat, lon, zoom)
-    tile_km = 40075 * abs(math.cos(math.radians(lat))) / (2 ** zoom)
-    nb_tiles = int(area_km / tile_km / 2)
-
-    tile_size = 256
-    total_width = tile_size * (2 * nb_tiles + 1)
-    total_height = tile_size * (2 * nb_tiles + 1)
-    combined_image = Image.new("RGBA", (total_width, total_height))
-
-    headers = {
-        "User-Agent": "Mozilla/5.0"
-    }
-
-    for dx in range(-nb_tiles, nb_tiles + 1):
-        for dy in range(-nb_tiles, nb_tiles + 1):
-            x = center_x + dx
-            y = center_y + dy
-            url = f"https://strava-heatmap.tiles.freemap.sk/{activity}/hot/{zoom}/{x}/{y}.png"
-            tile_path = f"data/strava_tiles/{zoom}/{x}/{y}.png"
-
-            try:
-                if os.path.exists(tile_path):
-                    tile_image = Image.open(tile_path)
-                    print(f"Tuile en cache : {tile_path}")
-                else:
-                    response = requests.get(url, headers=headers)
-                    response.raise_for_status()
-                    tile_image = Image.open(io.BytesIO(response.content))
-                    os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-                    tile_image.save(tile_path)
-                    print(f"Téléchargé et sauvegardé : {tile_path}")
-
-                pos_x = (dx + nb_tiles) * tile_size
-                pos_y = (dy + nb_tiles) * tile_size
-                combined_image.paste(tile_image, (pos_x, pos_y))
-
-            except Exception as e:
-                print(f"Erreur pour {url} : {e}")
-                continue
-
-    # Génération automatique du nom de l'image finale si non fourni
-    if output_path is None:
-        safe_lat = str(round(lat, 5)).replace('.', '_')
-        safe_lon = str(round(lon, 5)).replace('.', '_')
-        filename = f"heatmap_{area_km}km_{safe_lat}_{safe_lon}.png"
-        output_path = os.path.join("data", "processed", filename)
-
-    # Création du dossier si besoin et sauvegarde
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    combined_image.save(output_path)
-    print(f"Image finale sauvegardée : {output_path}")
+    # === Mise à jour concurrente du cache MBTiles (tuiles absentes ou périmées)
+    tiles = [
+        (zoom, x, y)
+        for x in range(x_min, x_max + 1)
+        for y in range(y_min, y_max + 1)
+    ]
+    cache = open_tile_cache(activity)
+    if cache.total_size() == 0:
+        imported = cache.import_directory(TILE_DIR)
+        if imported:
+            print(f"Cache : {imported} tuiles importées depuis {TILE_DIR}")
+    manifest = TileManifest(TILE_DIR / f"manifest_{activity}_{zoom}.jsonl")
+    downloader = TileDownloader(url_params={"activity": activity})
+    try:
+        counts = downloader.download(tiles, cache, manifest=manifest)
+    finally:
+        downloader.close()
+    print(f"Tuiles : {counts}")
+
+    evicted = cache.evict(MAX_CACHE_BYTES)
+    if evicted:
+        print(f"Cache : {evicted} tuiles évincées")
+    cache.close()
+    return zoom, x_min, x_max, y_min, y_max
 
 if __name__ == "__main__":
     download_heatmap_area(
@@ -78,4 +57,4 @@ if __name__ == "__main__":
     area_km=130,    # couvre ~130km x 130km
     max_tiles=150,  # augmente la tolérance
     activity="ride"
-)
\ No newline at end of file
+)
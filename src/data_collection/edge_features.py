@@ -0,0 +1,176 @@
+# src/data_collection/edge_features.py
+
+import os
+import sys
+import json
+from pathlib import Path
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.utils.array_io import save_arrays
+
+# === Feature store enregistré avec le GraphStore (construit par la même étape)
+EDGE_FEATURES_DIR = Path("data/processed/graph_store/features")
+
+FORMAT_VERSION = 1
+
+# === Colonnes numériques de la matrice (NaN = attribut absent)
+NUMERIC_FEATURES = ("distance", "dplus", "grade", "popularity")
+
+FEATURE_ARRAY_NAMES = ("features", "edge_uvk", "uvk_keys", "node_ids", "surface", "highway")
+
+
+class EdgeFeatureStore:
+    """
+    Features des arêtes alignées sur un index dense :
+    - la ligne e (int32) est l'arête e du GraphStore (même ordre CSR),
+    - edge_uvk (E, 3) donne le triplet OSM (u, v, k) de chaque ligne ;
+      index_of() fait l'inverse, par recherche dichotomique sur uvk_keys
+      (rang de u, rang de v, k combinés en un entier croissant),
+    - features (E, F) float32 : distance (m), dplus (m), grade (pente moyenne
+      (D+ - D-) / distance), popularity, puis highway et surface encodés
+      one-hot (colonnes highway=<type>, surface=<type> ; tout à 0 si absent),
+    - surface et highway : codes catégoriels int16 (-1 = absent) pour les
+      modèles qui préfèrent une variable catégorielle.
+
+    Aucun NetworkX : entraînement, scoring et routage lisent les .npy
+    (mappables en mémoire) et indexent les lignes par index d'arête.
+    """
+
+    def __init__(self, arrays, meta, directory=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.meta = meta
+        for name in FEATURE_ARRAY_NAMES:
+            setattr(self, name, np.asarray(arrays[name]))
+        self.feature_names = list(meta["feature_names"])
+        self._columns = {name: i for i, name in enumerate(self.feature_names)}
+
+    @property
+    def n_edges(self):
+        return len(self.edge_uvk)
+
+    @property
+    def graph_version(self):
+        return self.meta["graph_version"]
+
+    @property
+    def surface_labels(self):
+        return self.meta["surface_labels"]
+
+    @property
+    def highway_labels(self):
+        return self.meta["highway_labels"]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in FEATURE_ARRAY_NAMES}
+
+    # === Construction
+    @classmethod
+    def build(cls, store):
+        """Construit les features à partir des colonnes du GraphStore."""
+        n_edges = store.n_edges
+        distance = np.asarray(store.distance, dtype=np.float64)
+        dplus = np.asarray(store.dplus, dtype=np.float64)
+        dminus = np.asarray(store.dminus, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            grade = np.where(distance > 0, (dplus - np.nan_to_num(dminus, nan=0.0)) / distance, np.nan)
+        numeric = {
+            "distance": distance,
+            "dplus": dplus,
+            "grade": grade,
+            "popularity": np.asarray(store.popularity, dtype=np.float64),
+        }
+
+        surface = np.asarray(store.surface, dtype=np.int16)
+        highway = np.asarray(store.highway, dtype=np.int16)
+        feature_names = (list(NUMERIC_FEATURES)
+                         + [f"highway={h}" for h in store.highway_labels]
+                         + [f"surface={s}" for s in store.surface_labels])
+        features = np.zeros((n_edges, len(feature_names)), dtype=np.float32)
+        for i, name in enumerate(NUMERIC_FEATURES):
+            features[:, i] = numeric[name]
+        rows = np.arange(n_edges)
+        start = len(NUMERIC_FEATURES)
+        features[rows[highway >= 0], start + highway[highway >= 0]] = 1.0
+        start += len(store.highway_labels)
+        features[rows[surface >= 0], start + surface[surface >= 0]] = 1.0
+
+        # (rang de u, rang de v, k) → clé entière, croissante dans l'ordre CSR
+        node_ids = np.asarray(store.node_ids, dtype=np.int64)
+        key_base = int(np.max(store.edge_key, initial=0)) + 1
+        uvk_keys = ((np.asarray(store.edge_src, dtype=np.int64) * len(node_ids)
+                     + store.indices) * key_base + store.edge_key)
+
+        arrays = {
+            "features": features,
+            "edge_uvk": store.edge_ids(),
+            "uvk_keys": uvk_keys,
+            "node_ids": node_ids,
+            "surface": surface,
+            "highway": highway,
+        }
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "graph_version": store.version,
+            "n_edges": int(n_edges),
+            "feature_names": feature_names,
+            "key_base": key_base,
+            "surface_labels": list(store.surface_labels),
+            "highway_labels": list(store.highway_labels),
+        }
+        return cls(arrays, meta)
+
+    # === Entrées / sorties
+    def save(self, directory=EDGE_FEATURES_DIR):
+        self.directory = save_arrays(directory, self.arrays(), self.meta)
+        return self.directory
+
+    @classmethod
+    def load(cls, directory=EDGE_FEATURES_DIR, mmap=True, graph_version=None):
+        """
+        Ouvre le feature store ; avec graph_version, vérifie qu'il est aligné
+        sur cette version du GraphStore.
+        """
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"❌ Feature store introuvable ou incomplet : {directory}")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if graph_version is not None and meta["graph_version"] != graph_version:
+            raise ValueError(f"❌ Feature store construit pour le graphe {meta['graph_version']}, "
+                             f"pas {graph_version} : relancer l'étape graph_store de pipeline.py")
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in FEATURE_ARRAY_NAMES}
+        return cls(arrays, meta, directory)
+
+    # === Accès
+    def index_of(self, u, v, k=0):
+        """Triplets OSM (u, v, k) → index d'arête int32 (vectorisé, -1 si absente)."""
+        u, v, k = np.broadcast_arrays(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64),
+                                      np.asarray(k, dtype=np.int64))
+        n_nodes = len(self.node_ids)
+        ru = np.clip(np.searchsorted(self.node_ids, u), 0, n_nodes - 1)
+        rv = np.clip(np.searchsorted(self.node_ids, v), 0, n_nodes - 1)
+        found = (self.node_ids[ru] == u) & (self.node_ids[rv] == v) & (k >= 0) & (k < self.meta["key_base"])
+        keys = (ru * n_nodes + rv) * self.meta["key_base"] + k
+        idx = np.minimum(np.searchsorted(self.uvk_keys, keys), max(self.n_edges - 1, 0))
+        found &= self.uvk_keys[idx] == keys
+        return np.where(found, idx, -1).astype(np.int32)
+
+    def edge_ids(self, edges=None):
+        """Index d'arêtes → triplets (u, v, k), tableau (E, 3)."""
+        return self.edge_uvk if edges is None else self.edge_uvk[edges]
+
+    def column(self, name, edges=None):
+        """Une colonne de la matrice (par nom), pour toutes les arêtes ou celles de edges."""
+        j = self._columns[name]
+        return self.features[:, j] if edges is None else self.features[edges, j]
+
+    def matrix(self, edges=None, names=None):
+        """Sous-matrice float32 (lignes edges, colonnes names), prête pour l'entraînement ou le scoring."""
+        rows = slice(None) if edges is None else np.asarray(edges)
+        if names is None:
+            return self.features[rows]
+        return self.features[rows][:, [self._columns[name] for name in names]]
@@ -1,126 +1,216 @@
 import os
-import gpxpy
-import pickle
+import sys
+import argparse
 from pathlib import Path
-from typing import List, Tuple
-from math import radians, sin, cos, sqrt, atan2
-from datetime import datetime
-import networkx as nx
-from scipy.spatial import KDTree
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+try:
+    from lxml import etree
+except ImportError:  # lxml absent : parseur en flux de la bibliothèque standard
+    import xml.etree.ElementTree as etree
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.snap_index import EdgeSnapIndex, SNAP_INDEX_DIR
+from src.data_collection.gap_filler import GapFiller
+from src.data_collection.trace_store import Trace, TraceStore, CLEAN_TRACES_DIR, CHUNK_TRACES
+from src.utils.geo import haversine_m
+from src.utils.workers import default_workers
 
 # === PARAMÈTRES ===
 MIN_POINTS = 10
 MAX_SPEED_KMH = 50
 MAX_GAP = 300  # mètres
 MAX_NODE_MATCH_DIST = 100  # mètres
-INTERPOLATION_DIST = 20  # mètres entre points
 BOUNDING_BOX = {
     "min_lon": 2.18865,
     "max_lon": 3.411287,
     "min_lat": 48.145309,
     "max_lat": 48.954693
 }
+N_WORKERS = default_workers()
 
 # === DOSSIERS ===
 INPUT_DIR = Path("data/gpx")
-OUTPUT_DIR = Path("data/gpx_clean")
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-# === CHARGEMENT DU GRAPHE ===
-GRAPH_PATH = "data/processed/graph_with_strava_and_dplus.gpickle"
-with open(GRAPH_PATH, "rb") as f:
-    G = pickle.load(f)
-
-node_coords = [(data["y"], data["x"]) for _, data in G.nodes(data=True)]
-node_list = list(G.nodes)
-kd_tree = KDTree(node_coords)
-
-# === UTILS ===
-def haversine(coord1, coord2):
-    R = 6371000
-    lat1, lon1 = coord1
-    lat2, lon2 = coord2
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
-def find_nearest_node(coord):
-    dist, idx = kd_tree.query(coord)
-    node_coord = node_coords[idx]
-    dist_m = haversine(coord, node_coord)
-    if dist_m > MAX_NODE_MATCH_DIST:
-        return None
-    return node_list[idx]
-
-def interpolate_linearly(p1, p2, step=INTERPOLATION_DIST):
-    lat1, lon1 = p1
-    lat2, lon2 = p2
-    distance = haversine(p1, p2)
-    if distance <= step:
-        return []
-    n = int(distance // step)
-    return [(lat1 + (lat2 - lat1) * i / n, lon1 + (lon2 - lon1) * i / n) for i in range(1, n)]
-
-def interpolate_segment(p1, p2):
-    n_start = find_nearest_node(p1)
-    n_end = find_nearest_node(p2)
-    if n_start is None or n_end is None:
-        print(f"⚠️ Aucun nœud proche : fallback interpolation")
-        return interpolate_linearly(p1, p2)
-    try:
-        path = nx.shortest_path(G, n_start, n_end, weight='length')
-        return [(G.nodes[n]['y'], G.nodes[n]['x']) for n in path[1:-1]]
-    except nx.NetworkXNoPath:
-        print(f"❌ Pas de chemin entre {p1} → {p2} : fallback interpolation")
-        return interpolate_linearly(p1, p2)
-
-def clean_trace(points: List[Tuple[Tuple[float, float], datetime]]) -> List[Tuple[float, float]]:
-    cleaned = []
-    for i, (pt, time) in enumerate(points):
-        if not cleaned:
-            cleaned.append((pt, time))
+
+# === État propre à chaque processus worker (initialisé par load_graph, lu par process_file)
+_worker = {}
+
+
+def load_graph(store_dir=GRAPH_STORE_DIR, snap_dir=SNAP_INDEX_DIR, verbose=False):
+    """GraphStore et index d'accrochage mappés en mémoire (pages partagées entre workers)."""
+    _worker["verbose"] = verbose
+    store = GraphStore.load(store_dir)
+    # Comblement des sauts : plus court chemin en distance, borné et mémorisé
+    _worker["gap_filler"] = GapFiller(store, EdgeSnapIndex.load(snap_dir), max_snap_distance=MAX_NODE_MATCH_DIST)
+
+
+# === LECTURE GPX EN FLUX ===
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def read_gpx(path):
+    """
+    Points de trace (trkpt) d'un fichier GPX, lus en flux (iterparse) sans
+    construire l'arbre complet. Renvoie (lat, lon, t) : tableaux numpy, t en
+    secondes (NaN si l'horodatage est absent).
+    """
+    lat, lon, times = [], [], []
+    for _, elem in etree.iterparse(str(path), events=("end",)):
+        if _local_name(elem.tag) != "trkpt":
             continue
-        dist = haversine(cleaned[-1][0], pt)
-        if time and cleaned[-1][1]:
-            dt = (time - cleaned[-1][1]).total_seconds()
-            speed = dist / dt * 3.6 if dt > 0 else 0
-        else:
-            speed = 0
-        if dist < MAX_GAP and speed < MAX_SPEED_KMH:
-            cleaned.append((pt, time))
-        elif dist >= MAX_GAP:
-            print(f"🚨 Saut de {int(dist)} m entre {cleaned[-1][0]} → {pt}")
-            interpolated = interpolate_segment(cleaned[-1][0], pt)
-            cleaned.extend([(p, None) for p in interpolated])
-            cleaned.append((pt, time))
-    return [pt for pt, _ in cleaned]
+        lat.append(float(elem.get("lat")))
+        lon.append(float(elem.get("lon")))
+        times.append(next((child.text for child in elem if _local_name(child.tag) == "time"), None))
+        # Libère le point lu (et, avec lxml, les points précédents)
+        elem.clear()
+        if hasattr(elem, "getprevious"):
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    t = pd.to_datetime(pd.Series(times, dtype=object), utc=True, errors="coerce", format="ISO8601")
+    seconds = (t - pd.Timestamp(0, tz="UTC")).dt.total_seconds().to_numpy(dtype=np.float64)
+    return np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), seconds
+
+
+# === NETTOYAGE VECTORISÉ ===
+def in_bounding_box(lat, lon, bbox=None):
+    bbox = bbox or BOUNDING_BOX
+    return ((lat >= bbox["min_lat"]) & (lat <= bbox["max_lat"]) &
+            (lon >= bbox["min_lon"]) & (lon <= bbox["max_lon"]))
+
+def acceptable(lat, lon, t, a, b):
+    """
+    Le point b peut suivre le point a : saut (distance >= MAX_GAP, comblé
+    ensuite) ou vitesse sous MAX_SPEED_KMH (0 sans horodatage). Vectorisé.
+    """
+    dist = haversine_m(lon[a], lat[a], lon[b], lat[b])
+    dt = t[b] - t[a]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, dist / dt * 3.6, 0.0)
+    return (dist >= MAX_GAP) | (np.nan_to_num(speed, nan=0.0) < MAX_SPEED_KMH)
+
+def drop_speed_outliers(lat, lon, t, window=256):
+    """
+    Index des points gardés, chaque point étant comparé au dernier point gardé
+    (pics de vitesse écartés). Les paires consécutives acceptables sont
+    validées en bloc ; après un point trop rapide, le point gardé suivant est
+    cherché par fenêtres vectorisées depuis le dernier point gardé.
+    """
+    n = len(lat)
+    idx = np.arange(n)
+    if n < 2:
+        return idx
+    bad = np.flatnonzero(~acceptable(lat, lon, t, idx[:-1], idx[1:]))
+    if not len(bad):
+        return idx
+
+    keep, j = [], 0
+    while j < n:
+        pos = np.searchsorted(bad, j)
+        if pos == len(bad):
+            keep.append(idx[j:])
+            break
+        k = bad[pos]
+        keep.append(idx[j:k + 1])
+        # k est gardé, k + 1 ne peut pas le suivre : premier point acceptable après k
+        j = n
+        for start in range(k + 2, n, window):
+            candidates = idx[start:start + window]
+            found = np.flatnonzero(acceptable(lat, lon, t, k, candidates))
+            if len(found):
+                j = int(candidates[found[0]])
+                break
+    return np.concatenate(keep)
+
+def clean_trace(lat, lon, t, gap_filler, verbose=False):
+    """
+    Trace nettoyée (lat, lon, t) : points hors emprise retirés, pics de
+    vitesse écartés, sauts de plus de MAX_GAP comblés par le plus court chemin
+    sur le graphe (gap_filler : GapFiller, interpolation linéaire à défaut) ;
+    les points ajoutés n'ont pas d'horodatage (NaN).
+    """
+    inside = in_bounding_box(lat, lon)
+    lat, lon, t = lat[inside], lon[inside], t[inside]
+    if len(lat) == 0:
+        return lat, lon, t
+    keep = drop_speed_outliers(lat, lon, t)
+    lat, lon, t = lat[keep], lon[keep], t[keep]
+
+    dist = haversine_m(lon[:-1], lat[:-1], lon[1:], lat[1:])
+    gaps = np.flatnonzero(dist >= MAX_GAP)
+    if not len(gaps):
+        return lat, lon, t
+
+    # Tous les sauts de la trace comblés en un appel
+    pairs = [((lat[i], lon[i]), (lat[i + 1], lon[i + 1])) for i in gaps.tolist()]
+    if verbose:
+        for i, (p1, p2) in zip(gaps.tolist(), pairs):
+            print(f"🚨 Saut de {int(dist[i])} m entre {p1} → {p2}")
+    fills = gap_filler.fill_many(pairs)
+
+    # Points comblés insérés après le point précédant chaque saut
+    fill_points = np.array([p for fill in fills for p in fill], dtype=np.float64).reshape(-1, 2)
+    at = np.repeat(gaps + 1, [len(fill) for fill in fills])
+    return (np.insert(lat, at, fill_points[:, 0]),
+            np.insert(lon, at, fill_points[:, 1]),
+            np.insert(t, at, np.nan))
+
 
 # === TRAITEMENT GPX ===
-for gpx_file in INPUT_DIR.glob("*.gpx"):
-    print(f"\n🔄 Traitement {gpx_file.name}")
-    with open(gpx_file, "r") as f:
-        gpx = gpxpy.parse(f)
-
-    all_points = []
-    for track in gpx.tracks:
-        for segment in track.segments:
-            for point in segment.points:
-                if (BOUNDING_BOX["min_lat"] <= point.latitude <= BOUNDING_BOX["max_lat"] and
-                    BOUNDING_BOX["min_lon"] <= point.longitude <= BOUNDING_BOX["max_lon"]):
-                    all_points.append(((point.latitude, point.longitude), point.time))
-
-    if len(all_points) < MIN_POINTS:
-        print("⛔ Trop peu de points")
-        continue
-
-    cleaned_trace = clean_trace(all_points)
-    if len(cleaned_trace) < MIN_POINTS:
-        print("⛔ Trace nettoyée trop courte")
-        continue
-
-    out_path = OUTPUT_DIR / f"{gpx_file.stem}_cleaned.pkl"
-    with open(out_path, "wb") as f:
-        pickle.dump(cleaned_trace, f)
-    print(f"✅ Sauvegardé : {out_path.name} ({len(cleaned_trace)} points)")
+def process_file(gpx_file):
+    """Lit et nettoie une trace ; renvoie (nom, Trace ou None, message)."""
+    name = gpx_file.stem
+    lat, lon, t = read_gpx(gpx_file)
+    if in_bounding_box(lat, lon).sum() < MIN_POINTS:
+        return name, None, "⛔ Trop peu de points"
+
+    lat, lon, t = clean_trace(lat, lon, t, _worker["gap_filler"], _worker["verbose"])
+    if len(lat) < MIN_POINTS:
+        return name, None, "⛔ Trace nettoyée trop courte"
+    return name, Trace(name, lat, lon, t), f"✅ Nettoyée ({len(lat)} points)"
+
+
+def main(n_workers=N_WORKERS, verbose=False, store_dir=GRAPH_STORE_DIR, snap_dir=SNAP_INDEX_DIR,
+         traces_dir=CLEAN_TRACES_DIR):
+    store = TraceStore(traces_dir)
+    files = [f for f in sorted(INPUT_DIR.glob("*.gpx")) if f.stem not in store]
+    print(f"🔄 {len(files)} fichiers GPX à traiter ({n_workers} processus)")
+    if not files:
+        return
+
+    if n_workers <= 1 or len(files) <= 1:
+        load_graph(store_dir, snap_dir, verbose)
+        results = map(process_file, files)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=load_graph,
+                                   initargs=(str(store_dir), str(snap_dir), verbose))
+        results = pool.map(process_file, files, chunksize=max(1, len(files) // (n_workers * 4)))
+    batch = []
+    try:
+        for name, trace, message in results:
+            print(f"{name} : {message}")
+            if trace is not None:
+                batch.append(trace)
+            if len(batch) >= CHUNK_TRACES:
+                store.append(batch)
+                batch = []
+    finally:
+        if batch:
+            store.append(batch)
+        if pool is not None:
+            pool.shutdown()
+    print(f"💾 {len(store)} traces nettoyées dans {traces_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nettoyage des traces GPX et comblement des sauts")
+    parser.add_argument("--jobs", type=int, default=N_WORKERS, help="processus de traitement des traces")
+    parser.add_argument("--verbose", action="store_true", help="affiche chaque saut comblé")
+    args = parser.parse_args()
+    main(n_workers=args.jobs, verbose=args.verbose)
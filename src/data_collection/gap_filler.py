@@ -0,0 +1,183 @@
+# src/data_collection/gap_filler.py
+
+import os
+import sys
+import math
+import heapq
+from collections import OrderedDict
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.routing.pathfinding import edge_distances, HEURISTIC_SCALE
+from src.utils.geo import EARTH_RADIUS_M, haversine_m
+
+DETOUR_FACTOR = 2.0        # chemin de comblement au plus 2 × le saut à vol d'oiseau
+MAX_SNAP_DISTANCE = 100.0  # m, accrochage des extrémités du saut au graphe
+INTERPOLATION_DIST = 20.0  # m entre points de l'interpolation linéaire de secours
+CACHE_SIZE = 50000         # paires de nœuds mémorisées (par processus)
+
+
+def interpolate_linearly(p1, p2, step=INTERPOLATION_DIST):
+    """Points intermédiaires (lat, lon) tous les step mètres entre p1 et p2 exclus."""
+    lat1, lon1 = p1
+    lat2, lon2 = p2
+    distance = float(haversine_m(lon1, lat1, lon2, lat2))
+    if distance <= step:
+        return []
+    n = int(distance // step)
+    return [(lat1 + (lat2 - lat1) * i / n, lon1 + (lon2 - lon1) * i / n) for i in range(1, n)]
+
+
+class GapFiller:
+    """
+    Comblement des sauts d'une trace GPS par le plus court chemin (en
+    distance) sur le GraphStore :
+    - extrémités accrochées en un seul appel vectorisé à l'index d'accrochage,
+    - A* sur l'adjacence CSR, sans tableau de la taille du graphe : la
+      recherche est bornée à DETOUR_FACTOR × longueur du saut (les nœuds dont
+      distance parcourue + vol d'oiseau restant dépasse la borne ne sont pas
+      développés), son coût ne dépend donc pas de la taille du graphe,
+    - résultats mémorisés par paire de nœuds (LRU), réutilisés d'une trace à
+      l'autre dans un même processus,
+    - fill_many() traite tous les sauts d'une trace en un appel.
+
+    Le chemin est rendu en sommets des géométries d'arêtes (lat, lon), sans
+    les nœuds accrochés aux deux extrémités du saut ; interpolation linéaire
+    à défaut d'accrochage ou de chemin dans la borne. La recherche lit les
+    tableaux du store mappé en mémoire par des memoryview (pas de copie par
+    processus).
+    """
+
+    def __init__(self, store, snap_index, detour_factor=DETOUR_FACTOR,
+                 max_snap_distance=MAX_SNAP_DISTANCE, cache_size=CACHE_SIZE):
+        self.store = store
+        self.snap_index = snap_index
+        self.detour_factor = detour_factor
+        self.max_snap_distance = max_snap_distance
+        self.cache_size = cache_size
+        self.cache = OrderedDict()   # (source, cible) → (borne utilisée, arêtes ou None)
+        self.stats = {"hits": 0, "misses": 0, "fallbacks": 0}
+
+        self.lon = np.asarray(store.node_x, dtype=np.float64)
+        self.lat = np.asarray(store.node_y, dtype=np.float64)
+        self.geom_coords = np.asarray(store.geom_coords)
+        self.geom_offsets = np.asarray(store.geom_offsets)
+
+        # Vues scalaires pour la boucle de relaxation (sans copie du store)
+        self._indptr = memoryview(np.ascontiguousarray(store.indptr))
+        self._indices = memoryview(np.ascontiguousarray(store.indices))
+        self._edge_src = memoryview(np.ascontiguousarray(store.edge_src))
+        self._distance = memoryview(edge_distances(store))
+        self._rad_lon = memoryview(np.radians(self.lon))
+        self._rad_lat = memoryview(np.radians(self.lat))
+
+    # === Recherche bornée
+    def _astar(self, source, target, max_length):
+        """Arêtes du plus court chemin source → target de longueur <= max_length, ou None."""
+        indptr, indices, distance = self._indptr, self._indices, self._distance
+        rad_lon, rad_lat = self._rad_lon, self._rad_lat
+        lon_t, lat_t = rad_lon[target], rad_lat[target]
+        cos_t = math.cos(lat_t)
+        scale = HEURISTIC_SCALE * EARTH_RADIUS_M * 2
+        sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+
+        def h(v):
+            a = sin((rad_lat[v] - lat_t) / 2) ** 2 + cos(rad_lat[v]) * cos_t * sin((rad_lon[v] - lon_t) / 2) ** 2
+            return scale * asin(sqrt(min(a, 1.0)))
+
+        dist, pred, settled = {source: 0.0}, {}, set()
+        heap = [(h(source), source)]
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == target:
+                edges, v = [], target
+                while v != source:
+                    e = pred[v]
+                    edges.append(e)
+                    v = self._edge_src[e]
+                edges.reverse()
+                return edges
+            settled.add(u)
+            d = dist[u]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + distance[e]
+                if nd < dist.get(v, math.inf):
+                    f = nd + h(v)
+                    if f > max_length:
+                        continue
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (f, v))
+        return None
+
+    def path(self, source, target, max_length):
+        """Arêtes du chemin mémorisé ou calculé (None si aucun dans la borne)."""
+        key = (source, target)
+        entry = self.cache.get(key)
+        # Un chemin trouvé vaut pour toute borne ; une absence, pour les bornes plus courtes
+        if entry is not None and (entry[1] is not None or entry[0] >= max_length):
+            self.cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+        self.stats["misses"] += 1
+        edges = [] if source == target else self._astar(source, target, max_length)
+        self.cache[key] = (max_length, edges)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return edges
+
+    # === Comblement
+    def _edge_points(self, edges):
+        """
+        Sommets (lat, lon) des géométries du chemin, nœuds de départ et
+        d'arrivée exclus (ce sont les points accrochés, pas des points de trace).
+        """
+        points = []
+        for e in edges:
+            coords = self.geom_coords[self.geom_offsets[e]:self.geom_offsets[e + 1]]
+            if len(coords) < 2:
+                v = self._indices[e]
+                coords = np.array([[self.lon[v], self.lat[v]]])
+            else:
+                coords = coords[1:]
+            points.extend((float(lat), float(lon)) for lon, lat in coords)
+        return points[:-1]
+
+    def fill_many(self, gaps):
+        """
+        Points intermédiaires de chaque saut ((lat1, lon1), (lat2, lon2)) :
+        une liste de (lat, lon) par saut, extrémités du saut exclues.
+        """
+        if not gaps:
+            return []
+        ends = np.asarray(gaps, dtype=np.float64).reshape(-1, 2, 2)   # saut, extrémité, (lat, lon)
+        lat, lon = ends[:, :, 0].ravel(), ends[:, :, 1].ravel()
+        nodes = self.snap_index.nearest_nodes(self.store, lon, lat, self.max_snap_distance).reshape(-1, 2)
+        found = nodes >= 0
+        snap = np.zeros(len(lat))
+        snap[found.ravel()] = haversine_m(lon[found.ravel()], lat[found.ravel()],
+                                          self.lon[nodes[found]], self.lat[nodes[found]])
+        snap = snap.reshape(-1, 2)
+        gap = haversine_m(ends[:, 0, 1], ends[:, 0, 0], ends[:, 1, 1], ends[:, 1, 0])
+
+        filled = []
+        for i, (p1, p2) in enumerate(gaps):
+            edges = None
+            if found[i].all():
+                source, target = int(nodes[i, 0]), int(nodes[i, 1])
+                max_length = self.detour_factor * gap[i] + snap[i].sum()
+                edges = self.path(source, target, max_length)
+            if edges is None:
+                self.stats["fallbacks"] += 1
+                filled.append(interpolate_linearly(p1, p2))
+            else:
+                filled.append(self._edge_points(edges))
+        return filled
+
+    def fill(self, p1, p2):
+        return self.fill_many([(p1, p2)])[0]
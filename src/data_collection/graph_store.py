@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import hashlib
+import pickle
+from pathlib import Path
+import numpy as np
+import networkx as nx
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.utils.geo import flatten_geometries, build_linestrings
+from src.data_collection.snap_index import EdgeSnapIndex
+from src.data_collection.edge_features import EdgeFeatureStore
+from src.utils.array_io import save_arrays
+
+# === Chemins par défaut ===
+GRAPH_INPUT = Path("data/processed/graph_with_strava_and_dplus.gpickle")
+GRAPH_STORE_DIR = Path("data/processed/graph_store")
+
+FORMAT_VERSION = 2
+
+# === Attributs numériques des arêtes (NaN = absent)
+EDGE_FLOAT_ATTRS = ("distance", "dplus", "dminus", "popularity")
+
+# === Tableaux écrits sur disque (un .npy par tableau, mappables en mémoire)
+ARRAY_NAMES = (
+    "node_ids", "node_x", "node_y",
+    "indptr", "indices", "edge_src", "edge_key",
+    *EDGE_FLOAT_ATTRS, "surface", "highway",
+    "geom_offsets", "geom_coords",
+)
+
+
+class GraphStore:
+    """
+    Graphe routier au format colonnaire :
+    - nœuds triés par identifiant OSM (node_ids, node_x, node_y),
+    - adjacence CSR (indptr, indices) ; l'arête e va de edge_src[e] à indices[e],
+      sa clé de multigraphe est edge_key[e],
+    - un tableau typé par attribut d'arête (distance, dplus, dminus, popularity,
+      surface et highway codés selon surface_labels / highway_labels),
+    - géométries aplaties (geom_coords[geom_offsets[e]:geom_offsets[e + 1]]).
+
+    L'index e d'une arête remplace le tuple edge_id (u, v, k) du graphe pickle :
+    edge_ids() renvoie les triplets correspondants.
+    """
+
+    def __init__(self, arrays, meta, directory=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.meta = meta
+        self.node_ids = arrays["node_ids"]
+        self.node_x = arrays["node_x"]
+        self.node_y = arrays["node_y"]
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.edge_src = arrays["edge_src"]
+        self.edge_key = arrays["edge_key"]
+        self.distance = arrays["distance"]
+        self.dplus = arrays["dplus"]
+        self.dminus = arrays["dminus"]
+        self.popularity = arrays["popularity"]
+        self.surface = arrays["surface"]
+        self.highway = arrays["highway"]
+        self.geom_offsets = arrays["geom_offsets"]
+        self.geom_coords = arrays["geom_coords"]
+        self._pair_keys = None   # clés (source, destination) de edge_index(), calculées au premier appel
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    @property
+    def version(self):
+        """Empreinte du contenu, change à chaque nouvel artefact."""
+        return self.meta["version"]
+
+    @property
+    def surface_labels(self):
+        return self.meta["surface_labels"]
+
+    @property
+    def highway_labels(self):
+        return self.meta["highway_labels"]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    # === Construction ===
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Convertit un MultiDiGraph osmnx (enrichi ou non) en GraphStore.
+        """
+        node_ids = np.array(sorted(G.nodes), dtype=np.int64)
+        node_x = np.array([G.nodes[n]["x"] for n in node_ids], dtype=np.float64)
+        node_y = np.array([G.nodes[n]["y"] for n in node_ids], dtype=np.float64)
+
+        edges = list(G.edges(keys=True, data=True)) if G.is_multigraph() else [
+            (u, v, 0, d) for u, v, d in G.edges(data=True)
+        ]
+        n_edges = len(edges)
+        src = np.searchsorted(node_ids, np.array([u for u, _, _, _ in edges], dtype=np.int64))
+        dst = np.searchsorted(node_ids, np.array([v for _, v, _, _ in edges], dtype=np.int64))
+        keys = np.array([k for _, _, k, _ in edges], dtype=np.int32)
+
+        # Tri CSR : par nœud source, puis destination, puis clé
+        order = np.lexsort((keys, dst, src))
+        edges = [edges[i] for i in order]
+        src, dst, keys = src[order], dst[order], keys[order]
+
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(node_ids)), out=indptr[1:])
+
+        arrays = {
+            "node_ids": node_ids,
+            "node_x": node_x,
+            "node_y": node_y,
+            "indptr": indptr,
+            "indices": dst.astype(np.int32),
+            "edge_src": src.astype(np.int32),
+            "edge_key": keys,
+        }
+        for attr in EDGE_FLOAT_ATTRS:
+            values = np.full(n_edges, np.nan, dtype=np.float32)
+            for i, (_, _, _, d) in enumerate(edges):
+                val = d.get(attr)
+                if val is not None:
+                    values[i] = val
+            arrays[attr] = values
+
+        surfaces = [d.get("surface") for _, _, _, d in edges]
+        labels = sorted({s for s in surfaces if isinstance(s, str)})
+        codes = {s: i for i, s in enumerate(labels)}
+        arrays["surface"] = np.array([codes.get(s, -1) for s in surfaces], dtype=np.int16)
+
+        # Type de voie OSM (premier de la liste si l'arête en fusionne plusieurs)
+        highways = [d.get("highway") for _, _, _, d in edges]
+        highways = [h[0] if isinstance(h, list) and h else h for h in highways]
+        highway_labels = sorted({h for h in highways if isinstance(h, str)})
+        codes = {h: i for i, h in enumerate(highway_labels)}
+        arrays["highway"] = np.array([codes.get(h, -1) for h in highways], dtype=np.int16)
+
+        coords, offsets = flatten_geometries([d.get("geometry") for _, _, _, d in edges])
+        arrays["geom_coords"] = coords
+        arrays["geom_offsets"] = offsets
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "crs": str(G.graph.get("crs", "epsg:4326")),
+            "n_nodes": int(len(node_ids)),
+            "n_edges": int(n_edges),
+            "surface_labels": labels,
+            "highway_labels": highway_labels,
+        }
+        meta["version"] = _content_hash(arrays, meta)
+        return cls(arrays, meta)
+
+    # === Entrées / sorties ===
+    def save(self, directory=GRAPH_STORE_DIR):
+        """
+        Écrit un .npy par tableau puis meta.json (écrit en dernier : sa présence
+        signale un artefact complet).
+        """
+        self.directory = save_arrays(directory, self.arrays(), self.meta)
+        return self.directory
+
+    @classmethod
+    def load(cls, directory=GRAPH_STORE_DIR, mmap=True):
+        """
+        Ouvre un GraphStore. Avec mmap=True, les tableaux sont projetés en mémoire
+        en lecture seule : l'ouverture est quasi instantanée et les pages sont
+        partagées entre processus.
+        """
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"❌ GraphStore introuvable ou incomplet : {directory}")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"❌ GraphStore au format {meta.get('format_version')} (attendu {FORMAT_VERSION}) : "
+                             f"relancer l'étape graph_store de pipeline.py")
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(arrays, meta, directory)
+
+    # === Accès ===
+    def node_index(self, node_ids):
+        """Identifiants OSM → index de nœuds (-1 si absent)."""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        idx = np.searchsorted(self.node_ids, node_ids)
+        idx = np.clip(idx, 0, self.n_nodes - 1)
+        return np.where(self.node_ids[idx] == node_ids, idx, -1)
+
+    def out_edges(self, node_idx):
+        """Index des arêtes sortantes d'un nœud (tranche CSR)."""
+        return np.arange(self.indptr[node_idx], self.indptr[node_idx + 1])
+
+    def edge_ids(self, edges=None):
+        """Triplets (u, v, k) OSM des arêtes, sous forme de tableau (E, 3)."""
+        if edges is None:
+            edges = slice(None)
+        return np.column_stack((
+            self.node_ids[self.edge_src[edges]],
+            self.node_ids[self.indices[edges]],
+            self.edge_key[edges].astype(np.int64),
+        ))
+
+    def edge_index(self, u, v):
+        """
+        Index de l'arête u → v (index de nœuds, vectorisé ; plus petite clé
+        si parallèles, -1 si absente). L'ordre CSR (source, destination, clé)
+        rend la clé source × n_nodes + destination croissante : une recherche
+        dichotomique remplace la table de hachage (u, v) → arête.
+        """
+        if self._pair_keys is None:
+            self._pair_keys = np.asarray(self.edge_src, dtype=np.int64) * self.n_nodes + self.indices
+        u, v = np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64)
+        keys = u * self.n_nodes + v
+        idx = np.searchsorted(self._pair_keys, keys)
+        idx = np.minimum(idx, max(self.n_edges - 1, 0))
+        found = (u >= 0) & (v >= 0) & (self._pair_keys[idx] == keys)
+        return np.where(found, idx, -1)
+
+    def edge_geometry_arrays(self, fill_missing=True):
+        """
+        Renvoie (coords, offsets) des géométries. Avec fill_missing, une arête
+        sans géométrie reçoit le segment droit entre ses deux nœuds.
+        """
+        coords, offsets = self.geom_coords, self.geom_offsets
+        counts = np.diff(offsets)
+        missing = counts < 2
+        if not fill_missing or not missing.any():
+            return coords, offsets
+
+        counts = np.where(missing, 2, counts)
+        new_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=new_offsets[1:])
+        new_coords = np.empty((new_offsets[-1], 2), dtype=np.float64)
+
+        kept = np.repeat(~missing, counts)
+        new_coords[kept] = coords[np.repeat(~missing, np.diff(offsets))]
+        starts = new_offsets[:-1][missing]
+        src, dst = self.edge_src[missing], self.indices[missing]
+        new_coords[starts] = np.column_stack((self.node_x[src], self.node_y[src]))
+        new_coords[starts + 1] = np.column_stack((self.node_x[dst], self.node_y[dst]))
+        return new_coords, new_offsets
+
+    def surface_names(self):
+        """Surfaces décodées (None si absente)."""
+        labels = np.array(list(self.surface_labels) + [None], dtype=object)
+        return labels[self.surface]
+
+    def highway_names(self):
+        """Types de voie décodés (None si absent)."""
+        labels = np.array(list(self.highway_labels) + [None], dtype=object)
+        return labels[self.highway]
+
+    def to_networkx(self):
+        """
+        Reconstruit un MultiDiGraph osmnx à partir des tableaux (à réserver aux
+        usages qui ont vraiment besoin de NetworkX : tracés osmnx, etc.).
+        """
+        G = nx.MultiDiGraph(crs=self.meta.get("crs"))
+        G.add_nodes_from(
+            (int(n), {"x": float(x), "y": float(y)})
+            for n, x, y in zip(self.node_ids, self.node_x, self.node_y)
+        )
+        ids = self.edge_ids()
+        geoms = build_linestrings(self.geom_coords, self.geom_offsets)
+        surfaces = self.surface_names()
+        highways = self.highway_names()
+        columns = {attr: getattr(self, attr) for attr in EDGE_FLOAT_ATTRS}
+        for e, (u, v, k) in enumerate(ids.tolist()):
+            data = {"edge_id": (u, v, k)}
+            for attr, values in columns.items():
+                if not np.isnan(values[e]):
+                    data[attr] = float(values[e])
+            if surfaces[e] is not None:
+                data["surface"] = surfaces[e]
+            if highways[e] is not None:
+                data["highway"] = highways[e]
+            if geoms[e] is not None:
+                data["geometry"] = geoms[e]
+            G.add_edge(u, v, key=k, **data)
+        return G
+
+
+def _content_hash(arrays, meta):
+    h = hashlib.sha256()
+    for name in ARRAY_NAMES:
+        h.update(name.encode())
+        h.update(np.ascontiguousarray(arrays[name]).tobytes())
+    h.update(json.dumps(meta, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def export_graph_store(graph_path=GRAPH_INPUT, store_dir=GRAPH_STORE_DIR):
+    """Convertit un graphe .gpickle en GraphStore."""
+    print(f"📥 Chargement du graphe : {graph_path}")
+    with open(graph_path, "rb") as f:
+        G = pickle.load(f)
+
+    store = GraphStore.from_networkx(G)
+    store.save(store_dir)
+    print(f"💾 GraphStore écrit : {store_dir} ({store.n_nodes} nœuds, {store.n_edges} arêtes, version {store.version})")
+
+    # Index d'accrochage aux arêtes, enregistré avec le store
+    snap_index = EdgeSnapIndex.build(store)
+    snap_index.save(Path(store_dir) / "snap")
+    print(f"💾 Index d'accrochage écrit : {Path(store_dir) / 'snap'} ({len(snap_index.seg_edge)} segments)")
+
+    # Features des arêtes alignées sur l'index du store
+    features = EdgeFeatureStore.build(store)
+    features.save(Path(store_dir) / "features")
+    print(f"💾 Feature store écrit : {Path(store_dir) / 'features'} ({len(features.feature_names)} features)")
+    return store
+
+
+if __name__ == "__main__":
+    export_graph_store()
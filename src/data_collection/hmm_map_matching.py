@@ -0,0 +1,325 @@
+# src/data_collection/hmm_map_matching.py
+
+import os
+import sys
+import math
+import time
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.snap_index import EdgeSnapIndex, SNAP_INDEX_DIR
+from src.data_collection.trace_store import Trace, TraceStore, CLEAN_TRACES_DIR, HMM_TRACES_DIR, CHUNK_TRACES
+from src.routing.pathfinding import edge_distances
+from src.utils.geo import haversine_m
+from src.utils.workers import default_workers
+
+# === Modèle de Markov caché (Newson & Krumm, 2009)
+SIGMA_Z = 10.0              # écart-type du bruit GPS (m) : probabilité d'émission
+BETA = 30.0                 # échelle de |distance routière - vol d'oiseau| (m) : probabilité de transition
+SEARCH_RADIUS = 50.0        # rayon de recherche des arêtes candidates (m)
+MAX_CANDIDATES = 6          # routes candidates gardées par point (les plus proches, tous sens et arêtes parallèles)
+MIN_SPACING = 2 * SIGMA_Z   # un point plus proche que cela du précédent retenu est ignoré (m)
+MAX_ROUTE_FACTOR = 3.0      # distance routière max = facteur × vol d'oiseau + 2 rayons
+
+N_WORKERS = default_workers()
+
+# === Matcher propre à chaque processus worker
+_worker = {}
+
+
+class HMMMatcher:
+    """
+    Map matching d'une trace GPS sur le GraphStore par modèle de Markov caché :
+    - états : arêtes candidates de chaque point (index d'accrochage, dans
+      SEARCH_RADIUS), avec leur abscisse le long de l'arête ; seules les
+      arêtes des MAX_CANDIDATES routes les plus proches sont gardées, une
+      route regroupant les deux sens et les arêtes parallèles entre deux
+      mêmes nœuds,
+    - émission : gaussienne de la distance point → arête,
+    - transition : exponentielle de l'écart entre distance routière (abscisses
+      + plus court chemin borné entre les deux arêtes) et distance à vol
+      d'oiseau entre les deux points,
+    - décodage de Viterbi, vectorisé point par point (matrice candidats ×
+      candidats).
+
+    Quand aucune transition n'est possible, le point est repris avec toutes
+    ses arêtes candidates ; s'il n'y en a toujours aucune, la trace est
+    coupée et le décodage reprend à ce point. Le résultat est directement la séquence
+    d'arêtes du store parcourues, chemins intermédiaires compris.
+    """
+
+    def __init__(self, store, snap_index):
+        if snap_index.meta.get("graph_version") != store.version:
+            raise ValueError("❌ Index d'accrochage construit pour une autre version du graphe")
+        self.store = store
+        self.snap_index = snap_index
+        self.edge_length = np.asarray(snap_index.edge_length, dtype=np.float64)
+        self.edge_src = np.asarray(store.edge_src, dtype=np.int64)
+        self.edge_dst = np.asarray(store.indices, dtype=np.int64)
+
+        # Listes Python pour la boucle de relaxation (accès scalaire rapide)
+        self._indptr = np.asarray(store.indptr).tolist()
+        self._indices = self.edge_dst.tolist()
+        self._edge_src = self.edge_src.tolist()
+        self._distance = edge_distances(store).tolist()
+
+    @classmethod
+    def load(cls, store_dir=GRAPH_STORE_DIR, snap_dir=SNAP_INDEX_DIR):
+        return cls(GraphStore.load(store_dir), EdgeSnapIndex.load(snap_dir))
+
+    # === Pré-traitement
+    @staticmethod
+    def _resample(lat, lon):
+        """Index des points gardés : chacun à plus de MIN_SPACING (m) le long de la trace du précédent."""
+        steps = haversine_m(lon[:-1], lat[:-1], lon[1:], lat[1:]).tolist()
+        keep, walked = [0], 0.0
+        for i, step in enumerate(steps, start=1):
+            walked += step
+            if walked > MIN_SPACING:
+                keep.append(i)
+                walked = 0.0
+        return np.asarray(keep, dtype=np.int64)
+
+    def _candidates(self, lat, lon):
+        """
+        Candidats (point, arête, abscisse, log-émission), triés par point puis
+        distance, et masque des candidats dans les MAX_CANDIDATES routes les
+        plus proches de leur point.
+        """
+        points, edges, offsets, dists = self.snap_index.within(lon, lat, SEARCH_RADIUS)
+        bounds = np.searchsorted(points, np.arange(len(lat) + 1))
+
+        # Route = paire non orientée de nœuds ; son rang dans le point est celui
+        # de sa candidate la plus proche (première occurrence)
+        u, v = self.edge_src[edges], self.edge_dst[edges]
+        road = np.minimum(u, v) * self.store.n_nodes + np.maximum(u, v)
+        order = np.lexsort((np.arange(len(points)), road, points))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (points[order][1:] != points[order][:-1]) | (road[order][1:] != road[order][:-1])
+        is_first = np.zeros(len(order), dtype=bool)
+        is_first[order[first]] = True
+        seen = np.concatenate(([0], np.cumsum(is_first)))
+        road_rank = seen[1:] - seen[bounds[points]] - 1
+        group_first = order[np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))]
+        road_rank[order] = road_rank[group_first]
+        capped = road_rank < MAX_CANDIDATES
+
+        emission = -0.5 * (dists / SIGMA_Z) ** 2
+        return bounds, edges, offsets.astype(np.float64), emission, capped
+
+    # === Transitions
+    def _search(self, source, targets, max_distance):
+        """
+        Dijkstra en distance depuis source, borné à max_distance, arrêté dès que
+        toutes les cibles sont fixées. Renvoie ({cible: distance}, prédécesseurs).
+        """
+        indptr, indices, distance = self._indptr, self._indices, self._distance
+        dist, pred, settled = {source: 0.0}, {}, set()
+        remaining = set(targets)
+        heap = [(0.0, source)]
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            settled.add(u)
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + distance[e]
+                if nd <= max_distance and nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return {t: dist[t] for t in targets if t in settled}, pred
+
+    def _route_distances(self, prev_edges, prev_offsets, edges, offsets, gc):
+        """
+        Distances routières (m) entre les candidats de deux points successifs :
+        le long de l'arête si elle est commune et parcourue vers l'avant, sinon
+        fin de l'arête de départ + plus court chemin + début de l'arête d'arrivée.
+        Renvoie (matrice, prédécesseurs par nœud de départ).
+        """
+        max_route = MAX_ROUTE_FACTOR * gc + 2 * SEARCH_RADIUS
+        route = np.full((len(prev_edges), len(edges)), np.inf)
+        forward = (prev_edges[:, None] == edges[None, :]) & (offsets[None, :] >= prev_offsets[:, None])
+        along = offsets[None, :] - prev_offsets[:, None]
+        route[forward] = along[forward]
+
+        heads = self.edge_dst[prev_edges]
+        tails = self.edge_src[edges]
+        rest = np.maximum(self.edge_length[prev_edges] - prev_offsets, 0.0)
+        targets = set(tails.tolist())
+        preds = {}
+        for head in np.unique(heads).tolist():
+            reached, preds[head] = self._search(head, targets, max_route)
+            if not reached:
+                continue
+            network = np.array([reached.get(t, math.inf) for t in tails.tolist()])
+            rows = np.flatnonzero(heads == head)
+            via = rest[rows, None] + network[None, :] + offsets[None, :]
+            route[rows] = np.minimum(route[rows], via)
+        route[route > max_route] = np.inf
+        return route, preds
+
+    def _path(self, preds, head, tail):
+        """Arêtes du plus court chemin head → tail (déjà calculé)."""
+        edges, v = [], tail
+        pred = preds[head]
+        while v != head:
+            e = pred[v]
+            edges.append(e)
+            v = self._edge_src[e]
+        edges.reverse()
+        return edges
+
+    # === Décodage
+    def _transition(self, layer, score, edges, offsets, gc):
+        """
+        Pas de Viterbi vers les candidats (edges, offsets) : (meilleur score
+        par candidat, candidat précédent retenu, prédécesseurs), ou None si
+        aucune transition n'est possible.
+        """
+        prev_edges, prev_offsets = layer[0], layer[1]
+        route, preds = self._route_distances(prev_edges, prev_offsets, edges, offsets, gc)
+        total = score[:, None] - np.abs(route - gc) / BETA
+        back = np.argmax(total, axis=0)
+        best = total[back, np.arange(len(edges))]
+        if not np.isfinite(best).any():
+            return None
+        return best, back, preds
+
+    def _backtrack(self, layers, score):
+        """Séquence d'arêtes du chemin de Viterbi d'un tronçon de trace."""
+        best = int(np.argmax(score))
+        chosen = [best]
+        for _, _, back, _ in reversed(layers[1:]):
+            best = int(back[best])
+            chosen.append(best)
+        chosen.reverse()
+
+        e0, off0 = layers[0][0], layers[0][1]
+        sequence = [int(e0[chosen[0]])]
+        for j in range(1, len(layers)):
+            a, b = chosen[j - 1], chosen[j]
+            prev_edges, prev_offsets = layers[j - 1][0], layers[j - 1][1]
+            edges, offsets, _, preds = layers[j]
+            ea, eb = int(prev_edges[a]), int(edges[b])
+            if ea == eb and offsets[b] >= prev_offsets[a]:
+                continue
+            sequence.extend(self._path(preds, int(self.edge_dst[ea]), int(self.edge_src[eb])))
+            sequence.append(eb)
+        return sequence
+
+    def match(self, lat, lon):
+        """
+        Trace (lat, lon) → {"edges": index d'arêtes du store dans l'ordre de
+        parcours, "n_points": points après rééchantillonnage, "n_matched":
+        points ayant au moins un candidat, "breaks": coupures de la trace}.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        keep = self._resample(lat, lon) if len(lat) > 1 else np.arange(len(lat))
+        lat, lon = lat[keep], lon[keep]
+        bounds, cand_edges, cand_offsets, emission, capped = self._candidates(lat, lon)
+
+        sequence, layers, score, breaks, n_matched = [], [], None, 0, 0
+        last = None
+        for i in range(len(lat)):
+            lo, hi = bounds[i], bounds[i + 1]
+            if lo == hi:
+                continue   # point sans arête candidate : ignoré
+            n_matched += 1
+            sel = np.arange(lo, hi)[capped[lo:hi]]
+            edges, offsets, em = cand_edges[sel], cand_offsets[sel], emission[sel]
+            if layers:
+                gc = float(haversine_m(lon[last], lat[last], lon[i], lat[i]))
+                transition = self._transition(layers[-1], score, edges, offsets, gc)
+                if transition is None and len(sel) < hi - lo:
+                    # Aucune transition vers les routes les plus proches : toutes les candidates
+                    edges, offsets, em = cand_edges[lo:hi], cand_offsets[lo:hi], emission[lo:hi]
+                    transition = self._transition(layers[-1], score, edges, offsets, gc)
+                if transition is not None:
+                    best, back, preds = transition
+                    score = best + em
+                    layers.append((edges, offsets, back, preds))
+                    last = i
+                    continue
+                # Aucune transition possible : on clôt le tronçon et on repart de ce point
+                sequence.extend(self._backtrack(layers, score))
+                breaks += 1
+            layers = [(edges, offsets, None, None)]
+            score = em
+            last = i
+        if layers:
+            sequence.extend(self._backtrack(layers, score))
+
+        edges = np.asarray(sequence, dtype=np.int64)
+        if len(edges):
+            edges = edges[np.concatenate(([True], edges[1:] != edges[:-1]))]
+        return {"edges": edges, "n_points": len(lat), "n_matched": n_matched, "breaks": breaks}
+
+
+# === Traitement des traces nettoyées (pool de processus)
+def _init_worker(store_dir, snap_dir, clean_dir):
+    # GraphStore, index et traces mappés en mémoire : les pages sont partagées entre workers
+    _worker["matcher"] = HMMMatcher.load(store_dir, snap_dir)
+    _worker["clean"] = TraceStore(clean_dir)
+
+
+def match_trace(name):
+    """Map matching d'une trace du store nettoyé ; renvoie (nom, arêtes, coupures)."""
+    trace = _worker["clean"].get(name)
+    result = _worker["matcher"].match(trace.lat, trace.lon)
+    return name, result["edges"], result["breaks"]
+
+
+def matched_trace(store, name, edges):
+    """Trace recalée : nœuds du chemin (géométrie) et séquence d'arêtes."""
+    nodes = np.concatenate((store.edge_src[edges[:1]], store.indices[edges])) if len(edges) else np.empty(0, dtype=np.int64)
+    return Trace(name, store.node_y[nodes], store.node_x[nodes], edges=edges, graph_version=store.version)
+
+
+def main(n_workers=N_WORKERS, store_dir=GRAPH_STORE_DIR, snap_dir=SNAP_INDEX_DIR,
+         clean_dir=CLEAN_TRACES_DIR, out_dir=HMM_TRACES_DIR):
+    matched = TraceStore(out_dir)
+    names = [name for name in TraceStore(clean_dir).names() if name not in matched]
+    print(f"🗺️  {len(names)} traces à recaler sur le graphe ({n_workers} processus)")
+    if not names:
+        return
+
+    start = time.time()
+    if n_workers <= 1 or len(names) <= 1:
+        _init_worker(store_dir, snap_dir, clean_dir)
+        results = map(match_trace, names)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                   initargs=(str(store_dir), str(snap_dir), str(clean_dir)))
+        results = pool.map(match_trace, names, chunksize=max(1, len(names) // (n_workers * 4)))
+
+    graph = GraphStore.load(store_dir)
+    batch = []
+    try:
+        for name, edges, breaks in results:
+            status = "✔" if len(edges) else "✘"
+            print(f"{status} {name} : {len(edges)} arêtes" + (f", {breaks} coupure(s)" if breaks else ""))
+            batch.append(matched_trace(graph, name, edges))
+            if len(batch) >= CHUNK_TRACES:
+                matched.append(batch, graph_version=graph.version)
+                batch = []
+    finally:
+        if batch:
+            matched.append(batch, graph_version=graph.version)
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.time() - start
+    print(f"⏱️  {len(names)} traces en {elapsed:.1f} s ({len(names) / max(elapsed, 1e-9) * 60:.0f} traces/min)")
+
+
+if __name__ == "__main__":
+    main()
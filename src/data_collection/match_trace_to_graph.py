@@ -1,23 +1,235 @@
 import os
-import pickle
-import requests
+import sys
 import json
 import time
+import random
+import subprocess
+import threading
 from pathlib import Path
 from math import radians, sin, cos, sqrt, atan2
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import polyline
+import requests
+import shapely
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.trace_store import Trace, TraceStore, CLEAN_TRACES_DIR, VALHALLA_TRACES_DIR
 
 # === CONFIGURATION ===
-CLEAN_DIR = Path("data/gpx_clean")
-OUT_DIR = Path("data/matched_traces")
-VALHALLA_URL = "http://localhost:8002/trace_route"
+JOURNAL_PATH = VALHALLA_TRACES_DIR / "journal.jsonl"
+VALHALLA_URL = os.environ.get("VALHALLA_URL", "http://localhost:8002")
 COSTING = "bicycle"
-CHUNK_SIZE = 400
-OVERLAP = 50
 INTERPOLATION_DISTANCE = 10
 QUALITY_THRESHOLD = 0.7
-BATCH_SIZE = 100  # <== Modifie ici pour adapter la taille du lot
+FLUSH_TRACES = 50          # traces recalées écrites dans le store par lot...
+FLUSH_INTERVAL = 30.0      # ... ou au moins toutes les 30 s : une interruption perd peu de travail
+SHAPE_PRECISION = 6        # Valhalla encode ses polylignes à 1e-6 degré
+
+# === Découpage des traces
+SIMPLIFY_TOLERANCE = 5.0   # m, Douglas-Peucker avant envoi (sous le bruit GPS)
+MAX_CHUNK_POINTS = 2000    # points max par requête
+MAX_CHUNK_DISTANCE = 30000 # m, longueur max de trace par requête
+MIN_CHUNK_POINTS = 100
+OVERLAP_DISTANCE = 300.0   # m de recouvrement entre deux blocs
+MIN_OVERLAP_POINTS = 5
+
+# === Client HTTP
+MAX_IN_FLIGHT = 4          # traces (donc requêtes) traitées simultanément
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5         # secondes, doublé à chaque tentative (+ gigue aléatoire)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+TIMEOUT = 60
+FAILURE_THRESHOLD = 5      # échecs consécutifs avant de suspendre les requêtes
+PROBE_INTERVAL = 5.0       # secondes entre deux sondes /status pendant la suspension
+RESTART_AFTER_PROBES = 6   # sondes en échec avant la commande de redémarrage
+MAX_PROBES = 60            # sondes en échec avant d'abandonner (~5 min) : le traitement s'arrête
+# ex. "docker restart valhalla" : remplace le redémarrage manuel du serveur
+RESTART_COMMAND = os.environ.get("VALHALLA_RESTART_CMD")
+
+DONE_STATUSES = {"ok", "low_coverage"}
+
+
+class ValhallaUnavailable(RuntimeError):
+    """Valhalla toujours indisponible après max_probes sondes : le traitement doit s'arrêter."""
+
+
+class ValhallaClient:
+    """
+    Client Valhalla partagé entre threads : session HTTP (keep-alive, pool de
+    connexions), reprises avec backoff exponentiel à gigue sur les erreurs
+    serveur et réseau.
+
+    Santé du serveur : après FAILURE_THRESHOLD échecs consécutifs, toutes les
+    requêtes sont suspendues ; le thread qui constate la panne remplace la
+    session (sous le verrou ; l'ancienne n'est fermée qu'à close(), les
+    requêtes encore en vol s'y terminent) et sonde /status jusqu'au retour du
+    serveur (en lançant restart_command s'il reste indisponible), puis les
+    requêtes reprennent. Après max_probes sondes en échec, le client est
+    déclaré hors service : cette requête et toutes les suivantes lèvent
+    ValhallaUnavailable.
+    Les erreurs propres à une trace (400, aucun tronçon proche...) ne sont ni
+    retentées ni comptées comme des pannes.
+
+    base_url peut pointer vers un faux serveur local pour les tests.
+    """
+
+    def __init__(self, base_url=VALHALLA_URL, max_in_flight=MAX_IN_FLIGHT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, timeout=TIMEOUT, failure_threshold=FAILURE_THRESHOLD,
+                 probe_interval=PROBE_INTERVAL, restart_command=RESTART_COMMAND, max_probes=MAX_PROBES):
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.restart_command = restart_command
+        self.max_probes = max_probes
+
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.ready.set()
+        self.failures = 0
+        self.down = False    # abandon après max_probes sondes en échec
+        self.session = self._new_session()
+        self._retired = []   # sessions remplacées, fermées par close()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def url(self, endpoint):
+        return f"{self.base_url}/{endpoint}"
+
+    # === Santé du serveur
+    def probe(self):
+        """True si /status répond 200."""
+        try:
+            return self.session.get(self.url("status"), timeout=min(self.timeout, 10)).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _success(self):
+        with self.lock:
+            self.failures = 0
+
+    def _unavailable(self):
+        return ValhallaUnavailable(f"Valhalla indisponible après {self.max_probes} sondes ({self.base_url})")
+
+    def _failure(self):
+        with self.lock:
+            if self.down:
+                raise self._unavailable()
+            self.failures += 1
+            if self.failures < self.failure_threshold or not self.ready.is_set():
+                return
+            self.ready.clear()
+        self._recover()
+
+    def _recover(self):
+        print("⚠️  Valhalla ne répond plus correctement : requêtes suspendues")
+        with self.lock:
+            self._retired.append(self.session)
+            self.session = self._new_session()
+        probes = 0
+        while not self.probe():
+            probes += 1
+            if probes >= self.max_probes:
+                with self.lock:
+                    self.down = True
+                self.ready.set()  # réveille les requêtes en attente : elles lèvent à leur tour
+                raise self._unavailable()
+            if self.restart_command and probes % RESTART_AFTER_PROBES == 0:
+                print(f"🔄 Redémarrage du serveur : {self.restart_command}")
+                subprocess.run(self.restart_command, shell=True, check=False)
+            time.sleep(self.probe_interval)
+        with self.lock:
+            self.failures = 0
+        print("✅ Valhalla de nouveau disponible : reprise des requêtes")
+        self.ready.set()
+
+    # === Requêtes
+    def trace_route(self, shape):
+        """Réponse JSON de /trace_route, ou None si la trace échoue."""
+        body = {
+            "shape": shape,
+            "costing": COSTING,
+            "shape_match": "map_snap",
+            "trace_options": {
+                "interpolation_distance": INTERPOLATION_DISTANCE
+            }
+        }
+        for attempt in range(self.max_retries + 1):
+            self.ready.wait()
+            if self.down:
+                raise self._unavailable()
+            try:
+                res = self.session.post(self.url("trace_route"), json=body, timeout=self.timeout)
+                if res.status_code == 200:
+                    data = res.json()
+                    self._success()
+                    return data
+                if res.status_code not in RETRY_STATUS:
+                    self._success()
+                    print(f"Erreur Valhalla: {res.status_code} - {res.text[:200]}")
+                    return None
+                error = f"{res.status_code} - {res.text[:200]}"
+            except (requests.RequestException, ValueError) as e:
+                error = e
+            self._failure()
+            if attempt == self.max_retries:
+                print(f"Erreur Valhalla après {attempt + 1} tentatives : {error}")
+                return None
+            time.sleep(self.backoff_base * (2 ** attempt) * (1 + random.random()))
+
+    def close(self):
+        with self.lock:
+            sessions, self._retired = [self.session] + self._retired, []
+        for session in sessions:
+            session.close()
+
+
+class MatchJournal:
+    """
+    Journal des traces traitées (une ligne JSON par trace) : une reprise saute
+    les traces déjà recalées sans relire le dossier de sortie ; les échecs
+    sont retentés.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # ligne tronquée par une interruption
+                    self.entries[entry["trace"]] = entry
+
+    def done(self, name):
+        entry = self.entries.get(name)
+        return entry is not None and entry["status"] in DONE_STATUSES
+
+    def record(self, name, status, **info):
+        entry = {"trace": name, "status": status, **info}
+        with self.lock:
+            self.entries[name] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
 
-OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 def haversine(coord1, coord2):
     R = 6371000
@@ -32,25 +244,6 @@ def haversine(coord1, coord2):
 def compute_distance(points):
     return sum(haversine(points[i], points[i+1]) for i in range(len(points)-1))
 
-def send_valhalla_request(shape):
-    body = {
-        "shape": shape,
-        "costing": COSTING,
-        "shape_match": "map_snap",
-        "trace_options": {
-            "interpolation_distance": INTERPOLATION_DISTANCE
-        }
-    }
-    try:
-        res = requests.post(VALHALLA_URL, json=body)
-        if res.status_code != 200:
-            print(f"Erreur Valhalla: {res.status_code} - {res.text}")
-            return None
-        return res.json()
-    except Exception as e:
-        print("Erreur requête ou parsing:", e)
-        return None
-
 def extract_shape_points(data):
     if not data or "trip" not in data:
         return []
@@ -58,91 +251,196 @@ def extract_shape_points(data):
     for leg in data["trip"]["legs"]:
         shape_raw = leg.get("shape", "")
         if isinstance(shape_raw, str):
-            import polyline
-            decoded = polyline.decode(shape_raw)
-            points.extend(decoded)
+            points.extend(polyline.decode(shape_raw, SHAPE_PRECISION))
         elif isinstance(shape_raw, list):
             points.extend(shape_raw)
     return points
 
-def map_match_trace_full(trace_points):
-    shape = [{"lat": lat, "lon": lon} for lat, lon in trace_points]
-    if len(shape) <= CHUNK_SIZE:
-        result = send_valhalla_request(shape)
-        return [result] if result else [], trace_points
-
-    chunks = []
-    i = 0
-    while i < len(shape):
-        end = min(i + CHUNK_SIZE, len(shape))
-        if end - i <= OVERLAP:
-            break
-        chunk = shape[i:end]
-        result = send_valhalla_request(chunk)
-        if result and "trip" in result:
-            print(f"  - Bloc {i}-{end} : OK")
-            chunks.append(result)
-        else:
-            print(f"  - Bloc {i}-{end} : échec")
-        i = end - OVERLAP
-    return chunks, trace_points
-
-def estimate_coverage_by_distance(matched_chunks, original_points):
-    matched_points = []
-    for chunk in matched_chunks:
-        matched_points.extend(extract_shape_points(chunk))
-    dist_match = compute_distance(matched_points)
+def local_xy(points, lat0=None):
+    """(lat, lon) → coordonnées planes locales (m), projection équirectangulaire."""
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if lat0 is None:
+        lat0 = pts[:, 0].mean() if len(pts) else 0.0
+    R = 6371000
+    return np.column_stack((np.radians(pts[:, 1]) * R * cos(radians(lat0)), np.radians(pts[:, 0]) * R))
+
+def simplify_trace(points, tolerance=SIMPLIFY_TOLERANCE):
+    """Douglas-Peucker (tolérance en m) : garde l'ordre et les extrémités de la trace."""
+    if len(points) < 3:
+        return list(points)
+    xy = local_xy(points)
+    simplified = shapely.simplify(shapely.linestrings(xy), tolerance, preserve_topology=False)
+    kept = shapely.get_coordinates(simplified)
+    # Les sommets gardés sont des sommets d'origine : on retrouve leurs index dans l'ordre
+    index, j = [], 0
+    for x, y in kept:
+        while j < len(xy) and (xy[j, 0] != x or xy[j, 1] != y):
+            j += 1
+        index.append(j)
+        j += 1
+    return [tuple(points[i]) for i in index if i < len(points)]
+
+def plan_chunks(points):
+    """
+    Blocs (début, fin) à envoyer : taille choisie d'après la densité de points
+    (espacement moyen) et la longueur de la trace, blocs équilibrés, avec un
+    recouvrement d'environ OVERLAP_DISTANCE mètres.
+    """
+    n = len(points)
+    if n < 2:
+        return [(0, n)]
+    xy = local_xy(points)
+    length = float(np.hypot(*np.diff(xy, axis=0).T).sum())
+    spacing = max(length / (n - 1), 1.0)
+    size = int(min(MAX_CHUNK_POINTS, max(MIN_CHUNK_POINTS, MAX_CHUNK_DISTANCE / spacing)))
+    if n <= size:
+        return [(0, n)]
+    overlap = int(min(size // 4, max(MIN_OVERLAP_POINTS, OVERLAP_DISTANCE / spacing)))
+    n_chunks = -(-(n - overlap) // (size - overlap))
+    step = -(-(n - overlap) // n_chunks)
+    return [(i * step, min(i * step + step + overlap, n)) for i in range(n_chunks)]
+
+def map_match_trace_full(client, trace_points):
+    """
+    Trace simplifiée puis découpée en blocs (plan_chunks) envoyés à Valhalla.
+    Renvoie (blocs, réponses ou None par bloc, points envoyés).
+    """
+    points = simplify_trace(trace_points)
+    chunks = plan_chunks(points)
+    results = []
+    for start, end in chunks:
+        shape = [{"lat": lat, "lon": lon} for lat, lon in points[start:end]]
+        result = client.trace_route(shape)
+        results.append(result if result and "trip" in result else None)
+        if len(chunks) > 1 and results[-1] is None:
+            print(f"  - Bloc {start}-{end} : échec")
+    return chunks, results, points
+
+def _cut_index(shape, point, lat0, from_end):
+    """Sommet de shape le plus proche de point, cherché dans la moitié côté recouvrement."""
+    xy = local_xy(shape, lat0)
+    target = local_xy([point], lat0)[0]
+    half = len(shape) // 2
+    lo, hi = (half, len(shape)) if from_end else (0, max(half, 1))
+    d = np.hypot(xy[lo:hi, 0] - target[0], xy[lo:hi, 1] - target[1])
+    return lo + int(np.argmin(d))
+
+def stitch_chunks(chunks, results, points):
+    """
+    Géométrie recalée sans doublon : deux blocs voisins réussis sont coupés au
+    milieu de leur recouvrement (sommet le plus proche du point d'entrée
+    central), un bloc en échec (ou à géométrie vide) coupe la trace. Renvoie
+    une liste de tronçons de (lat, lon).
+    """
+    lat0 = float(np.mean([p[0] for p in points])) if points else 0.0
+    shapes = [extract_shape_points(result) if result is not None else [] for result in results]
+    runs, current = [], []
+    for i, ((start, end), shape) in enumerate(zip(chunks, shapes)):
+        if not shape:
+            if current:
+                runs.append(current)
+            current = []
+            continue
+        first, last = 0, len(shape)
+        if current and i > 0 and shapes[i - 1]:
+            overlap_mid = (start + chunks[i - 1][1]) // 2
+            first = _cut_index(shape, points[overlap_mid], lat0, from_end=False)
+        if i + 1 < len(chunks) and shapes[i + 1]:
+            overlap_mid = (chunks[i + 1][0] + end) // 2
+            last = _cut_index(shape, points[overlap_mid], lat0, from_end=True) + 1
+        if current and first < last and tuple(shape[first]) == tuple(current[-1]):
+            first += 1   # sommet de coupe déjà présent
+        current.extend(shape[first:last])
+    if current:
+        runs.append(current)
+    return runs
+
+def estimate_coverage_by_distance(runs, original_points):
+    dist_match = sum(compute_distance(run) for run in runs)
     dist_orig = compute_distance(original_points)
     if dist_orig == 0:
         return 0
     return dist_match / dist_orig
 
-def merge_chunks(chunks):
-    if not chunks:
-        return None
-    merged = {"trip": {"legs": []}}
-    for chunk in chunks:
-        if "trip" in chunk and "legs" in chunk["trip"]:
-            merged["trip"]["legs"].extend(chunk["trip"]["legs"])
-    return merged
-
-def main():
-    all_files = sorted(CLEAN_DIR.glob("*.pkl"))
-    N = len(all_files)
-    for batch_start in range(0, N, BATCH_SIZE):
-        batch = all_files[batch_start:batch_start + BATCH_SIZE]
-        print(f"\n=== Traitement du batch {batch_start//BATCH_SIZE+1} ({len(batch)} traces) ===")
-        for file in batch:
-            out_file = OUT_DIR / (file.stem + "_matched.json")
-            if out_file.exists():
-                print(f"{out_file.name} existe déjà, on saute cette trace.")
-                continue
-
-            print(f"\n=== Traitement de {file.name} ===")
-            with open(file, "rb") as f:
-                trace = pickle.load(f)
-
-            matched_chunks, original_points = map_match_trace_full(trace)
-            if not matched_chunks:
-                print("✘ Matching échoué")
-                time.sleep(1.0)
-                continue
-
-            coverage = estimate_coverage_by_distance(matched_chunks, original_points)
-            if coverage < QUALITY_THRESHOLD:
-                print(f"⚠️  Couverture faible (distance) : {coverage*100:.1f}%")
-            else:
-                print(f"✔ Bonne couverture (distance) : {coverage*100:.1f}%")
-
-            result = merge_chunks(matched_chunks)
-            with open(out_file, "w") as f:
-                json.dump(result, f)
-            print(f"Trace sauvegardée : {out_file}")
-            time.sleep(1.0)  # Pause 1s après chaque trace
-
-        print("\n=== Fin du batch ===")
-        print("👉 Redémarre maintenant le serveur Docker Valhalla puis appuie sur Entrée pour continuer.")
-        input("Appuie sur Entrée quand Valhalla est prêt...")
+def match_trace(client, trace):
+    """
+    Recale une trace nettoyée ; renvoie (statut, couverture, Trace recalée ou
+    None). La couverture est mesurée sur la trace d'origine, pas sur les
+    points simplifiés envoyés.
+    """
+    original = trace.points()
+    chunks, results, points = map_match_trace_full(client, original)
+    runs = stitch_chunks(chunks, results, points)
+    if not runs:
+        return "failed", 0.0, None
+
+    coverage = estimate_coverage_by_distance(runs, original)
+    matched = np.asarray([p for run in runs for p in run], dtype=np.float64).reshape(-1, 2)
+    status = "ok" if coverage >= QUALITY_THRESHOLD else "low_coverage"
+    return status, coverage, Trace(trace.name, matched[:, 0], matched[:, 1])
+
+def main(base_url=VALHALLA_URL, max_in_flight=MAX_IN_FLIGHT, journal_path=JOURNAL_PATH,
+         clean_dir=CLEAN_TRACES_DIR, out_dir=VALHALLA_TRACES_DIR):
+    journal = MatchJournal(journal_path)
+    clean = TraceStore(clean_dir)
+    matched = TraceStore(out_dir)
+    names = [name for name in clean.names() if not journal.done(name)]
+    print(f"=== {len(names)} traces à recaler ({max_in_flight} en parallèle) ===")
+
+    client = ValhallaClient(base_url, max_in_flight=max_in_flight)
+    counts = {"ok": 0, "low_coverage": 0, "failed": 0}
+    pending = []   # (nom, statut, couverture, trace) en attente d'écriture dans le store
+    last_flush = time.time()
+
+    def flush():
+        # Le journal n'est écrit qu'une fois les traces enregistrées
+        nonlocal last_flush
+        matched.append(trace for _, _, _, trace in pending)
+        for name, status, coverage, _ in pending:
+            journal.record(name, status, coverage=round(coverage, 4))
+        pending.clear()
+        last_flush = time.time()
+
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            futures = {pool.submit(match_trace, client, clean.get(name)): name for name in names}
+            remaining = set(futures)
+            while remaining:
+                # Réveil au moins toutes les FLUSH_INTERVAL s, même sans trace terminée
+                finished, remaining = wait(remaining, timeout=FLUSH_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = futures[future]
+                    try:
+                        status, coverage, trace = future.result()
+                    except ValhallaUnavailable:
+                        # Serveur perdu : traces en file annulées, le journal est sauvegardé (finally)
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+                    except Exception as e:
+                        print(f"✘ {name} : {e}")
+                        status, coverage, trace = "failed", 0.0, None
+                    counts[status] += 1
+                    if status == "failed":
+                        print(f"✘ {name} : matching échoué")
+                        journal.record(name, status, coverage=0.0)
+                        continue
+                    if status == "low_coverage":
+                        print(f"⚠️  {name} : couverture faible (distance) : {coverage*100:.1f}%")
+                    else:
+                        print(f"✔ {name} : bonne couverture (distance) : {coverage*100:.1f}%")
+                    pending.append((name, status, coverage, trace))
+                if pending and (len(pending) >= FLUSH_TRACES or time.time() - last_flush >= FLUSH_INTERVAL):
+                    flush()
+    finally:
+        if pending:
+            flush()
+        client.close()
+
+    print(f"\n=== Terminé en {time.time() - start:.1f} s : {counts} ===")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except ValhallaUnavailable as e:
+        sys.exit(f"🛑 {e} : arrêt, les traces restantes seront reprises au prochain lancement")
@@ -0,0 +1,344 @@
+import os
+import ast
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+ROOT = Path(__file__).resolve().parents[2]
+STATE_PATH = Path("data/processed/.pipeline_state.json")
+
+sys.path.append(str(ROOT))
+
+from src.utils.workers import WORKERS_ENV
+
+
+class Stage:
+    """
+    Étape de construction : un script exécuté depuis la racine du projet,
+    avec ses entrées (fichiers ou dossiers) et ses sorties.
+    Les paramètres des scripts sont leurs constantes : ils sont couverts par le
+    hash du code (script + modules src.* qu'il importe, directement ou non,
+    déduits des imports ; code : fichiers supplémentaires non importés).
+    max_age (s) : pour une étape qui lit une source externe (téléchargement),
+    relance quand la dernière exécution réussie est plus ancienne.
+    """
+
+    def __init__(self, name, script, inputs=(), outputs=(), code=(), max_age=None):
+        self.name = name
+        self.script = Path(script)
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.code = [self.script] + [Path(p) for p in code]
+        self.max_age = max_age
+
+
+# === Étapes de construction du graphe (ordre déduit des entrées / sorties)
+STAGES = [
+    Stage(
+        "download_osm", "src/data_collection/download_osm.py",
+        outputs=["data/raw_osm/osm_graph_zone_interet.gpickle"],
+    ),
+    Stage(
+        "parse_gpickle", "src/data_collection/parse_gpickle.py",
+        inputs=["data/raw_osm/osm_graph_zone_interet.gpickle"],
+        outputs=["data/processed/osm_graph_filtered_clean.gpickle"],
+    ),
+    Stage(
+        "add_distance", "src/data_collection/add_distance_to_graph.py",
+        inputs=["data/processed/osm_graph_filtered_clean.gpickle"],
+        outputs=["data/processed/graph_with_distance.gpickle"],
+    ),
+    Stage(
+        "add_dplus", "src/data_collection/add_dplus_to_graph.py",
+        inputs=["data/processed/graph_with_distance.gpickle", "data/dem/tif"],
+        outputs=["data/processed/graph_with_dplus.gpickle"],
+    ),
+    Stage(
+        # Met à jour le cache MBTiles puis écrit le GeoTIFF depuis le cache :
+        # sans entrée locale, relancée chaque semaine (tuiles revalidées par ETag)
+        "convert_heatmap", "src/data_collection/convert_heatmap_to_geotiff.py",
+        outputs=["data/strava_tiles/heatmap.tif"],
+        max_age=7 * 24 * 3600,
+    ),
+    Stage(
+        "add_popularity", "scripts/generate_graph_with_strava_gpickle.py",
+        inputs=["data/processed/graph_with_dplus.gpickle", "data/strava_tiles/heatmap.tif"],
+        outputs=["data/processed/graph_with_strava_and_dplus.gpickle"],
+    ),
+    Stage(
+        "reproject", "src/data_collection/reproject_graph.py",
+        inputs=["data/processed/graph_with_strava_and_dplus.gpickle"],
+        outputs=["data/processed/graph_wgs84.gpickle"],
+    ),
+    Stage(
+        "graph_store", "src/data_collection/graph_store.py",
+        inputs=["data/processed/graph_with_strava_and_dplus.gpickle"],
+        outputs=["data/processed/graph_store"],
+    ),
+    Stage(
+        "contraction", "src/routing/contraction.py",
+        inputs=["data/processed/graph_store"],
+        outputs=["data/processed/graph_ch"],
+    ),
+]
+
+
+class Pipeline:
+    """
+    Exécute les étapes dans l'ordre des dépendances, en parallèle quand elles
+    sont indépendantes, et saute celles dont la sortie est à jour : une étape
+    est à jour si le hash (code + contenu des entrées) n'a pas changé depuis
+    la dernière exécution réussie, si ses sorties sont celles que cette
+    exécution a laissées (présentes, mêmes tailles et dates de modification :
+    une sortie supprimée ou retouchée à la main est reconstruite) et, avec
+    max_age, si cette exécution est assez récente. Une étape dont une
+    dépendance a été relancée n'est reconstruite que si le contenu de ses
+    entrées a changé.
+    """
+
+    def __init__(self, stages=STAGES, root=ROOT, state_path=STATE_PATH, max_workers=2, cpus=None):
+        self.stages = {s.name: s for s in stages}
+        self.root = Path(root)
+        self.state_path = self.root / state_path
+        self.max_workers = max_workers
+        # Budget de cœurs partagé : chaque étape lancée reçoit sa part
+        # (SMARTROUTE_WORKERS) au lieu de prendre cpu_count() pour elle seule
+        self.stage_workers = max(1, (cpus or os.cpu_count() or 1) // max(1, max_workers))
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+        self.code = {s.name: self._code_files(s) for s in stages}
+
+        producers = {out: s.name for s in stages for out in s.outputs}
+        self.deps = {
+            s.name: {producers[inp] for inp in s.inputs if inp in producers}
+            for s in stages
+        }
+
+    # === Code couvert par le hash d'une étape
+    def _code_files(self, stage):
+        """
+        Script de l'étape + extras déclarés + fermeture transitive des modules
+        src.* importés (y compris les imports locaux dans les fonctions).
+        """
+        files, todo = [], list(stage.code)
+        while todo:
+            path = todo.pop(0)
+            if path in files or not (self.root / path).is_file():
+                continue
+            files.append(path)
+            todo.extend(self._local_imports(path))
+        return files
+
+    def _local_imports(self, path):
+        tree = ast.parse((self.root / path).read_text(encoding="utf-8"))
+        modules = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules += [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+                modules.append(node.module)
+                modules += [f"{node.module}.{alias.name}" for alias in node.names]
+        found = []
+        for module in modules:
+            if module.split(".")[0] != "src":
+                continue
+            candidate = Path(*module.split(".")).with_suffix(".py")
+            if (self.root / candidate).is_file():
+                found.append(candidate)
+        return found
+
+    # === État persistant (hash des étapes et cache des hash de fichiers)
+    def _load_state(self):
+        if self.state_path.exists():
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        return {"stages": {}, "files": {}}
+
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def file_hash(self, path):
+        """
+        sha256 du contenu, mis en cache par (taille, mtime) : une reconstruction
+        sans changement ne relit aucun fichier.
+        """
+        full = self.root / path
+        st = full.stat()
+        stamp = [st.st_size, st.st_mtime_ns]
+        with self._lock:
+            cached = self.state["files"].get(str(path))
+        if cached and cached["stamp"] == stamp:
+            return cached["sha256"]
+
+        h = hashlib.sha256()
+        with open(full, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self.state["files"][str(path)] = {"stamp": stamp, "sha256": digest}
+        return digest
+
+    def path_hash(self, path):
+        full = self.root / path
+        if not full.exists():
+            return None
+        if full.is_file():
+            return self.file_hash(path)
+        h = hashlib.sha256()
+        for child in sorted(p for p in full.rglob("*") if p.is_file()):
+            rel = child.relative_to(self.root)
+            h.update(str(rel.relative_to(path)).encode())
+            h.update(self.file_hash(rel).encode())
+        return h.hexdigest()
+
+    def output_stamp(self, path):
+        """
+        Empreinte (chemin, taille, mtime) d'une sortie, fichiers d'un dossier
+        compris, sans relire leur contenu ; None si absente.
+        """
+        full = self.root / path
+        if not full.exists():
+            return None
+        files = [full] if full.is_file() else sorted(p for p in full.rglob("*") if p.is_file())
+        h = hashlib.sha256()
+        for child in files:
+            st = child.stat()
+            h.update(f"{child.relative_to(full)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+
+    def stage_hash(self, stage):
+        h = hashlib.sha256()
+        for path in self.code[stage.name] + stage.inputs:
+            digest = self.path_hash(path)
+            if digest is None:
+                return None  # entrée absente : l'étape ne peut pas être à jour
+            h.update(str(path).encode())
+            h.update(digest.encode())
+        return h.hexdigest()
+
+    def is_current(self, stage):
+        entry = self.state["stages"].get(stage.name)
+        if not isinstance(entry, dict):
+            return False  # jamais exécutée (ou état d'un format antérieur)
+        if stage.max_age is not None and time.time() - entry["finished"] > stage.max_age:
+            return False
+        if any(self.output_stamp(out) != entry["outputs"].get(str(out)) for out in stage.outputs):
+            return False
+        digest = self.stage_hash(stage)
+        return digest is not None and entry["hash"] == digest
+
+    # === Exécution
+    def _required(self, targets):
+        required, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in required:
+                required.add(name)
+                todo.extend(self.deps[name])
+        return required
+
+    def run(self, targets=None, force=(), dry_run=False):
+        required = self._required(targets or list(self.stages))
+        done, failed, pending, running = set(), set(), set(required), {}
+        rebuilt = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name in sorted(pending):
+                    deps = self.deps[name] & required
+                    if deps & failed:
+                        print(f"⏭️  {name} : dépendance en échec, ignorée")
+                        pending.discard(name)
+                        failed.add(name)
+                        continue
+                    if not deps <= done:
+                        continue
+                    pending.discard(name)
+                    stage = self.stages[name]
+                    # Exécution réelle : le hash relit les entrées produites par les
+                    # dépendances ; à blanc, elles ne sont pas encore reconstruites
+                    stale = name in force or (dry_run and bool(deps & rebuilt)) or not self.is_current(stage)
+                    if not stale:
+                        print(f"✅ {name} : à jour")
+                        done.add(name)
+                        continue
+                    if dry_run:
+                        print(f"🔁 {name} : serait reconstruite")
+                        done.add(name)
+                        rebuilt.add(name)
+                        continue
+                    print(f"🚀 {name} : lancement ({stage.script})")
+                    running[pool.submit(self._run_stage, stage)] = name
+
+                if not running:
+                    if pending and not any(self.deps[n] & required <= done | failed for n in pending):
+                        raise RuntimeError(f"❌ Dépendances circulaires : {sorted(pending)}")
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        done.add(name)
+                        rebuilt.add(name)
+                    else:
+                        failed.add(name)
+
+        if not dry_run:
+            self._save_state()
+        return not failed
+
+    def _run_stage(self, stage):
+        start = time.time()
+        env = dict(os.environ, **{WORKERS_ENV: str(self.stage_workers)})
+        result = subprocess.run([sys.executable, str(stage.script)], cwd=self.root, env=env)
+        elapsed = time.time() - start
+        if result.returncode != 0:
+            print(f"❌ {stage.name} : échec (code {result.returncode}) après {elapsed:.1f}s")
+            return False
+        entry = {
+            "hash": self.stage_hash(stage),
+            "outputs": {str(out): self.output_stamp(out) for out in stage.outputs},
+            "finished": time.time(),
+        }
+        with self._lock:
+            self.state["stages"][stage.name] = entry
+        self._save_state_safe()
+        print(f"✅ {stage.name} : terminé en {elapsed:.1f}s")
+        return True
+
+    def _save_state_safe(self):
+        with self._lock:
+            self._save_state()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construction incrémentale des artefacts du graphe")
+    parser.add_argument("targets", nargs="*", help="étapes à produire (défaut : toutes)")
+    parser.add_argument("--force", nargs="*", default=[], help="étapes à relancer quoi qu'il arrive")
+    parser.add_argument("--dry-run", action="store_true", help="affiche ce qui serait relancé")
+    parser.add_argument("--jobs", type=int, default=2, help="étapes indépendantes en parallèle")
+    parser.add_argument("--cpus", type=int, default=None, help="cœurs partagés entre les étapes (défaut : tous)")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(max_workers=args.jobs, cpus=args.cpus)
+    unknown = [t for t in args.targets + args.force if t not in pipeline.stages]
+    if unknown:
+        parser.error(f"étapes inconnues : {unknown} (disponibles : {list(pipeline.stages)})")
+
+    ok = pipeline.run(args.targets or None, force=set(args.force), dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
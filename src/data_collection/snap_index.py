@@ -0,0 +1,236 @@
+import json
+import math
+from pathlib import Path
+import numpy as np
+from pyproj import Transformer
+
+from src.utils.array_io import save_arrays
+
+# === Index enregistré avec le GraphStore (construit par la même étape)
+SNAP_INDEX_DIR = Path("data/processed/graph_store/snap")
+
+# === Projection métrique : Lambert-93, comme les dalles DEM
+METRIC_CRS = "EPSG:2154"
+TO_METRIC = Transformer.from_crs("EPSG:4326", METRIC_CRS, always_xy=True)
+
+CELL_SIZE = 50.0           # côté d'une cellule de la grille (m)
+MAX_SNAP_DISTANCE = 100.0  # distance maximale d'accrochage par défaut (m)
+QUERY_CHUNK = 20000        # points traités par lot (borne la mémoire des requêtes)
+
+SNAP_ARRAY_NAMES = (
+    "seg_xy", "seg_edge", "seg_offset", "edge_length",
+    "cell_keys", "cell_start", "cell_segments",
+)
+
+
+class EdgeSnapIndex:
+    """
+    Index spatial des segments d'arêtes du GraphStore, en coordonnées
+    métriques (EPSG:2154) :
+    - seg_xy : segments (x0, y0, x1, y1) en float32, relatifs à l'origine,
+    - seg_edge / seg_offset : arête du store et abscisse (m) du début du segment,
+    - grille régulière (cell_keys triées, cell_start, cell_segments) : chaque
+      segment est rangé dans les cellules que couvre son emprise.
+
+    Les requêtes (lon, lat) sont vectorisées : accrochage au segment le plus
+    proche (arête, abscisse le long de l'arête, distance) ou recherche de
+    toutes les arêtes dans un rayon. Tout est enregistré en .npy, mappable
+    en mémoire.
+    """
+
+    def __init__(self, arrays, meta, directory=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.meta = meta
+        for name in SNAP_ARRAY_NAMES:
+            setattr(self, name, np.asarray(arrays[name]))
+        self.cell_size = meta["cell_size"]
+        self.origin = (meta["origin_x"], meta["origin_y"])
+        self.nx, self.ny = meta["nx"], meta["ny"]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in SNAP_ARRAY_NAMES}
+
+    # === Construction
+    @classmethod
+    def build(cls, store, cell_size=CELL_SIZE):
+        """Construit l'index à partir des géométries du store (segment droit si absente)."""
+        coords, offsets = store.edge_geometry_arrays(fill_missing=True)
+        x, y = TO_METRIC.transform(coords[:, 0], coords[:, 1])
+        origin_x, origin_y = math.floor(x.min()) - cell_size, math.floor(y.min()) - cell_size
+        x, y = x - origin_x, y - origin_y
+
+        # Segments : chaque sommet sauf le dernier de son arête
+        counts = np.diff(offsets)
+        n_segs = np.maximum(counts - 1, 0)
+        starts = np.ones(len(coords), dtype=bool)
+        starts[offsets[1:][counts > 0] - 1] = False
+        first = np.flatnonzero(starts)
+        seg_edge = np.repeat(np.arange(len(counts), dtype=np.int32), n_segs)
+        x0, y0, x1, y1 = x[first], y[first], x[first + 1], y[first + 1]
+        length = np.hypot(x1 - x0, y1 - y0)
+
+        cum = np.concatenate(([0.0], np.cumsum(length)))
+        first_seg = np.concatenate(([0], np.cumsum(n_segs)))
+        seg_offset = cum[:-1] - cum[first_seg[:-1]][seg_edge]
+        edge_length = cum[first_seg[1:]] - cum[first_seg[:-1]]
+
+        # Grille : cellules couvertes par l'emprise de chaque segment
+        nx = int(math.ceil(x.max() / cell_size)) + 2
+        ny = int(math.ceil(y.max() / cell_size)) + 2
+        ix0 = np.floor(np.minimum(x0, x1) / cell_size).astype(np.int64)
+        ix1 = np.floor(np.maximum(x0, x1) / cell_size).astype(np.int64)
+        iy0 = np.floor(np.minimum(y0, y1) / cell_size).astype(np.int64)
+        iy1 = np.floor(np.maximum(y0, y1) / cell_size).astype(np.int64)
+        width = ix1 - ix0 + 1
+        n_cells = width * (iy1 - iy0 + 1)
+        seg = np.repeat(np.arange(len(x0), dtype=np.int64), n_cells)
+        local = np.arange(len(seg)) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        keys = (iy0[seg] + local // width[seg]) * nx + ix0[seg] + local % width[seg]
+
+        order = np.argsort(keys, kind="stable")
+        cell_keys, cell_counts = np.unique(keys[order], return_counts=True)
+        cell_start = np.zeros(len(cell_keys) + 1, dtype=np.int64)
+        np.cumsum(cell_counts, out=cell_start[1:])
+
+        arrays = {
+            "seg_xy": np.column_stack((x0, y0, x1, y1)).astype(np.float32),
+            "seg_edge": seg_edge,
+            "seg_offset": seg_offset.astype(np.float32),
+            "edge_length": edge_length,
+            "cell_keys": cell_keys,
+            "cell_start": cell_start,
+            "cell_segments": seg[order].astype(np.int32),
+        }
+        meta = {
+            "crs": METRIC_CRS,
+            "cell_size": float(cell_size),
+            "origin_x": float(origin_x),
+            "origin_y": float(origin_y),
+            "nx": nx,
+            "ny": ny,
+            "graph_version": store.version,
+        }
+        return cls(arrays, meta)
+
+    # === Entrées / sorties
+    def save(self, directory=SNAP_INDEX_DIR):
+        self.directory = save_arrays(directory, self.arrays(), self.meta)
+        return self.directory
+
+    @classmethod
+    def load(cls, directory=SNAP_INDEX_DIR, mmap=True):
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"❌ Index d'accrochage introuvable ou incomplet : {directory}")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in SNAP_ARRAY_NAMES}
+        return cls(arrays, meta, directory)
+
+    # === Requêtes
+    def project(self, lon, lat):
+        """(lon, lat) → coordonnées métriques relatives à l'origine de la grille."""
+        x, y = TO_METRIC.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        return np.atleast_1d(x - self.origin[0]), np.atleast_1d(y - self.origin[1])
+
+    def _candidates(self, px, py, radius):
+        """
+        Paires (point, segment) à moins de radius : renvoie
+        (index du point, segment, abscisse sur le segment, distance).
+        """
+        k = int(math.ceil(radius / self.cell_size))
+        dx, dy = np.meshgrid(np.arange(-k, k + 1), np.arange(-k, k + 1))
+        dx, dy = dx.ravel(), dy.ravel()
+
+        cx = np.floor(px / self.cell_size).astype(np.int64)
+        cy = np.floor(py / self.cell_size).astype(np.int64)
+        gx, gy = (cx[:, None] + dx).ravel(), (cy[:, None] + dy).ravel()
+        point = np.repeat(np.arange(len(px)), len(dx))
+        inside = (gx >= 0) & (gx < self.nx) & (gy >= 0) & (gy < self.ny)
+        keys = gy[inside] * self.nx + gx[inside]
+        point = point[inside]
+
+        pos = np.searchsorted(self.cell_keys, keys)
+        pos = np.minimum(pos, len(self.cell_keys) - 1)
+        found = self.cell_keys[pos] == keys
+        pos, point = pos[found], point[found]
+        starts = self.cell_start[pos]
+        counts = self.cell_start[pos + 1] - starts
+        point = np.repeat(point, counts)
+        local = np.arange(len(point)) - np.repeat(np.cumsum(counts) - counts, counts)
+        seg = self.cell_segments[np.repeat(starts, counts) + local]
+
+        # Projection orthogonale du point sur chaque segment candidat
+        x0, y0, x1, y1 = (self.seg_xy[seg, i].astype(np.float64) for i in range(4))
+        vx, vy = x1 - x0, y1 - y0
+        length2 = vx * vx + vy * vy
+        t = np.where(length2 > 0, ((px[point] - x0) * vx + (py[point] - y0) * vy) / np.where(length2 > 0, length2, 1), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dist = np.hypot(px[point] - (x0 + t * vx), py[point] - (y0 + t * vy))
+        along = t * np.sqrt(length2)
+
+        keep = dist <= radius
+        return point[keep], seg[keep], along[keep], dist[keep]
+
+    def nearest(self, lon, lat, max_distance=MAX_SNAP_DISTANCE):
+        """
+        Accroche chaque point (lon, lat) au segment d'arête le plus proche.
+        Renvoie (edges, offsets, distances) : index d'arête du store, abscisse
+        (m) le long de l'arête, distance (m) ; -1 / nan / inf au-delà de
+        max_distance.
+        """
+        px, py = self.project(lon, lat)
+        n = len(px)
+        edges = np.full(n, -1, dtype=np.int64)
+        offsets = np.full(n, np.nan)
+        distances = np.full(n, np.inf)
+        for a in range(0, n, QUERY_CHUNK):
+            b = min(a + QUERY_CHUNK, n)
+            point, seg, along, dist = self._candidates(px[a:b], py[a:b], max_distance)
+            if not len(point):
+                continue
+            order = np.lexsort((dist, point))
+            point, first = np.unique(point[order], return_index=True)
+            best = order[first]
+            edges[a + point] = self.seg_edge[seg[best]]
+            offsets[a + point] = self.seg_offset[seg[best]] + along[best]
+            distances[a + point] = dist[best]
+        return edges, offsets, distances
+
+    def within(self, lon, lat, radius):
+        """
+        Toutes les arêtes à moins de radius (m) de chaque point.
+        Renvoie (points, edges, offsets, distances), une ligne par couple
+        (point, arête) au point le plus proche de l'arête, triées par point
+        puis distance.
+        """
+        px, py = self.project(lon, lat)
+        parts = []
+        for a in range(0, len(px), QUERY_CHUNK):
+            b = min(a + QUERY_CHUNK, len(px))
+            point, seg, along, dist = self._candidates(px[a:b], py[a:b], radius)
+            edge = self.seg_edge[seg].astype(np.int64)
+            order = np.lexsort((dist, edge, point))
+            pairs = (point[order].astype(np.int64) << 32) | edge[order]
+            _, first = np.unique(pairs, return_index=True)
+            best = order[first]
+            best = best[np.lexsort((dist[best], point[best]))]
+            parts.append((a + point[best], edge[best], self.seg_offset[seg[best]] + along[best], dist[best]))
+        if not parts:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        return tuple(np.concatenate(col) for col in zip(*parts))
+
+    def nearest_nodes(self, store, lon, lat, max_distance=MAX_SNAP_DISTANCE):
+        """
+        Nœud le plus proche le long de l'arête accrochée (extrémité la plus
+        proche en abscisse) ; -1 si aucun segment à moins de max_distance.
+        """
+        edges, offsets, _ = self.nearest(lon, lat, max_distance)
+        found = edges >= 0
+        nodes = np.full(len(edges), -1, dtype=np.int64)
+        e = edges[found]
+        at_end = offsets[found] > self.edge_length[e] / 2
+        nodes[found] = np.where(at_end, store.indices[e], store.edge_src[e])
+        return nodes
@@ -0,0 +1,171 @@
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+TILE_CACHE_PATH = Path("data/strava_tiles/strava_{activity}.mbtiles")
+MAX_CACHE_BYTES = 2 * 1024 ** 3      # au-delà : éviction LRU
+MAX_AGE = 30 * 24 * 3600             # tuile revalidée après 30 jours
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE TABLE IF NOT EXISTS tile_state (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+    etag TEXT, last_modified TEXT, fetched_at REAL, accessed_at REAL, size INTEGER,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tile_state_lru ON tile_state (accessed_at);
+"""
+
+
+def tms_row(z, y):
+    """MBTiles stocke les lignes en convention TMS (origine en bas)."""
+    return (1 << z) - 1 - y
+
+
+class MBTilesCache:
+    """
+    Cache de tuiles dans un seul fichier MBTiles (SQLite) :
+    - octets bruts stockés sans ré-encodage (table tiles, format MBTiles),
+    - ETag / Last-Modified conservés pour la revalidation (table tile_state),
+    - éviction LRU au-delà d'une taille maximale,
+    - lecture groupée d'une plage de tuiles en une requête.
+    Les coordonnées exposées sont en convention XYZ (celle des URL).
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if metadata:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                    [(k, str(v)) for k, v in metadata.items()],
+                )
+
+    # === Lecture
+    def get(self, z, x, y):
+        """Octets de la tuile, ou None si absente."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (z, x, tms_row(z, y)),
+            ).fetchone()
+            if row is not None:
+                self._touch(z, [(x, y)])
+        return row[0] if row else None
+
+    def state(self, z, x, y):
+        """(etag, last_modified, fetched_at) de la tuile, ou None si absente."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT etag, last_modified, fetched_at FROM tile_state "
+                "WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (z, x, tms_row(z, y)),
+            ).fetchone()
+
+    def is_fresh(self, z, x, y, max_age=MAX_AGE):
+        state = self.state(z, x, y)
+        return state is not None and time.time() - state[2] < max_age
+
+    def get_range(self, z, x_min, x_max, y_min, y_max):
+        """
+        Toutes les tuiles présentes de la plage (bornes incluses), en une
+        requête : {(x, y): octets}.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT tile_column, tile_row, tile_data FROM tiles "
+                "WHERE zoom_level=? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?",
+                (z, x_min, x_max, tms_row(z, y_max), tms_row(z, y_min)),
+            ).fetchall()
+            tiles = {(x, tms_row(z, row)): data for x, row, data in rows}
+            self._touch(z, list(tiles))
+        return tiles
+
+    # === Écriture
+    def put(self, z, x, y, data, etag=None, last_modified=None):
+        now = time.time()
+        row = tms_row(z, y)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) "
+                "VALUES (?, ?, ?, ?)",
+                (z, x, row, sqlite3.Binary(data)),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tile_state VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (z, x, row, etag, last_modified, now, now, len(data)),
+            )
+
+    def mark_fresh(self, z, x, y):
+        """Réponse 304 : la tuile en cache reste valable."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE tile_state SET fetched_at=? "
+                "WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                (time.time(), z, x, tms_row(z, y)),
+            )
+
+    def _touch(self, z, xys):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE tile_state SET accessed_at=? "
+                "WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                [(now, z, x, tms_row(z, y)) for x, y in xys],
+            )
+
+    # === Éviction
+    def total_size(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM tile_state").fetchone()[0]
+
+    def evict(self, max_bytes=MAX_CACHE_BYTES):
+        """Supprime les tuiles les moins récemment lues jusqu'à max_bytes."""
+        excess = self.total_size() - max_bytes
+        if excess <= 0:
+            return 0
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "SELECT zoom_level, tile_column, tile_row, size FROM tile_state ORDER BY accessed_at"
+            )
+            victims = []
+            for z, x, row, size in cursor:
+                if excess <= 0:
+                    break
+                victims.append((z, x, row))
+                excess -= size
+            cursor.close()
+            self.conn.executemany(
+                "DELETE FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", victims
+            )
+            self.conn.executemany(
+                "DELETE FROM tile_state WHERE zoom_level=? AND tile_column=? AND tile_row=?", victims
+            )
+        return len(victims)
+
+    def import_directory(self, tile_dir):
+        """Importe un ancien cache {z}/{x}/{y}.png (un fichier par tuile)."""
+        count = 0
+        for path in Path(tile_dir).glob("*/*/*.png"):
+            try:
+                z, x, y = int(path.parent.parent.name), int(path.parent.name), int(path.stem)
+            except ValueError:
+                continue
+            self.put(z, x, y, path.read_bytes())
+            count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
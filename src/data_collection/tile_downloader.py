@@ -0,0 +1,208 @@
+import json
+import time
+import random
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.data_collection.tile_cache import MAX_AGE
+
+STRAVA_TILE_URL = "https://strava-heatmap.tiles.freemap.sk/{activity}/hot/{z}/{x}/{y}.png"
+TILE_DIR = Path("data/strava_tiles")
+
+MAX_WORKERS = 8          # requêtes simultanées
+RATE_PER_SECOND = 20.0   # débit maximal par hôte
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5       # secondes, doublé à chaque tentative
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0"
+}
+
+
+class RateLimiter:
+    """Seau à jetons : au plus `rate` requêtes par seconde (rafale de `burst`)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TileManifest:
+    """
+    Journal des tuiles déjà traitées (une ligne JSON par tuile) : les tuiles
+    absentes côté serveur ne sont pas redemandées à la reprise.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # ligne tronquée par une interruption
+                    self.entries[tuple(entry["tile"])] = entry["status"]
+
+    def __contains__(self, tile):
+        return tuple(tile) in self.entries
+
+    def record(self, tile, status):
+        with self.lock:
+            self.entries[tuple(tile)] = status
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"tile": list(tile), "status": status}) + "\n")
+
+
+class TileDownloader:
+    """
+    Téléchargement concurrent de tuiles : session HTTP partagée (keep-alive,
+    pool de connexions), concurrence bornée, limite de débit par hôte,
+    reprises avec backoff exponentiel. Les tuiles sont lues et écrites via un
+    MBTilesCache : une reprise ne retélécharge que ce qui manque.
+
+    url_template accepte {z}, {x}, {y} (et les champs passés dans url_params) :
+    il peut pointer vers un serveur de tuiles local pour les tests.
+    """
+
+    def __init__(self, url_template=STRAVA_TILE_URL, url_params=None, max_workers=MAX_WORKERS,
+                 rate_per_second=RATE_PER_SECOND, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, timeout=10, headers=HEADERS):
+        self.url_template = url_template
+        self.url_params = url_params or {}
+        self.max_workers = max_workers
+        self.rate_per_second = rate_per_second
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def url(self, z, x, y):
+        return self.url_template.format(z=z, x=x, y=y, **self.url_params)
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(self.rate_per_second)
+            return self._limiters[host]
+
+    def fetch(self, z, x, y, etag=None, last_modified=None):
+        """
+        Requête (conditionnelle si etag / last_modified sont connus).
+        Renvoie (statut, octets, etag, last_modified) avec statut parmi
+        "ok", "not_modified" (304) et "missing" (404).
+        Lève la dernière erreur si toutes les tentatives échouent.
+        """
+        url = self.url(z, x, y)
+        limiter = self._limiter(url)
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code == 404:
+                    return "missing", None, None, None
+                if response.status_code == 304:
+                    return "not_modified", None, etag, last_modified
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return (
+                        "ok", response.content,
+                        response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                    )
+                error = requests.HTTPError(f"{response.status_code} pour {url}", response=response)
+                retry_after = response.headers.get("Retry-After")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff_base * (2 ** attempt) * (1 + random.random())
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay)
+
+    def download(self, tiles, cache, manifest=None, max_age=MAX_AGE):
+        """
+        Met à jour le cache pour les tuiles (z, x, y) : les tuiles fraîches sont
+        ignorées, les tuiles périmées revalidées (ETag / Last-Modified), les
+        autres téléchargées. Les tuiles absentes côté serveur (404) sont notées
+        au manifeste pour ne pas être redemandées. Renvoie le nombre de tuiles
+        par statut.
+        """
+        counts = {"ok": 0, "not_modified": 0, "missing": 0, "error": 0, "fresh": 0}
+        todo = []
+        for tile in tiles:
+            if manifest is not None and manifest.entries.get(tuple(tile)) == "missing":
+                counts["missing"] += 1
+                continue
+            state = cache.state(*tile)
+            if state is not None and time.time() - state[2] < max_age:
+                counts["fresh"] += 1
+                continue
+            todo.append((tile, state))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self.fetch, *tile, *(state[:2] if state else (None, None))): tile
+                for tile, state in todo
+            }
+            for future in as_completed(futures):
+                tile = futures[future]
+                try:
+                    status, data, etag, last_modified = future.result()
+                except Exception as e:
+                    print(f"Erreur pour {self.url(*tile)} : {e}")
+                    counts["error"] += 1
+                    continue  # rien d'écrit : sera retentée
+                if status == "ok":
+                    cache.put(*tile, data, etag=etag, last_modified=last_modified)
+                elif status == "not_modified":
+                    cache.mark_fresh(*tile)
+                elif manifest is not None:
+                    manifest.record(tile, status)
+                counts[status] += 1
+        return counts
+
+    def close(self):
+        self.session.close()
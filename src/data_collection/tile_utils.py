@@ -38,4 +38,32 @@ def get_zoom_for_area(area_km, max_tiles=100, lat=45.0):
             return zoom
     return 12  # fallback large si tout échoue
 
+WEB_MERCATOR_RADIUS = 6378137.0
 
+def lonlat_to_web_mercator(lon_deg, lat_deg):
+    """Projette une coordonnée lon/lat en EPSG:3857 (mètres)."""
+    x = math.radians(lon_deg) * WEB_MERCATOR_RADIUS
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat_deg) / 2)) * WEB_MERCATOR_RADIUS
+    return x, y
+
+def tile_bounds_3857(xtile_min, ytile_min, xtile_max, ytile_max, zoom):
+    """
+    Emprise exacte (ouest, sud, est, nord) en EPSG:3857 d'un bloc de tuiles
+    (bornes incluses), à partir des coins donnés par num2deg.
+    """
+    north, west = num2deg(xtile_min, ytile_min, zoom)
+    south, east = num2deg(xtile_max + 1, ytile_max + 1, zoom)
+    west_m, south_m = lonlat_to_web_mercator(west, south)
+    east_m, north_m = lonlat_to_web_mercator(east, north)
+    return west_m, south_m, east_m, north_m
+
+def tile_range_for_area(lat, lon, area_km, max_tiles=100):
+    """
+    Zoom et plage de tuiles (zoom, x_min, x_max, y_min, y_max) couvrant
+    area_km x area_km autour de (lat, lon).
+    """
+    zoom = get_zoom_for_area(area_km=area_km, max_tiles=max_tiles, lat=lat)
+    center_x, center_y = deg2num(lat, lon, zoom)
+    tile_km = 40075 * abs(math.cos(math.radians(lat))) / (2 ** zoom)
+    nb_tiles = int(area_km / tile_km / 2)
+    return zoom, center_x - nb_tiles, center_x + nb_tiles, center_y - nb_tiles, center_y + nb_tiles
@@ -0,0 +1,230 @@
+# src/data_collection/trace_store.py
+
+import os
+import sys
+import json
+import time
+import pickle
+import hashlib
+from pathlib import Path
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+# === Un store par étape de la chaîne des traces
+TRACE_STORE_DIR = Path("data/processed/traces")
+CLEAN_TRACES_DIR = TRACE_STORE_DIR / "clean"         # traces nettoyées (filter_and_clean_gpx.py)
+HMM_TRACES_DIR = TRACE_STORE_DIR / "hmm"             # arêtes recalées par le HMM (hmm_map_matching.py)
+VALHALLA_TRACES_DIR = TRACE_STORE_DIR / "valhalla"   # géométries recalées par Valhalla (match_trace_to_graph.py)
+
+CHUNK_TRACES = 1000   # traces max par bloc écrit
+
+CHUNK_ARRAY_NAMES = ("offsets", "lat", "lon", "time", "edge_offsets", "edges", "bbox")
+
+
+class Trace:
+    """
+    Trace du store : lat, lon, time (s, NaN sans horodatage) et edges (index
+    d'arêtes du GraphStore) sont des vues sur les tableaux de son bloc.
+    """
+
+    def __init__(self, name, lat, lon, time=None, edges=None, graph_version=None):
+        self.name = name
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.time = np.full(len(self.lat), np.nan) if time is None else np.asarray(time, dtype=np.float64)
+        self.edges = np.empty(0, dtype=np.int64) if edges is None else np.asarray(edges, dtype=np.int64)
+        self.graph_version = graph_version
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __repr__(self):
+        return f"Trace({self.name!r}, {len(self)} points, {len(self.edges)} arêtes)"
+
+    def points(self):
+        """Liste de (lat, lon), comme les anciens pickles de gpx_clean."""
+        return list(zip(self.lat.tolist(), self.lon.tolist()))
+
+
+class TraceStore:
+    """
+    Stockage colonnaire des traces, en ajout seul :
+    - chaque append() écrit un ou plusieurs blocs chunk_XXXXX/ : lat, lon, time
+      aplatis (float64) avec offsets par trace, séquences d'arêtes aplaties
+      (edges, edge_offsets), bbox (min_lon, min_lat, max_lon, max_lat) par
+      trace, et meta.json (noms, hash du contenu de chaque trace, version du
+      graphe) écrit en dernier : un bloc interrompu est ignoré,
+    - lecture mappée en mémoire : get() renvoie des vues, sans copie ni
+      décodage ; query_bbox() est une comparaison vectorisée sur l'index des
+      bbox de toutes les traces,
+    - une trace réécrite sous le même nom remplace la précédente.
+    """
+
+    def __init__(self, directory, mmap=True):
+        self.directory = Path(directory)
+        self.mmap = mmap
+        self.chunks = []        # (tableaux, meta) par bloc
+        self.index = {}         # nom → position globale (dernière version)
+        self._names = []        # positions globales → nom
+        self._location = []     # positions globales → (bloc, position dans le bloc)
+        self._bbox = [np.empty((0, 4))]
+        self._bbox_all = None
+        for chunk_dir in sorted(self.directory.glob("chunk_*")):
+            if (chunk_dir / "meta.json").exists():
+                self._register(chunk_dir)
+
+    # === Index
+    def _register(self, chunk_dir):
+        with open(chunk_dir / "meta.json", "r") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if self.mmap else None
+        arrays = {name: np.asarray(np.load(chunk_dir / f"{name}.npy", mmap_mode=mmap_mode))
+                  for name in CHUNK_ARRAY_NAMES}
+        c = len(self.chunks)
+        self.chunks.append((arrays, meta))
+        for i, name in enumerate(meta["names"]):
+            self.index[name] = len(self._names)
+            self._names.append(name)
+            self._location.append((c, i))
+        self._bbox.append(arrays["bbox"])
+        self._bbox_all = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index)
+
+    # === Lecture
+    def get(self, name):
+        c, i = self._location[self.index[name]]
+        arrays, meta = self.chunks[c]
+        a, b = arrays["offsets"][i], arrays["offsets"][i + 1]
+        ea, eb = arrays["edge_offsets"][i], arrays["edge_offsets"][i + 1]
+        return Trace(name, arrays["lat"][a:b], arrays["lon"][a:b], arrays["time"][a:b],
+                     arrays["edges"][ea:eb], meta.get("graph_version"))
+
+    def content_hash(self, name):
+        """
+        sha256 du contenu d'une trace (lat, lon, time, arêtes), enregistré à
+        l'écriture : comparer deux versions d'une trace ne relit pas ses points.
+        """
+        c, i = self._location[self.index[name]]
+        hashes = self.chunks[c][1].get("hashes")
+        if hashes is None:   # bloc écrit avant l'enregistrement des hash
+            return content_hash(self.get(name))
+        return hashes[i]
+
+    def traces(self, names=None):
+        """Itère sur les traces (toutes, ou celles de names)."""
+        for name in (self.index if names is None else names):
+            yield self.get(name)
+
+    def query_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Noms des traces dont la bbox intersecte la zone."""
+        if self._bbox_all is None:
+            self._bbox_all = np.concatenate(self._bbox)
+        bbox = self._bbox_all
+        hit = ((bbox[:, 0] <= max_lon) & (bbox[:, 2] >= min_lon) &
+               (bbox[:, 1] <= max_lat) & (bbox[:, 3] >= min_lat))
+        return [self._names[p] for p in np.flatnonzero(hit) if self.index[self._names[p]] == p]
+
+    # === Écriture
+    def append(self, traces, graph_version=None):
+        """Ajoute des traces (objets Trace) par blocs de CHUNK_TRACES ; renvoie le nombre écrit."""
+        batch, count = [], 0
+        for trace in traces:
+            batch.append(trace)
+            if len(batch) >= CHUNK_TRACES:
+                self._write_chunk(batch, graph_version)
+                count += len(batch)
+                batch = []
+        if batch:
+            self._write_chunk(batch, graph_version)
+            count += len(batch)
+        return count
+
+    def _write_chunk(self, traces, graph_version):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = [int(p.name.split("_")[1]) for p in self.directory.glob("chunk_*")]
+        chunk_dir = self.directory / f"chunk_{max(existing, default=-1) + 1:05d}"
+        chunk_dir.mkdir()
+
+        counts = np.array([len(t) for t in traces], dtype=np.int64)
+        edge_counts = np.array([len(t.edges) for t in traces], dtype=np.int64)
+        arrays = {
+            "offsets": np.concatenate(([0], np.cumsum(counts))),
+            "lat": np.concatenate([t.lat for t in traces]),
+            "lon": np.concatenate([t.lon for t in traces]),
+            "time": np.concatenate([t.time for t in traces]),
+            "edge_offsets": np.concatenate(([0], np.cumsum(edge_counts))),
+            "edges": np.concatenate([t.edges for t in traces]).astype(np.int64),
+            "bbox": np.array([
+                (t.lon.min(), t.lat.min(), t.lon.max(), t.lat.max()) if len(t) else (np.nan,) * 4
+                for t in traces
+            ], dtype=np.float64).reshape(-1, 4),
+        }
+        for name, array in arrays.items():
+            np.save(chunk_dir / f"{name}.npy", array)
+        meta = {
+            "names": [t.name for t in traces],
+            "hashes": [content_hash(t) for t in traces],
+            "n_traces": len(traces),
+            "n_points": int(counts.sum()),
+            "graph_version": graph_version,
+            "created": time.time(),
+        }
+        with open(chunk_dir / "meta.json", "w") as f:
+            json.dump(meta, f)
+        self._register(chunk_dir)
+        return chunk_dir
+
+
+def content_hash(trace):
+    """sha256 du contenu d'une trace (lat, lon, time en float64, arêtes en int64)."""
+    h = hashlib.sha256()
+    for array, dtype in ((trace.lat, np.float64), (trace.lon, np.float64),
+                         (trace.time, np.float64), (trace.edges, np.int64)):
+        h.update(np.ascontiguousarray(array, dtype=dtype).data)
+    return h.hexdigest()
+
+
+def trace_name(path):
+    """Nom d'une trace à partir d'un ancien fichier (X.gpx, X_cleaned.pkl, X_cleaned_matched.json...)."""
+    stem = Path(path).stem
+    for suffix in ("_hmm", "_matched", "_cleaned"):
+        if stem.endswith(suffix):
+            stem = stem[:-len(suffix)]
+    return stem
+
+
+def import_legacy(clean_dir=Path("data/gpx_clean"), matched_dir=Path("data/matched_traces")):
+    """Importe les anciens fichiers par trace (.pkl nettoyés, .json recalés) dans les stores."""
+    clean = TraceStore(CLEAN_TRACES_DIR)
+    traces = []
+    for path in sorted(clean_dir.glob("*.pkl")):
+        if trace_name(path) in clean:
+            continue
+        with open(path, "rb") as f:
+            points = np.asarray(pickle.load(f), dtype=np.float64).reshape(-1, 2)
+        traces.append(Trace(trace_name(path), points[:, 0], points[:, 1]))
+    print(f"📥 {clean.append(traces)} traces nettoyées importées dans {CLEAN_TRACES_DIR}")
+
+    from src.data_collection.match_trace_to_graph import extract_shape_points
+    valhalla = TraceStore(VALHALLA_TRACES_DIR)
+    traces = []
+    for path in sorted(matched_dir.glob("*_matched.json")):
+        if trace_name(path) in valhalla:
+            continue
+        with open(path, "r") as f:
+            points = np.asarray(extract_shape_points(json.load(f)), dtype=np.float64).reshape(-1, 2)
+        traces.append(Trace(trace_name(path), points[:, 0], points[:, 1]))
+    print(f"📥 {valhalla.append(traces)} traces Valhalla importées dans {VALHALLA_TRACES_DIR}")
+
+
+if __name__ == "__main__":
+    import_legacy()
@@ -1,8 +1,10 @@
-import pickle
-from pathlib import Path
+import os
+import sys
 from math import radians, cos, sin, asin, sqrt
 
-CLEAN_DIR = Path("data/gpx_clean")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.trace_store import TraceStore, CLEAN_TRACES_DIR
 
 def haversine(lon1, lat1, lon2, lat2):
     # Calcul de la distance entre 2 points GPS en mètres
@@ -25,14 +27,13 @@ def analyze_trace(points):
     return total_distance, avg_distance
 
 def main():
-    for file_path in CLEAN_DIR.glob("*.pkl"):
-        with open(file_path, "rb") as f:
-            points = pickle.load(f)
+    for trace in TraceStore(CLEAN_TRACES_DIR).traces():
+        points = trace.points()
         if not points:
-            print(f"{file_path.name} est vide")
+            print(f"{trace.name} est vide")
             continue
         total_dist, avg_dist = analyze_trace(points)
-        print(f"Trace {file_path.name}:")
+        print(f"Trace {trace.name}:")
         print(f"  Nombre de points : {len(points)}")
         print(f"  Distance totale approximative : {total_dist/1000:.2f} km")
         print(f"  Distance moyenne entre points : {avg_dist:.1f} m\n")
@@ -0,0 +1,84 @@
+# src/preprocessing/dem_sampler.py
+
+import numpy as np
+from pyproj import Transformer
+
+# === Reprojection EPSG:4326 → EPSG:2154 (LAMBERT-93), CRS des dalles RGE ALTI
+DEM_CRS = "EPSG:2154"
+TO_DEM_CRS = Transformer.from_crs("EPSG:4326", DEM_CRS, always_xy=True)
+
+
+class MosaicSampler:
+    """
+    Échantillonne une bande DEM déjà chargée en mémoire (mosaïque rasterio).
+    Les points hors emprise ou en nodata valent NaN (trous du DEM, écartés
+    par elevation_changes).
+    """
+
+    def __init__(self, band, transform, nodata=None):
+        self.band = band
+        self.transform = transform
+        self.nodata = nodata
+
+    def sample(self, x, y):
+        """
+        Altitudes aux coordonnées (x, y) exprimées dans le CRS du DEM.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        rows, cols = world_to_pixel(self.transform, x, y)
+        return read_pixels(self.band, rows, cols, self.nodata)
+
+
+def world_to_pixel(transform, x, y):
+    """Équivalent vectorisé de rasterio.transform.rowcol (arrondi inférieur)."""
+    inv = ~transform
+    cols = np.floor(inv.a * x + inv.b * y + inv.c).astype(np.int64)
+    rows = np.floor(inv.d * x + inv.e * y + inv.f).astype(np.int64)
+    return rows, cols
+
+
+def read_pixels(band, rows, cols, nodata=None):
+    """
+    Lit band[rows, cols] ; hors image, nodata ou valeur non finie → NaN.
+    """
+    height, width = band.shape
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    out = np.full(len(rows), np.nan)
+    out[inside] = band[rows[inside], cols[inside]]
+    if nodata is not None:
+        out[out == nodata] = np.nan
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def elevation_changes(elevations, offsets):
+    """
+    Réduit un profil d'altitudes aplati en D+ et D- par arête.
+    Les sommets de l'arête i sont elevations[offsets[i]:offsets[i + 1]].
+    Une différence touchant une altitude manquante (NaN, trou du DEM) compte
+    pour 0 : un trou ne crée pas de faux dénivelé.
+    """
+    diffs = np.nan_to_num(np.diff(elevations), nan=0.0)
+    gain = np.concatenate(([0.0], np.cumsum(np.maximum(diffs, 0.0))))
+    loss = np.concatenate(([0.0], np.cumsum(np.maximum(-diffs, 0.0))))
+
+    # Somme sur les paires internes à chaque arête : [start, end - 1]
+    start = np.minimum(offsets[:-1], len(gain) - 1)
+    end = np.maximum(offsets[1:] - 1, start)
+    return gain[end] - gain[start], loss[end] - loss[start]
+
+
+def compute_edge_dplus(coords, offsets, sampler, transformer=TO_DEM_CRS):
+    """
+    D+ et D- (m) de toutes les arêtes en un seul passage.
+    coords : sommets (lon, lat) aplatis, offsets : bornes par arête.
+    sampler : objet exposant sample(x, y) dans le CRS du DEM.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) == 0:
+        n_edges = len(offsets) - 1
+        return np.zeros(n_edges), np.zeros(n_edges)
+    x, y = transformer.transform(coords[:, 0], coords[:, 1])
+    elevations = sampler.sample(x, y)
+    return elevation_changes(elevations, np.asarray(offsets))
@@ -0,0 +1,149 @@
+# src/preprocessing/dem_tile_index.py
+
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import rasterio
+import shapely
+from rasterio.windows import Window
+
+from src.preprocessing.dem_sampler import world_to_pixel
+
+BLOCK_SIZE = 512  # pixels par côté d'un bloc mis en cache
+MAX_CACHE_BYTES = 256 * 1024 ** 2
+MAX_OPEN_FILES = 64
+
+
+class DemTileIndex:
+    """
+    Index spatial des dalles DEM d'un dossier, lues à la demande.
+
+    Seules les emprises des fichiers sont chargées à l'initialisation (STRtree).
+    À l'échantillonnage, les points sont regroupés par dalle puis par bloc,
+    et seuls les blocs touchés sont lus (fenêtres rasterio) et conservés dans
+    un cache LRU borné en octets : la mémoire ne dépend pas de la taille du
+    dossier DEM.
+
+    Même convention que MosaicSampler : hors emprise / nodata → NaN. Quand
+    plusieurs dalles se recouvrent, la première (ordre des fichiers) qui a une
+    valeur valide l'emporte, comme rasterio.merge.
+    """
+
+    def __init__(self, folder, block_size=BLOCK_SIZE, max_cache_bytes=MAX_CACHE_BYTES,
+                 max_open_files=MAX_OPEN_FILES):
+        self.folder = Path(folder)
+        self.paths = sorted(self.folder.glob("*.tif"))
+        if not self.paths:
+            raise FileNotFoundError(f"❌ Aucun fichier .tif trouvé dans {self.folder}")
+
+        self.block_size = block_size
+        self.max_cache_bytes = max_cache_bytes
+        self.max_open_files = max_open_files
+
+        bounds, self.transforms, self.shapes, self.nodata = [], [], [], []
+        for path in self.paths:
+            with rasterio.open(path) as src:
+                bounds.append(tuple(src.bounds))
+                self.transforms.append(src.transform)
+                self.shapes.append((src.height, src.width))
+                self.nodata.append(src.nodata)
+        self.bounds = np.array(bounds, dtype=np.float64)
+        self.tree = shapely.STRtree(shapely.box(*self.bounds.T))
+
+        self._datasets = OrderedDict()
+        self._blocks = OrderedDict()
+        self._cache_bytes = 0
+        self.stats = {"hits": 0, "misses": 0}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def sample(self, x, y):
+        """
+        Altitudes aux coordonnées (x, y) exprimées dans le CRS des dalles.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        out = np.full(len(x), np.nan)
+        resolved = np.zeros(len(x), dtype=bool)
+        if len(x) == 0:
+            return out
+
+        point_idx, tile_idx = self.tree.query(shapely.points(x, y), predicate="intersects")
+        order = np.lexsort((point_idx, tile_idx))
+        point_idx, tile_idx = point_idx[order], tile_idx[order]
+        tiles, starts = np.unique(tile_idx, return_index=True)
+        ends = np.append(starts[1:], len(tile_idx))
+
+        for tile, start, end in zip(tiles, starts, ends):
+            pts = point_idx[start:end]
+            pts = pts[~resolved[pts]]
+            if len(pts) == 0:
+                continue
+            values, valid = self._sample_tile(int(tile), x[pts], y[pts])
+            out[pts[valid]] = values[valid]
+            resolved[pts[valid]] = True
+        return out
+
+    def _sample_tile(self, tile, x, y):
+        rows, cols = world_to_pixel(self.transforms[tile], x, y)
+        height, width = self.shapes[tile]
+        values = np.zeros(len(x), dtype=np.float64)
+        valid = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+        bs = self.block_size
+        n_block_cols = (width + bs - 1) // bs
+        block_ids = np.where(valid, (rows // bs) * n_block_cols + cols // bs, -1)
+        for block_id in np.unique(block_ids[valid]):
+            sel = block_ids == block_id
+            brow, bcol = divmod(int(block_id), n_block_cols)
+            block = self._get_block(tile, brow, bcol)
+            values[sel] = block[rows[sel] - brow * bs, cols[sel] - bcol * bs]
+
+        nodata = self.nodata[tile]
+        valid &= np.isfinite(values)
+        if nodata is not None:
+            valid &= values != nodata
+        values[~valid] = np.nan
+        return values, valid
+
+    # === Cache LRU des blocs décodés ===
+    def _get_block(self, tile, brow, bcol):
+        key = (tile, brow, bcol)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            self.stats["hits"] += 1
+            return block
+
+        self.stats["misses"] += 1
+        height, width = self.shapes[tile]
+        bs = self.block_size
+        window = Window(bcol * bs, brow * bs, min(bs, width - bcol * bs), min(bs, height - brow * bs))
+        block = self._dataset(tile).read(1, window=window)
+
+        self._blocks[key] = block
+        self._cache_bytes += block.nbytes
+        while self._cache_bytes > self.max_cache_bytes and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._cache_bytes -= evicted.nbytes
+        return block
+
+    def _dataset(self, tile):
+        ds = self._datasets.get(tile)
+        if ds is not None:
+            self._datasets.move_to_end(tile)
+            return ds
+        ds = rasterio.open(self.paths[tile])
+        self._datasets[tile] = ds
+        if len(self._datasets) > self.max_open_files:
+            _, old = self._datasets.popitem(last=False)
+            old.close()
+        return ds
+
+    def close(self):
+        for ds in self._datasets.values():
+            ds.close()
+        self._datasets.clear()
+        self._blocks.clear()
+        self._cache_bytes = 0
@@ -0,0 +1,139 @@
+# src/preprocessing/enrichment_runner.py
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from tqdm import tqdm
+
+from src.utils.workers import default_workers
+
+SHARDS_PER_WORKER = 4  # plusieurs shards par cœur pour lisser la charge
+
+# === État propre à chaque processus worker
+_worker = {}
+
+
+def run_sharded(enricher_factory, n_edges, coords=None, offsets=None, columns=None,
+                factory_args=(), shared=None, n_workers=None, n_shards=None, desc="⚙️  Enrichissement"):
+    """
+    Découpe les arêtes en shards et applique une fonction d'enrichissement
+    dans un pool de processus, puis recolle les colonnes produites.
+
+    - enricher_factory(*factory_args) est appelé une fois par worker et renvoie
+      enrich(coords, offsets, columns) -> {nom: valeurs par arête du shard}.
+    - coords / offsets : géométries aplaties (lon, lat), transmises aux workers
+      par mémoire partagée (pas de pickle du graphe).
+    - columns : attributs d'entrée légers {nom: liste par arête}, découpés par shard.
+    - shared : gros tableaux en lecture seule {nom: ndarray} (bande raster...),
+      chargés une fois par l'appelant, placés en mémoire partagée et passés
+      à enricher_factory en arguments nommés : une seule copie pour tous les
+      workers.
+    """
+    n_workers = n_workers or default_workers()
+    n_shards = n_shards or n_workers * SHARDS_PER_WORKER
+    n_shards = max(1, min(n_shards, n_edges))
+    bounds = np.linspace(0, n_edges, n_shards + 1).astype(np.int64)
+    columns = columns or {}
+    shared = shared or {}
+
+    if coords is None:
+        coords = np.empty((0, 2), dtype=np.float64)
+        offsets = np.zeros(n_edges + 1, dtype=np.int64)
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+
+    tasks = [
+        (int(a), int(b), {name: values[a:b] for name, values in columns.items()})
+        for a, b in zip(bounds[:-1], bounds[1:])
+    ]
+
+    if n_workers == 1:
+        _worker.update(coords=coords, offsets=offsets, enrich=enricher_factory(*factory_args, **shared))
+        try:
+            results = [_run_shard(task) for task in tqdm(tasks, desc=desc)]
+        finally:
+            _worker.clear()
+        return _merge(results)
+
+    shms = []
+    try:
+        specs = []
+        arrays = {"coords": coords, "offsets": offsets,
+                  **{name: np.ascontiguousarray(array) for name, array in shared.items()}}
+        for key, array in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            shms.append(shm)
+            specs.append((key, shm.name, array.shape, array.dtype.str))
+
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(specs, enricher_factory, factory_args),
+        ) as pool:
+            results = list(tqdm(pool.map(_run_shard, tasks), total=len(tasks), desc=desc))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return _merge(results)
+
+
+def _init_worker(specs, enricher_factory, factory_args):
+    arrays = {}
+    for key, name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        _worker.setdefault("shms", []).append(shm)  # garder la projection ouverte
+    _worker["coords"], _worker["offsets"] = arrays.pop("coords"), arrays.pop("offsets")
+    _worker["enrich"] = enricher_factory(*factory_args, **arrays)
+
+
+def _run_shard(task):
+    start, stop, columns = task
+    offsets = _worker["offsets"][start:stop + 1]
+    coords = _worker["coords"][offsets[0]:offsets[-1]] if len(_worker["coords"]) else _worker["coords"]
+    return _worker["enrich"](coords, offsets - offsets[0], columns)
+
+
+def _merge(results):
+    merged = {}
+    for name in (results[0] if results else {}):
+        parts = [r[name] for r in results]
+        if isinstance(parts[0], np.ndarray):
+            merged[name] = np.concatenate(parts)
+        else:
+            merged[name] = [value for part in parts for value in part]
+    return merged
+
+
+# === Fonctions d'enrichissement (fabriques appelées dans chaque worker)
+def dem_enricher(dem_folder, max_cache_bytes=None):
+    """
+    D+ / D- par arête, à partir d'un DemTileIndex propre au worker
+    (max_cache_bytes : budget du cache de blocs de ce worker).
+    """
+    from src.preprocessing.dem_sampler import compute_edge_dplus
+    from src.preprocessing.dem_tile_index import DemTileIndex, MAX_CACHE_BYTES
+
+    index = DemTileIndex(dem_folder, max_cache_bytes=max_cache_bytes or MAX_CACHE_BYTES)
+
+    def enrich(coords, offsets, columns):
+        dplus, dminus = compute_edge_dplus(coords, offsets, index)
+        return {"dplus": dplus, "dminus": dminus}
+    return enrich
+
+
+def heatmap_enricher(heatmap_path, band=None):
+    """
+    Intensité Strava moyenne par arête ; band : bande décodée une fois par
+    l'appelant et partagée (run_sharded(..., shared={"band": band})).
+    """
+    from src.preprocessing.strava_heatmap_parser import StravaHeatmapProcessor
+
+    processor = StravaHeatmapProcessor(heatmap_path, band=band)
+
+    def enrich(coords, offsets, columns):
+        return {"popularity": processor.compute_edges_intensity(coords, offsets)}
+    return enrich
+
@@ -1,56 +1,146 @@
 # src/preprocessing/strava_heatmap_parser.py
 
 import rasterio
-from shapely.geometry import LineString
+from rasterio.crs import CRS
 import numpy as np
-import networkx as nx
+from pyproj import Transformer
+
+from src.utils.geo import flatten_geometries, geodesic_lengths
+from src.preprocessing.dem_sampler import world_to_pixel
+
+SAMPLE_STEP_M = 10.0  # un échantillon tous les ~10 m le long d'une arête
+MIN_SAMPLES = 2       # au moins les deux extrémités
 
 class StravaHeatmapProcessor:
     """
     Classe utilitaire pour extraire les intensités Strava à partir d'une heatmap raster
     et les projeter sur les arêtes d'un graphe OSM.
+
+    La bande est décodée une seule fois à l'initialisation ; toutes les arêtes
+    sont ensuite échantillonnées en un appel vectorisé.
     """
 
-    def __init__(self, heatmap_path):
+    def __init__(self, heatmap_path, step_m=SAMPLE_STEP_M, band=None):
         """
-        Initialise le processeur avec le chemin vers la heatmap.
+        Initialise le processeur avec le chemin vers la heatmap ; band : bande
+        déjà décodée (mémoire partagée entre workers), lue dans le fichier sinon.
         """
         self.heatmap_path = heatmap_path
-        self.dataset = rasterio.open(heatmap_path)
+        self.step_m = step_m
+        with rasterio.open(heatmap_path) as src:
+            self.band = src.read(1) if band is None else band
+            self.transform = src.transform
+            self.nodata = src.nodata if src.nodata is not None else 0
+            self.crs = src.crs
+
+        # Les géométries du graphe sont en lon/lat : reprojection si la heatmap ne l'est pas
+        self._to_raster = None
+        if self.crs is not None and self.crs != CRS.from_epsg(4326):
+            self._to_raster = Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+
+    def sample_points(self, lon, lat):
+        """
+        Valeurs de la heatmap aux points (lon, lat) ; 0 hors image ou en nodata.
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        x, y = self._to_raster.transform(lon, lat) if self._to_raster else (lon, lat)
+        rows, cols = world_to_pixel(self.transform, x, y)
+        height, width = self.band.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        values = np.zeros(len(lon), dtype=np.float64)
+        values[inside] = self.band[rows[inside], cols[inside]]
+        values[values == self.nodata] = 0
+        return values
 
     def get_intensity_at_point(self, lon, lat):
         """
         Récupère la valeur de la heatmap à une coordonnée (lon, lat).
         """
-        try:
-            row, col = self.dataset.index(lon, lat)
-            return self.dataset.read(1)[row, col]
-        except IndexError:
-            return 0  # Valeur nulle si le point est hors image
+        return float(self.sample_points([lon], [lat])[0])
+
+    def compute_edges_intensity(self, coords, offsets):
+        """
+        Intensité moyenne de chaque arête à partir des géométries aplaties
+        (coords en lon, lat ; arête i = coords[offsets[i]:offsets[i + 1]]).
+        Le nombre d'échantillons dépend de la longueur de l'arête ; seuls les
+        échantillons d'intensité > 0 entrent dans la moyenne (0 sinon).
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        n_edges = len(offsets) - 1
+        counts = np.diff(offsets)
+        if n_edges == 0 or len(coords) < 2:
+            return np.zeros(n_edges)
 
-    def compute_edge_intensity(self, edge_geometry, n_points=10):
+        lengths = geodesic_lengths(coords, offsets)
+        n_samples = np.where(
+            counts >= 2,
+            np.maximum(MIN_SAMPLES, np.ceil(lengths / self.step_m).astype(np.int64) + 1),
+            0,
+        )
+        lon, lat, edge_of_sample = interpolate_along(coords, offsets, n_samples)
+
+        values = self.sample_points(lon, lat)
+        positive = values > 0
+        sums = np.bincount(edge_of_sample, weights=np.where(positive, values, 0.0), minlength=n_edges)
+        hits = np.bincount(edge_of_sample, weights=positive, minlength=n_edges)
+        return np.divide(sums, hits, out=np.zeros(n_edges), where=hits > 0)
+
+    def compute_edge_intensity(self, edge_geometry):
         """
         Moyenne de l'intensité Strava le long d'une arête.
         """
-        points = [
-            edge_geometry.interpolate(dist, normalized=True)
-            for dist in np.linspace(0, 1, num=n_points)
-        ]
-        intensities = [
-            self.get_intensity_at_point(p.x, p.y)
-            for p in points
-        ]
-        return np.mean(intensities) if intensities else 0
+        coords, offsets = flatten_geometries([edge_geometry])
+        return float(self.compute_edges_intensity(coords, offsets)[0])
 
     def enrich_graph(self, G, geometry_key="geometry", output_key="strava"):
         """
-        Ajoute un attribut d'intensité Strava à chaque arête du graphe G.
+        Ajoute un attribut d'intensité Strava à chaque arête du graphe G
+        (multigraphe compris). Sans géométrie, l'intensité vaut 0.
         """
-        for u, v, data in G.edges(data=True):
-            geom = data.get(geometry_key)
-            if isinstance(geom, LineString):
-                intensity = self.compute_edge_intensity(geom)
-                data[output_key] = intensity
-            else:
-                data[output_key] = 0  # Si pas de géométrie, valeur par défaut
+        if G.is_multigraph():
+            edge_data = [data for _, _, _, data in G.edges(keys=True, data=True)]
+        else:
+            edge_data = [data for _, _, data in G.edges(data=True)]
+        coords, offsets = flatten_geometries([data.get(geometry_key) for data in edge_data])
+        intensities = self.compute_edges_intensity(coords, offsets)
+        for data, intensity in zip(edge_data, intensities):
+            data[output_key] = float(intensity)
         return G
+
+
+def interpolate_along(coords, offsets, n_samples):
+    """
+    Points régulièrement espacés le long de chaque géométrie aplatie
+    (équivalent vectorisé de LineString.interpolate(t, normalized=True)).
+    Renvoie (x, y, index de l'arête de chaque échantillon).
+    """
+    n_edges = len(offsets) - 1
+    seg = np.hypot(*np.diff(coords, axis=0).T)
+    # Les paires de sommets à cheval sur deux arêtes ne comptent pas
+    boundaries = offsets[1:-1] - 1
+    seg[boundaries[(boundaries >= 0) & (boundaries < len(seg))]] = 0.0
+    cum = np.concatenate(([0.0], np.cumsum(seg)))
+
+    has_geom = n_samples > 0
+    first = offsets[:-1]
+    last = np.where(has_geom, offsets[1:] - 1, first)
+    edge_of_sample = np.repeat(np.arange(n_edges), n_samples)
+    sample_start = np.concatenate(([0], np.cumsum(n_samples)[:-1]))
+    local = np.arange(len(edge_of_sample)) - sample_start[edge_of_sample]
+    denom = np.maximum(n_samples - 1, 1)[edge_of_sample]
+    t = local / denom
+
+    start_len = cum[first[edge_of_sample]]
+    end_len = cum[last[edge_of_sample]]
+    s = start_len + t * (end_len - start_len)
+
+    idx = np.searchsorted(cum, s, side="right") - 1
+    idx = np.clip(idx, first[edge_of_sample], last[edge_of_sample] - 1)
+    seg_len = seg[idx]
+    frac = np.divide(s - cum[idx], seg_len, out=np.zeros_like(s), where=seg_len > 0)
+    frac = np.clip(frac, 0.0, 1.0)
+
+    points = coords[idx] + frac[:, None] * (coords[idx + 1] - coords[idx])
+    return points[:, 0], points[:, 1], edge_of_sample
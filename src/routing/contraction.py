@@ -0,0 +1,322 @@
+# src/routing/contraction.py
+
+import os
+import sys
+import json
+import math
+import heapq
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GRAPH_STORE_DIR
+from src.routing.pathfinding import RoutingGraph
+from src.utils.array_io import save_arrays
+
+# === Hiérarchie écrite à côté du GraphStore (dossier séparé : le store reste
+# une entrée stable pour le pipeline)
+CH_DIR = Path("data/processed/graph_ch")
+
+# === Recherche de témoins : bornée pour garder un prétraitement raisonnable
+# (un témoin manqué ajoute un raccourci inutile, jamais un chemin faux)
+WITNESS_MAX_SETTLED = 64
+
+CH_ARRAY_NAMES = (
+    "rank",
+    "up_indptr", "up_indices", "up_cost", "up_edge",
+    "down_indptr", "down_indices", "down_cost", "down_edge",
+    "shortcut_children",
+)
+
+
+class ContractionHierarchy:
+    """
+    Hiérarchie de contraction sur les coûts d'un RoutingGraph.
+
+    - rank : ordre de contraction des nœuds,
+    - graphe montant (up_*) : arêtes u → w avec rank[w] > rank[u], parcouru
+      par la recherche avant,
+    - graphe descendant (down_*) : pour chaque nœud v, arêtes u → v avec
+      rank[u] > rank[v], parcourues à l'envers par la recherche arrière.
+
+    Les identifiants d'arêtes (up_edge, down_edge) sont ceux du GraphStore
+    pour e < n_edges ; au-delà, e désigne le raccourci e - n_edges, dont
+    shortcut_children donne les deux arêtes remplacées. Un raccourci se
+    déroule donc toujours en arêtes du store (géométrie, attributs, (u, v, k)).
+    La hiérarchie dépend des pondérations : elles sont enregistrées dans meta.
+    """
+
+    def __init__(self, arrays, meta, directory=None):
+        self.directory = Path(directory) if directory is not None else None
+        self.meta = meta
+        for name in CH_ARRAY_NAMES:
+            # np.asarray : vue ndarray sur la même projection mémoire, sans le
+            # surcoût d'indexation de np.memmap dans la boucle de requête
+            setattr(self, name, np.asarray(arrays[name]))
+        self.n_edges = meta["n_edges"]
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in CH_ARRAY_NAMES}
+
+    # === Construction
+    @classmethod
+    def build(cls, graph, witness_max_settled=WITNESS_MAX_SETTLED):
+        """
+        Contracte les nœuds un par un, par priorité croissante (différence
+        d'arêtes + voisins déjà contractés + profondeur ; voisins recalculés
+        après chaque contraction, nœud dépilé revérifié paresseusement),
+        en ajoutant un raccourci u → w chaque fois que le chemin u → v → w
+        n'a pas de témoin plus court.
+        """
+        store = graph.store
+        n_nodes, n_edges = graph.n_nodes, store.n_edges
+
+        # Graphe restant : out[u][w] = (coût, id), inn[w][u] = (coût, id) ;
+        # arêtes parallèles réduites à la moins chère, boucles ignorées
+        out = [dict() for _ in range(n_nodes)]
+        inn = [dict() for _ in range(n_nodes)]
+        src = np.asarray(store.edge_src).tolist()
+        dst = np.asarray(store.indices).tolist()
+        for e, (u, w, c) in enumerate(zip(src, dst, graph.cost.tolist())):
+            if u != w and (w not in out[u] or c < out[u][w][0]):
+                out[u][w] = inn[w][u] = (c, e)
+
+        children = []
+        rank = np.full(n_nodes, -1, dtype=np.int32)
+        deleted = [0] * n_nodes
+        level = [0] * n_nodes   # profondeur dans la hiérarchie (répartit la contraction)
+        up, down = [], []
+
+        def witness(u, v, max_cost):
+            """Dijkstra borné depuis u dans le graphe restant, sans passer par v."""
+            dist = {u: 0.0}
+            heap = [(0.0, u)]
+            settled = 0
+            while heap and settled < witness_max_settled:
+                d, x = heapq.heappop(heap)
+                if d > max_cost:
+                    break
+                if d > dist[x]:
+                    continue
+                settled += 1
+                for y, (c, _) in out[x].items():
+                    if y == v:
+                        continue
+                    nd = d + c
+                    if nd < dist.get(y, math.inf):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+            return dist
+
+        def shortcuts(v):
+            """Raccourcis nécessaires pour contracter v : [(u, w, coût, id_uv, id_vw)]."""
+            needed = []
+            if not out[v]:
+                return needed
+            max_out = max(c for c, _ in out[v].values())
+            for u, (c_uv, id_uv) in inn[v].items():
+                dist = witness(u, v, c_uv + max_out)
+                for w, (c_vw, id_vw) in out[v].items():
+                    if w == u:
+                        continue
+                    cost = c_uv + c_vw
+                    if dist.get(w, math.inf) > cost:
+                        needed.append((u, w, cost, id_uv, id_vw))
+            return needed
+
+        def priority(v):
+            return len(shortcuts(v)) - len(inn[v]) - len(out[v]) + deleted[v] + level[v]
+
+        current = [priority(v) for v in tqdm(range(n_nodes), desc="🔢 Priorités initiales")]
+        heap = [(p, v) for v, p in enumerate(current)]
+        heapq.heapify(heap)
+        with tqdm(total=n_nodes, desc="🔧 Contraction") as progress:
+            order = 0
+            while heap:
+                p, v = heapq.heappop(heap)
+                if rank[v] >= 0 or p != current[v]:
+                    continue  # entrée périmée
+                # Mise à jour paresseuse : si la priorité a augmenté, on repousse
+                p = priority(v)
+                if heap and p > heap[0][0]:
+                    current[v] = p
+                    heapq.heappush(heap, (p, v))
+                    continue
+
+                for u, w, cost, id_uv, id_vw in shortcuts(v):
+                    if w not in out[u] or cost < out[u][w][0]:
+                        sid = n_edges + len(children)
+                        children.append((id_uv, id_vw))
+                        out[u][w] = inn[w][u] = (cost, sid)
+
+                neighbors = set(out[v]) | set(inn[v])
+                for w, (c, e) in out[v].items():
+                    up.append((v, w, c, e))
+                    del inn[w][v]
+                for u, (c, e) in inn[v].items():
+                    down.append((v, u, c, e))
+                    del out[u][v]
+                out[v], inn[v] = {}, {}
+
+                # Les voisins changent de priorité : mise à jour immédiate
+                for x in neighbors:
+                    deleted[x] += 1
+                    level[x] = max(level[x], level[v] + 1)
+                    current[x] = priority(x)
+                    heapq.heappush(heap, (current[x], x))
+
+                rank[v] = order
+                order += 1
+                progress.update(1)
+
+        arrays = {"rank": rank}
+        for prefix, entries in (("up", up), ("down", down)):
+            arrays.update(_csr(prefix, entries, n_nodes))
+        arrays["shortcut_children"] = np.array(children, dtype=np.int64).reshape(-1, 2)
+
+        meta = {
+            "graph_version": store.version,
+            "weights": graph.weights,
+            "n_nodes": int(n_nodes),
+            "n_edges": int(n_edges),
+            "n_shortcuts": len(children),
+        }
+        return cls(arrays, meta)
+
+    # === Entrées / sorties
+    def save(self, directory=CH_DIR):
+        self.directory = save_arrays(directory, self.arrays(), self.meta)
+        return self.directory
+
+    @classmethod
+    def load(cls, directory=CH_DIR, mmap=True):
+        directory = Path(directory)
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            raise FileNotFoundError(f"❌ Hiérarchie introuvable ou incomplète : {directory}")
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in CH_ARRAY_NAMES}
+        return cls(arrays, meta, directory)
+
+    def matches(self, graph):
+        """Vrai si la hiérarchie a été construite pour ce graphe et ces pondérations."""
+        return (self.meta["graph_version"] == graph.store.version
+                and self.meta["weights"] == graph.weights)
+
+    # === Requêtes
+    def unpack(self, edge_ids):
+        """Déroule des arêtes de la hiérarchie en arêtes du GraphStore."""
+        edges = []
+        stack = list(reversed(edge_ids))
+        while stack:
+            e = stack.pop()
+            if e < self.n_edges:
+                edges.append(e)
+            else:
+                first, second = self.shortcut_children[e - self.n_edges]
+                stack.append(int(second))
+                stack.append(int(first))
+        return edges
+
+    def query(self, source, target):
+        """
+        Dijkstra bidirectionnel dans la hiérarchie (les deux recherches ne
+        montent que vers des rangs plus élevés). Renvoie (arêtes du store,
+        coût) ou None si target est inaccessible.
+        """
+        if source == target:
+            return [], 0.0
+        # Les tableaux restent mappés en mémoire : une requête ne lit que les
+        # quelques centaines de nœuds de rang élevé qu'elle visite
+        graphs = (
+            (self.up_indptr, self.up_indices, self.up_cost),
+            (self.down_indptr, self.down_indices, self.down_cost),
+        )
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({}, {})  # nœud → (position dans up / down, nœud précédent)
+        heaps = ([(0.0, source)], [(0.0, target)])
+        done = (set(), set())
+        best, meeting = math.inf, -1
+
+        while heaps[0] or heaps[1]:
+            tops = [h[0][0] if h else math.inf for h in heaps]
+            if min(tops) >= best:
+                break
+            side = 0 if tops[0] <= tops[1] else 1
+            d, u = heapq.heappop(heaps[side])
+            if u in done[side]:
+                continue
+            done[side].add(u)
+            other = dist[1 - side].get(u)
+            if other is not None and d + other < best:
+                best, meeting = d + other, u
+
+            # Stall-on-demand : u est atteint plus court par un nœud de rang
+            # supérieur, inutile de le développer
+            own_dist, own_parent = dist[side], parent[side]
+            indptr, indices, cost = graphs[1 - side]
+            start, stop = int(indptr[u]), int(indptr[u + 1])
+            if any(own_dist.get(w, math.inf) + c < d
+                   for w, c in zip(indices[start:stop].tolist(), cost[start:stop].tolist())):
+                continue
+
+            indptr, indices, cost = graphs[side]
+            start, stop = int(indptr[u]), int(indptr[u + 1])
+            for i, v, c in zip(range(start, stop), indices[start:stop].tolist(), cost[start:stop].tolist()):
+                nd = d + c
+                if nd < own_dist.get(v, math.inf):
+                    own_dist[v] = nd
+                    own_parent[v] = (i, u)
+                    heapq.heappush(heaps[side], (nd, v))
+
+        if meeting < 0:
+            return None
+
+        # Arêtes de la hiérarchie : montée depuis source puis descente vers target
+        forward, v = [], meeting
+        while v in parent[0]:
+            i, v = parent[0][v]
+            forward.append(int(self.up_edge[i]))
+        forward.reverse()
+        backward, v = [], meeting
+        while v in parent[1]:
+            i, v = parent[1][v]
+            backward.append(int(self.down_edge[i]))
+        return self.unpack(forward + backward), best
+
+
+def _csr(prefix, entries, n_nodes):
+    """Entrées (nœud, voisin, coût, id) → tableaux CSR triés par nœud."""
+    if entries:
+        node, other, cost, edge = (np.array(col) for col in zip(*entries))
+    else:
+        node = other = edge = np.empty(0, dtype=np.int64)
+        cost = np.empty(0, dtype=np.float64)
+    order = np.argsort(node, kind="stable")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(node, minlength=n_nodes), out=indptr[1:])
+    return {
+        f"{prefix}_indptr": indptr,
+        f"{prefix}_indices": other[order].astype(np.int32),
+        f"{prefix}_cost": cost[order].astype(np.float64),
+        f"{prefix}_edge": edge[order].astype(np.int64),
+    }
+
+
+def build_hierarchy(store_dir=GRAPH_STORE_DIR, ch_dir=CH_DIR, weights=None):
+    """Construit et enregistre la hiérarchie du GraphStore."""
+    graph = RoutingGraph.load(store_dir, weights)
+    print(f"📥 Graphe chargé : {graph.n_nodes} nœuds, {graph.store.n_edges} arêtes")
+    ch = ContractionHierarchy.build(graph)
+    ch.save(ch_dir)
+    print(f"💾 Hiérarchie écrite : {ch_dir} ({ch.meta['n_shortcuts']} raccourcis)")
+    return ch
+
+
+if __name__ == "__main__":
+    build_hierarchy()
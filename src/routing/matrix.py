@@ -0,0 +1,108 @@
+# src/routing/matrix.py
+
+import os
+import sys
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from shapely.geometry import MultiPoint
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.routing.pathfinding import RoutingGraph
+
+CONCAVE_RATIO = 0.3      # 0 = enveloppe très serrée, 1 = enveloppe convexe
+METRICS = ("cost", "distance", "dplus")
+
+# === Graphe propre à chaque processus worker
+_worker = {}
+
+
+def cost_matrix(graph, sources, targets, metric="cost", max_cost=math.inf, n_workers=1):
+    """
+    Matrice N sources × M cibles en un appel : une recherche par source
+    (arrêtée dès que toutes les cibles sont fixées) sert toutes les cibles.
+    metric : "cost" (coût pondéré), "distance" (m) ou "dplus" (m), cumulés le
+    long du chemin de coût minimal. inf pour les cibles inaccessibles.
+    Avec n_workers > 1, les sources sont réparties sur un pool de processus
+    (le graphe doit provenir d'un GraphStore sur disque).
+    """
+    if metric not in METRICS:
+        raise ValueError(f"❌ Métrique inconnue : {metric} (disponibles : {METRICS})")
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    tasks = [(int(s), targets, metric, max_cost) for s in sources]
+    rows = _map_sources(graph, _matrix_row, tasks, n_workers)
+    return np.vstack(rows) if rows else np.empty((0, len(targets)))
+
+
+def isochrone(graph, source, max_cost=math.inf, max_distance=math.inf, max_dplus=math.inf,
+              polygon=True, concave_ratio=CONCAVE_RATIO):
+    """
+    Nœuds atteignables depuis source sans dépasser les limites de coût, de
+    distance (m) et de D+ (m) cumulés, et enveloppe (concave si possible)
+    de ces nœuds en (lon, lat).
+    Renvoie {"nodes", "distance", "dplus", "polygon"}.
+    """
+    _, _, meters, climb = graph.bounded_dijkstra(
+        int(source), max_cost=max_cost, max_distance=max_distance, max_dplus=max_dplus
+    )
+    nodes = np.flatnonzero(np.isfinite(meters))
+    result = {"nodes": nodes, "distance": meters[nodes], "dplus": climb[nodes], "polygon": None}
+    if polygon:
+        result["polygon"] = isochrone_polygon(graph, nodes, concave_ratio)
+    return result
+
+
+def isochrones(graph, sources, max_cost=math.inf, max_distance=math.inf, max_dplus=math.inf,
+               polygon=True, concave_ratio=CONCAVE_RATIO, n_workers=1):
+    """isochrone() pour plusieurs sources, réparties sur n_workers processus."""
+    tasks = [(int(s), max_cost, max_distance, max_dplus, polygon, concave_ratio) for s in sources]
+    return _map_sources(graph, _isochrone_task, tasks, n_workers)
+
+
+def isochrone_polygon(graph, nodes, concave_ratio=CONCAVE_RATIO):
+    """Enveloppe concave (shapely.concave_hull) des nœuds ; convexe si concave_ratio >= 1."""
+    points = MultiPoint(np.column_stack((graph.lon[nodes], graph.lat[nodes])))
+    if concave_ratio >= 1:
+        return shapely.convex_hull(points)
+    return shapely.concave_hull(points, ratio=concave_ratio)
+
+
+# === Exécution par source (en ligne ou dans un pool)
+def _map_sources(graph, func, tasks, n_workers):
+    if n_workers <= 1 or len(tasks) <= 1:
+        _worker["graph"] = graph
+        try:
+            return [func(task) for task in tasks]
+        finally:
+            _worker.clear()
+
+    directory = graph.store.directory
+    if directory is None:
+        raise ValueError("❌ Exécution parallèle : le graphe doit être chargé depuis un GraphStore sur disque")
+    chunksize = max(1, len(tasks) // (n_workers * 4))
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=_init_worker,
+        initargs=(str(directory), graph.weights),
+    ) as pool:
+        return list(pool.map(func, tasks, chunksize=chunksize))
+
+
+def _init_worker(store_dir, weights):
+    # Le GraphStore est mappé en mémoire : les pages sont partagées entre workers
+    _worker["graph"] = RoutingGraph.load(store_dir, weights)
+
+
+def _matrix_row(task):
+    source, targets, metric, max_cost = task
+    dist, _, meters, climb = _worker["graph"].bounded_dijkstra(source, targets=targets, max_cost=max_cost)
+    values = {"cost": dist, "distance": meters, "dplus": climb}[metric]
+    return values[targets]
+
+
+def _isochrone_task(task):
+    source, max_cost, max_distance, max_dplus, polygon, concave_ratio = task
+    return isochrone(_worker["graph"], source, max_cost, max_distance, max_dplus, polygon, concave_ratio)
@@ -0,0 +1,467 @@
+# src/routing/pathfinding.py
+
+import os
+import sys
+import math
+import heapq
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.utils.geo import EARTH_RADIUS_M, haversine_m
+
+# === Pondérations par défaut du coût d'une arête
+DEFAULT_WEIGHTS = {
+    "distance": 1.0,     # par mètre
+    "dplus": 8.0,        # par mètre de dénivelé positif
+    "popularity": 0.3,   # par mètre, à popularité nulle (0 si popularité maximale)
+    "surface": 0.5,      # par mètre, multiplié par la pénalité de la surface
+}
+
+POPULARITY_MAX = 255.0   # intensité maximale de la heatmap (uint8)
+
+# === Pénalité relative par type de surface (0 = roulant)
+SURFACE_PENALTY = {
+    "asphalt": 0.0,
+    "paved": 0.0,
+    "concrete": 0.0,
+    "paving_stones": 0.2,
+    "compacted": 0.2,
+    "fine_gravel": 0.3,
+    "gravel": 0.5,
+    "unpaved": 0.5,
+    "stone": 0.6,
+    "sett": 0.6,
+    "cobblestone": 0.7,
+    "dirt": 0.7,
+    "ground": 0.7,
+    "grass": 0.9,
+    "mud": 1.0,
+    "sand": 1.0,
+}
+DEFAULT_SURFACE_PENALTY = 0.4  # surface inconnue ou absente
+
+# Heuristique = distance à vol d'oiseau × poids distance, légèrement réduite :
+# la sphère moyenne peut surestimer de ~0,5 % la distance sur l'ellipsoïde.
+HEURISTIC_SCALE = 0.99
+
+
+def edge_distances(store):
+    """
+    Distance (m) de chaque arête ; une distance absente est remplacée par la
+    distance à vol d'oiseau entre les deux nœuds.
+    """
+    distance = np.asarray(store.distance, dtype=np.float64)
+    missing = np.isnan(distance)
+    if missing.any():
+        src, dst = store.edge_src[missing], store.indices[missing]
+        distance = distance.copy()
+        distance[missing] = haversine_m(store.node_x[src], store.node_y[src],
+                                        store.node_x[dst], store.node_y[dst])
+    return np.maximum(distance, 0.0)
+
+
+def surface_penalties(store):
+    """Pénalité de surface (SURFACE_PENALTY) de chaque arête."""
+    penalties = np.array(
+        [SURFACE_PENALTY.get(s, DEFAULT_SURFACE_PENALTY) for s in store.surface_labels]
+        + [DEFAULT_SURFACE_PENALTY]  # code -1 : surface absente
+    )
+    return penalties[store.surface]
+
+
+def edge_costs(store, weights=None):
+    """
+    Coût de chaque arête du GraphStore, combinaison positive de la distance,
+    du D+, de la popularité et de la surface :
+
+        d × (w_distance + w_surface × pénalité + w_popularity × (1 - pop / 255))
+        + w_dplus × D+
+
+    D+ et popularité absents valent 0.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    if any(w < 0 for w in weights.values()):
+        raise ValueError(f"❌ Pondérations négatives : {weights}")
+
+    distance = edge_distances(store)
+    dplus = np.nan_to_num(np.asarray(store.dplus, dtype=np.float64), nan=0.0)
+    popularity = np.clip(np.nan_to_num(np.asarray(store.popularity, dtype=np.float64), nan=0.0)
+                         / POPULARITY_MAX, 0.0, 1.0)
+
+    per_meter = (weights["distance"]
+                 + weights["surface"] * surface_penalties(store)
+                 + weights["popularity"] * (1.0 - popularity))
+    return distance * per_meter + weights["dplus"] * np.maximum(dplus, 0.0)
+
+
+class Route:
+    """Itinéraire : index des nœuds et des arêtes du GraphStore, coût total."""
+
+    def __init__(self, nodes, edges, cost):
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.cost = float(cost)
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f"Route({len(self.nodes)} nœuds, coût {self.cost:.1f})"
+
+
+def _view(array):
+    """memoryview d'un tableau contigu (les tableaux mappés ne sont pas copiés)."""
+    return memoryview(np.ascontiguousarray(array))
+
+
+class RoutingGraph:
+    """
+    Moteur de plus courts chemins sur l'adjacence CSR d'un GraphStore.
+
+    Le coût des arêtes est calculé une fois (edge_costs) ; les recherches
+    (Dijkstra, A*, A* bidirectionnel) utilisent un tas binaire et des tableaux
+    numpy de distances et de prédécesseurs alloués par requête, ce qui permet
+    des requêtes concurrentes sur le même objet. Les prédécesseurs sont des
+    index d'arêtes : un chemin se déroule directement en arêtes du store
+    (et donc en (u, v, k), géométries et attributs).
+
+    La boucle de relaxation accède aux tableaux (adjacence, coûts, distances
+    et prédécesseurs de la requête) par des memoryview : accès scalaire rapide
+    sans copie, l'adjacence reste celle du store mappé en mémoire (pages
+    partagées entre processus).
+    """
+
+    def __init__(self, store, weights=None):
+        self.store = store
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.n_nodes = store.n_nodes
+        self.cost = edge_costs(store, self.weights)
+        self.distance = edge_distances(store)
+        self.surface_penalty = surface_penalties(store)
+        self.lon = np.asarray(store.node_x, dtype=np.float64)
+        self.lat = np.asarray(store.node_y, dtype=np.float64)
+
+        # Vues scalaires pour la boucle de relaxation (sans copie du store)
+        self._indptr = _view(store.indptr)
+        self._indices = _view(store.indices)
+        self._cost = _view(self.cost)
+        self._distance = _view(self.distance)
+        self._dplus = _view(np.maximum(np.nan_to_num(np.asarray(store.dplus, dtype=np.float64)), 0.0))
+        self._reverse = None
+
+        self._rad_lon = _view(np.radians(self.lon))
+        self._rad_lat = _view(np.radians(self.lat))
+        self._cos_lat = _view(np.cos(np.radians(self.lat)))
+        self._h_scale = HEURISTIC_SCALE * self.weights["distance"] * EARTH_RADIUS_M * 2
+
+        self.hierarchy = None
+
+    @classmethod
+    def load(cls, directory=GRAPH_STORE_DIR, weights=None, hierarchy_dir=None):
+        """
+        Charge le GraphStore (mappé en mémoire) ; avec hierarchy_dir, charge
+        aussi la hiérarchie de contraction pour le mode "ch".
+        """
+        graph = cls(GraphStore.load(directory), weights)
+        if hierarchy_dir is not None:
+            from src.routing.contraction import ContractionHierarchy
+            graph.use_hierarchy(ContractionHierarchy.load(hierarchy_dir))
+        return graph
+
+    def use_hierarchy(self, hierarchy):
+        """Active le mode "ch" ; la hiérarchie doit correspondre au graphe et aux pondérations."""
+        if not hierarchy.matches(self):
+            raise ValueError("❌ Hiérarchie construite pour un autre graphe ou d'autres pondérations")
+        self.hierarchy = hierarchy
+
+    # === Utilitaires
+    def _reverse_adjacency(self):
+        """
+        Adjacence inverse (arêtes entrantes) pour la recherche arrière,
+        construite au premier besoin : (rev_indptr, rev_edges, rev_src).
+        """
+        if self._reverse is None:
+            indices = self.store.indices
+            order = np.argsort(indices, kind="stable")
+            rev_indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(indices, minlength=self.n_nodes), out=rev_indptr[1:])
+            self._reverse = (_view(rev_indptr), _view(order), _view(np.asarray(self.store.edge_src)[order]))
+        return self._reverse
+
+    def nearest_node(self, lon, lat):
+        """Index du nœud le plus proche de (lon, lat)."""
+        return int(np.argmin(haversine_m(self.lon, self.lat, lon, lat)))
+
+    def _heuristic(self, target):
+        """Minorant du coût restant jusqu'à target (0 si le poids distance est nul)."""
+        if self._h_scale == 0:
+            return lambda v: 0.0
+        lon_t, lat_t, cos_t = self._rad_lon[target], self._rad_lat[target], self._cos_lat[target]
+        rad_lon, rad_lat, cos_lat, scale = self._rad_lon, self._rad_lat, self._cos_lat, self._h_scale
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+
+        def h(v):
+            a = sin((rad_lat[v] - lat_t) / 2) ** 2 + cos_lat[v] * cos_t * sin((rad_lon[v] - lon_t) / 2) ** 2
+            return scale * asin(sqrt(min(a, 1.0)))
+        return h
+
+    def _unpack(self, edges, cost):
+        if not edges:
+            return None
+        nodes = [self.store.edge_src[edges[0]]] + [self._indices[e] for e in edges]
+        return Route(nodes, edges, cost)
+
+    def path_edges(self, pred, target):
+        """Arêtes du chemin jusqu'à target à partir d'un tableau de prédécesseurs."""
+        edges = []
+        v = target
+        while pred[v] >= 0:
+            e = int(pred[v])
+            edges.append(e)
+            v = int(self.store.edge_src[e])
+        edges.reverse()
+        return edges
+
+    def route_stats(self, route):
+        """
+        Distance, D+, D- totaux ; popularité et pénalité de surface moyennes
+        (pondérées par la distance).
+        """
+        edges = route.edges
+        distance = self.distance[edges]
+        popularity = np.nan_to_num(np.asarray(self.store.popularity[edges], dtype=np.float64))
+        surface = self.surface_penalty[edges]
+        total = float(distance.sum())
+        return {
+            "distance": total,
+            "dplus": float(np.nansum(self.store.dplus[edges])),
+            "dminus": float(np.nansum(self.store.dminus[edges])),
+            "popularity": float((popularity * distance).sum() / total) if total > 0 else 0.0,
+            "surface": float((surface * distance).sum() / total) if total > 0 else 0.0,
+        }
+
+    # === Recherches
+    def dijkstra(self, source, target=None, max_cost=math.inf):
+        """
+        Dijkstra depuis source. S'arrête à target (si fourni) ou au-delà de
+        max_cost. Renvoie (dist, pred) : tableaux numpy de taille n_nodes,
+        dist = inf et pred = -1 pour les nœuds non atteints, pred = index de
+        l'arête d'arrivée.
+        """
+        dist = _view(np.full(self.n_nodes, np.inf))
+        pred = _view(np.full(self.n_nodes, -1, dtype=np.int64))
+        settled = _view(np.zeros(self.n_nodes, dtype=bool))
+        indptr, indices, cost = self._indptr, self._indices, self._cost
+
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            if d > max_cost:
+                break
+            settled[u] = True
+            if u == target:
+                break
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + cost[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        dist, pred, settled = np.asarray(dist), np.asarray(pred), np.asarray(settled)
+        dist[~settled] = np.inf
+        pred[~settled] = -1
+        return dist, pred
+
+    def bounded_dijkstra(self, source, targets=None, max_cost=math.inf,
+                         max_distance=math.inf, max_dplus=math.inf):
+        """
+        Dijkstra (sur le coût) depuis source, qui cumule aussi la distance et le
+        D+ le long de l'arbre des chemins de coût minimal. Un nœud n'est
+        développé que si ces cumuls restent sous max_cost / max_distance /
+        max_dplus ; avec targets, la recherche s'arrête dès que tous sont fixés.
+        Une seule recherche sert ainsi toutes les cibles d'une source.
+        Renvoie (dist, pred, distance, dplus) : inf / -1 hors de portée.
+        """
+        n = self.n_nodes
+        dist = _view(np.full(n, np.inf))
+        pred = _view(np.full(n, -1, dtype=np.int64))
+        meters = _view(np.full(n, np.inf))
+        climb = _view(np.full(n, np.inf))
+        settled = _view(np.zeros(n, dtype=bool))
+        indptr, indices, cost = self._indptr, self._indices, self._cost
+        edge_distance, edge_dplus = self._distance, self._dplus
+        remaining = set(int(t) for t in targets) if targets is not None else None
+
+        dist[source], meters[source], climb[source] = 0.0, 0.0, 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            settled[u] = True
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            m_u, c_u = meters[u], climb[u]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + cost[e]
+                if nd < dist[v]:
+                    m, c = m_u + edge_distance[e], c_u + edge_dplus[e]
+                    if nd > max_cost or m > max_distance or c > max_dplus:
+                        continue
+                    dist[v], meters[v], climb[v] = nd, m, c
+                    pred[v] = e
+                    heapq.heappush(heap, (nd, v))
+        dist, pred, settled = np.asarray(dist), np.asarray(pred), np.asarray(settled)
+        meters, climb = np.asarray(meters), np.asarray(climb)
+        for array in (dist, meters, climb):
+            array[~settled] = np.inf
+        pred[~settled] = -1
+        return dist, pred, meters, climb
+
+    def astar(self, source, target):
+        """A* vers target avec l'heuristique à vol d'oiseau. Renvoie une Route ou None."""
+        if source == target:
+            return Route([source], [], 0.0)
+        h = self._heuristic(target)
+        dist = _view(np.full(self.n_nodes, np.inf))
+        pred = _view(np.full(self.n_nodes, -1, dtype=np.int64))
+        settled = _view(np.zeros(self.n_nodes, dtype=bool))
+        indptr, indices, cost = self._indptr, self._indices, self._cost
+
+        dist[source] = 0.0
+        heap = [(h(source), 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            settled[u] = True
+            if u == target:
+                return self._unpack(self.path_edges(pred, target), d)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + cost[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = e
+                    heapq.heappush(heap, (nd + h(v), nd, v))
+        return None
+
+    def bidirectional_astar(self, source, target):
+        """
+        A* bidirectionnel à potentiels moyennés (p = (h_t - h_s) / 2) : les deux
+        recherches travaillent sur les mêmes coûts réduits positifs, et l'arrêt
+        se fait dès que la somme des sommets des deux tas dépasse le meilleur
+        chemin trouvé. Renvoie une Route ou None.
+        """
+        if source == target:
+            return Route([source], [], 0.0)
+        h_t, h_s = self._heuristic(target), self._heuristic(source)
+        potentials = {}
+
+        def p(v):
+            if v not in potentials:
+                potentials[v] = (h_t(v) - h_s(v)) / 2
+            return potentials[v]
+
+        n = self.n_nodes
+        dist_f, dist_r = _view(np.full(n, np.inf)), _view(np.full(n, np.inf))
+        pred_f, succ_r = _view(np.full(n, -1, dtype=np.int64)), _view(np.full(n, -1, dtype=np.int64))
+        done_f, done_r = _view(np.zeros(n, dtype=bool)), _view(np.zeros(n, dtype=bool))
+        indptr, indices, cost = self._indptr, self._indices, self._cost
+        rev_indptr, rev_edges, rev_src = self._reverse_adjacency()
+
+        dist_f[source], dist_r[target] = 0.0, 0.0
+        heap_f, heap_r = [(p(source), source)], [(-p(target), target)]
+        best, meeting = math.inf, -1
+
+        while heap_f and heap_r:
+            if heap_f[0][0] + heap_r[0][0] >= best:
+                break
+            if heap_f[0][0] <= heap_r[0][0]:
+                _, u = heapq.heappop(heap_f)
+                if done_f[u]:
+                    continue
+                done_f[u] = True
+                d = dist_f[u]
+                for e in range(indptr[u], indptr[u + 1]):
+                    v = indices[e]
+                    nd = d + cost[e]
+                    if nd < dist_f[v]:
+                        dist_f[v] = nd
+                        pred_f[v] = e
+                        heapq.heappush(heap_f, (nd + p(v), v))
+                    if nd + dist_r[v] < best:
+                        best, meeting = nd + dist_r[v], v
+            else:
+                _, u = heapq.heappop(heap_r)
+                if done_r[u]:
+                    continue
+                done_r[u] = True
+                d = dist_r[u]
+                for i in range(rev_indptr[u], rev_indptr[u + 1]):
+                    e, v = rev_edges[i], rev_src[i]
+                    nd = d + cost[e]
+                    if nd < dist_r[v]:
+                        dist_r[v] = nd
+                        succ_r[v] = e
+                        heapq.heappush(heap_r, (nd - p(v), v))
+                    if nd + dist_f[v] < best:
+                        best, meeting = nd + dist_f[v], v
+
+        if meeting < 0:
+            return None
+        edges = self.path_edges(pred_f, meeting)
+        v = meeting
+        while succ_r[v] >= 0:
+            e = int(succ_r[v])
+            edges.append(e)
+            v = self._indices[e]
+        return self._unpack(edges, best)
+
+    def shortest_path(self, source, target, method="bidirectional"):
+        """
+        Itinéraire de coût minimal entre deux index de nœuds.
+        method : "bidirectional" (défaut), "astar", "dijkstra" ou "ch"
+        (hiérarchie de contraction, voir use_hierarchy).
+        """
+        if method == "ch":
+            if self.hierarchy is None:
+                raise ValueError("❌ Mode ch : aucune hiérarchie chargée (use_hierarchy)")
+            if source == target:
+                return Route([source], [], 0.0)
+            result = self.hierarchy.query(source, target)
+            return self._unpack(*result) if result else None
+        if method == "bidirectional":
+            return self.bidirectional_astar(source, target)
+        if method == "astar":
+            return self.astar(source, target)
+        if method == "dijkstra":
+            if source == target:
+                return Route([source], [], 0.0)
+            dist, pred = self.dijkstra(source, target)
+            if not np.isfinite(dist[target]):
+                return None
+            return self._unpack(self.path_edges(pred, target), dist[target])
+        raise ValueError(f"❌ Méthode inconnue : {method}")
+
+
+if __name__ == "__main__":
+    import time
+
+    graph = RoutingGraph.load()
+    print(f"📥 Graphe chargé : {graph.n_nodes} nœuds, {graph.store.n_edges} arêtes")
+    pairs = np.random.default_rng(0).integers(0, graph.n_nodes, size=(20, 2))
+    for method in ("dijkstra", "astar", "bidirectional"):
+        start = time.time()
+        for s, t in pairs:
+            graph.shortest_path(int(s), int(t), method=method)
+        print(f"⏱️  {method} : {(time.time() - start) / 20 * 1000:.1f} ms / requête")
@@ -0,0 +1,340 @@
+# src/routing/route_cache.py
+
+import os
+import sys
+import json
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.routing.pathfinding import RoutingGraph
+from src.routing.route_generator import LoopGenerator, SCORE_WEIGHTS
+
+ROUTE_CACHE_PATH = Path("data/cache/route_cache.sqlite")
+MAX_ENTRIES = 1024        # entrées gardées en mémoire (LRU)
+MAX_GRAPHS = 4            # graphes gardés pour des pondérations d'arêtes propres à la requête
+TTL = 6 * 3600            # durée de vie d'une entrée (s)
+PURGE_INTERVAL = 600      # purge des lignes expirées du niveau disque (s)
+VERSION_CHECK_S = 5.0     # relecture de la version du GraphStore sur disque (s)
+
+# === Quantification des requêtes : des requêtes quasi identiques partagent une entrée
+PREFERENCE_STEP = 0.05    # pondérations arrondies à 0,05
+DISTANCE_STEP = 100.0     # distance cible arrondie à 100 m
+DPLUS_STEP = 10.0         # budget D+ arrondi à 10 m
+
+MISSING = object()        # distingue « absent du cache » d'un résultat None (pas de chemin)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY, version TEXT, created REAL, value BLOB
+);
+CREATE INDEX IF NOT EXISTS entries_version ON entries (version);
+"""
+
+
+def quantize(value, step):
+    return None if value is None else round(round(value / step) * step, 6)
+
+
+def quantize_preferences(weights, step=PREFERENCE_STEP):
+    """Pondérations → tuple trié de (nom, valeur arrondie), utilisable dans une clé."""
+    return tuple(sorted((name, quantize(float(w), step)) for name, w in (weights or {}).items()))
+
+
+class RouteCache:
+    """
+    Cache des résultats de routage :
+    - niveau mémoire LRU (max_entries) avec durée de vie (ttl),
+    - niveau disque optionnel (SQLite, valeurs picklées), relu en cas d'absence
+      en mémoire,
+    - compteurs hits / misses / evictions / expired,
+    - entrées liées à une version du graphe : dès qu'une autre version est
+      vue, les entrées de l'ancienne sont supprimées (mémoire et disque),
+    - lignes expirées du disque purgées à l'ouverture puis toutes les
+      PURGE_INTERVAL secondes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL, disk_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()   # clé → (créée le, valeur)
+        self.version = None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        self.conn = None
+        self._next_purge = 0.0
+        if disk_path is not None:
+            disk_path = Path(disk_path)
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            self._purge_expired(time.time())
+
+    def _purge_expired(self, now):
+        """Supprime les lignes expirées du disque (au plus une fois par PURGE_INTERVAL)."""
+        if self.conn is None or now < self._next_purge:
+            return
+        self._next_purge = now + PURGE_INTERVAL
+        with self.conn:
+            self.conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+
+    @staticmethod
+    def key(kind, version, **params):
+        """Clé canonique (JSON trié) d'une requête pour une version du graphe."""
+        return json.dumps({"kind": kind, "version": version, **params}, sort_keys=True, default=list)
+
+    def use_version(self, version):
+        """Invalide les entrées d'une autre version du graphe."""
+        with self.lock:
+            if version == self.version:
+                return
+            self.memory.clear()
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM entries WHERE version != ?", (version,))
+            self.version = version
+
+    def get(self, key, default=None):
+        """Valeur en cache, ou default si absente ou expirée."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self.memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self.memory[key]
+                self.stats["expired"] += 1
+
+            if self.conn is not None:
+                row = self.conn.execute(
+                    "SELECT created, value FROM entries WHERE key = ? AND version = ?", (key, self.version)
+                ).fetchone()
+                if row is not None and now - row[0] <= self.ttl:
+                    value = pickle.loads(row[1])
+                    self._remember(key, row[0], value)
+                    self.stats["disk_hits"] += 1
+                    return value
+
+            self.stats["misses"] += 1
+            return default
+
+    def put(self, key, value, version):
+        """
+        Enregistre value pour la version du graphe avec laquelle elle a été
+        calculée ; ignorée si le cache est déjà passé à une autre version.
+        """
+        now = time.time()
+        with self.lock:
+            if version != self.version:
+                return
+            self._remember(key, now, value)
+            if self.conn is not None:
+                self._purge_expired(now)
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO entries (key, version, created, value) VALUES (?, ?, ?, ?)",
+                        (key, version, now, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)),
+                    )
+
+    def _remember(self, key, created, value):
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM entries")
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class CachedRouter:
+    """
+    Points d'entrée du routage (itinéraire point à point, boucles) derrière un
+    RouteCache. Les clés portent sur les identifiants OSM des nœuds de départ
+    et d'arrivée après accrochage, la méthode de recherche, les pondérations
+    quantifiées et la version du graphe ; les paramètres numériques sont
+    arrondis avant calcul, pour que des requêtes voisines partagent le même
+    résultat.
+
+    route() accepte des pondérations d'arêtes propres à la requête : elles
+    sont quantifiées, et le graphe correspondant (coûts recalculés sur le
+    même store) est gardé pour les MAX_GRAPHS jeux de pondérations les plus
+    récents.
+
+    Pour un graphe chargé depuis le disque, la version de l'artefact est
+    relue (meta.json du store et de la hiérarchie, au plus toutes les
+    VERSION_CHECK_S secondes) : un processus de longue durée recharge le
+    graphe reconstruit au lieu de servir l'ancien. Les artefacts sont
+    substitués fichier par fichier (voir utils/array_io) : l'ancien graphe
+    mappé reste lisible jusqu'au rechargement.
+    """
+
+    def __init__(self, graph, cache=None, generator=None):
+        self.graph = graph
+        self.cache = cache if cache is not None else RouteCache()
+        self.generator = generator or LoopGenerator(graph)
+        self.variants = OrderedDict()   # pondérations quantifiées → RoutingGraph
+        self._reload_lock = threading.Lock()
+        self._variants_lock = threading.Lock()
+        self._next_check = 0.0
+        hierarchy = graph.hierarchy
+        self._hierarchy_dir = hierarchy.directory if hierarchy is not None else None
+        self._store_stamp = self._stamp(graph.store.directory)
+        self._hierarchy_stamp = self._stamp(self._hierarchy_dir)
+
+    # === Suivi des artefacts sur disque
+    @staticmethod
+    def _stamp(directory):
+        try:
+            st = (Path(directory) / "meta.json").stat()
+        except (TypeError, FileNotFoundError):
+            return None  # graphe en mémoire, ou artefact en cours de réécriture
+        return st.st_size, st.st_mtime_ns
+
+    def _load_hierarchy(self, graph):
+        """Active la hiérarchie sur disque sur graph si elle lui correspond."""
+        from src.routing.contraction import ContractionHierarchy
+        try:
+            graph.use_hierarchy(ContractionHierarchy.load(self._hierarchy_dir))
+            return True
+        except (FileNotFoundError, ValueError):
+            print("⚠️ Hiérarchie de contraction absente ou pas encore reconstruite pour ce graphe")
+            return False
+
+    def refresh(self):
+        """
+        Recharge le graphe si le store sur disque a changé de version, et la
+        hiérarchie de contraction si elle a été reconstruite depuis.
+        """
+        now = time.monotonic()
+        if self.graph.store.directory is None or now < self._next_check:
+            return
+        with self._reload_lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + VERSION_CHECK_S
+            store_stamp = self._stamp(self.graph.store.directory)
+            hierarchy_stamp = self._stamp(self._hierarchy_dir)
+            if store_stamp is None or (store_stamp, hierarchy_stamp) == (self._store_stamp, self._hierarchy_stamp):
+                return
+            old = self.graph
+            graph = old
+            if store_stamp != self._store_stamp:
+                try:
+                    graph = RoutingGraph.load(old.store.directory, old.weights)
+                except (FileNotFoundError, ValueError) as e:
+                    print(f"⚠️ Rechargement du graphe impossible, ancienne version conservée : {e}")
+                    return
+                self._store_stamp = store_stamp
+                if graph.store.version == old.store.version:
+                    graph = old
+            if self._hierarchy_dir is not None and hierarchy_stamp is not None and (
+                    graph is not old or hierarchy_stamp != self._hierarchy_stamp):
+                self._hierarchy_stamp = hierarchy_stamp
+                # hiérarchie reconstruite pour le graphe courant : objet neuf, les
+                # requêtes en cours gardent l'ancien
+                candidate = graph if graph is not old else RoutingGraph(old.store, old.weights)
+                if self._load_hierarchy(candidate):
+                    graph = candidate
+            if graph is old:
+                return
+            print(f"🔄 Graphe rechargé : version {graph.store.version}, "
+                  f"mode ch {'actif' if graph.hierarchy is not None else 'inactif'}")
+            with self._variants_lock:
+                self.variants.clear()
+            self.graph, self.generator = graph, LoopGenerator(graph)
+
+    def _graph_for(self, graph, weights):
+        """Graphe dont les coûts d'arêtes suivent weights (quantifiées) ; graph si elles ne changent rien."""
+        preferences = quantize_preferences({**graph.weights, **(weights or {})})
+        if not weights or preferences == quantize_preferences(graph.weights):
+            return graph
+        with self._variants_lock:
+            variant = self.variants.get(preferences)
+            if variant is not None and variant.store is graph.store:
+                self.variants.move_to_end(preferences)
+                return variant
+        variant = RoutingGraph(graph.store, dict(preferences))
+        with self._variants_lock:
+            self.variants[preferences] = variant
+            while len(self.variants) > MAX_GRAPHS:
+                self.variants.popitem(last=False)
+        return variant
+
+    @staticmethod
+    def _snap(graph, point):
+        """Index de nœud (entier) ou (lon, lat) → index du nœud accroché."""
+        if isinstance(point, (tuple, list)):
+            return graph.nearest_node(*point)
+        return int(point)
+
+    @staticmethod
+    def _node_id(graph, node):
+        return int(graph.store.node_ids[node])
+
+    def route(self, start, end, method="bidirectional", weights=None):
+        """
+        Itinéraire de coût minimal entre deux points (voir RoutingGraph.shortest_path).
+        weights : pondérations d'arêtes de la requête (voir edge_costs), à la
+        place de celles du graphe ; le mode "ch" n'est disponible qu'avec les
+        pondérations de la hiérarchie.
+        """
+        self.refresh()
+        graph = self._graph_for(self.graph, weights)
+        version = graph.store.version
+        self.cache.use_version(version)
+        source, target = self._snap(graph, start), self._snap(graph, end)
+        key = self.cache.key(
+            "route", version,
+            start=self._node_id(graph, source), end=self._node_id(graph, target), method=method,
+            preferences=quantize_preferences(graph.weights),
+        )
+        route = self.cache.get(key, MISSING)
+        if route is MISSING:
+            route = graph.shortest_path(source, target, method=method)
+            self.cache.put(key, route, version)
+        return route
+
+    def loops(self, start, target_distance, dplus_max=None, weights=None, n_routes=3):
+        """Boucles candidates (voir LoopGenerator.generate)."""
+        self.refresh()
+        generator = self.generator
+        graph = generator.graph
+        version = graph.store.version
+        self.cache.use_version(version)
+        source = self._snap(graph, start)
+        target_distance = quantize(target_distance, DISTANCE_STEP)
+        dplus_max = quantize(dplus_max, DPLUS_STEP)
+        weights = dict(quantize_preferences({**SCORE_WEIGHTS, **(weights or {})}))
+        key = self.cache.key(
+            "loops", version,
+            start=self._node_id(graph, source), distance=target_distance, dplus_max=dplus_max,
+            n_routes=n_routes, method=generator.method, preferences=quantize_preferences(graph.weights),
+            score_weights=sorted(weights.items()),
+        )
+        loops = self.cache.get(key, MISSING)
+        if loops is MISSING:
+            loops = generator.generate(source, target_distance, dplus_max, weights, n_routes)
+            if not loops.truncated:  # résultat partiel : ne pas le figer dans le cache
+                self.cache.put(key, loops, version)
+        return loops
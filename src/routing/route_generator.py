@@ -0,0 +1,260 @@
+# src/routing/route_generator.py
+
+import os
+import sys
+import math
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.routing.pathfinding import RoutingGraph, Route, HEURISTIC_SCALE, POPULARITY_MAX
+from src.utils.geo import EARTH_RADIUS_M, haversine_m
+
+# === Pondérations par défaut du score d'une boucle (plus bas = meilleur)
+SCORE_WEIGHTS = {
+    "distance": 1.0,     # écart relatif à la distance cible
+    "dplus": 1.0,        # dépassement relatif du budget D+
+    "popularity": 0.3,   # 1 - popularité moyenne normalisée
+    "surface": 0.3,      # pénalité de surface moyenne
+    "overlap": 0.5,      # part de la distance parcourue deux fois
+}
+
+# === Recherche
+N_HEADINGS = 12                  # orientations testées pour le triangle
+RADIUS_SCALES = (1.0, 0.8, 1.25) # variations de taille du triangle
+INITIAL_DETOUR = 1.3             # distance routière / distance à vol d'oiseau
+MAX_DETOUR = 2.5                 # au-delà, un triangle trop petit est écarté sans routage
+DISTANCE_TOLERANCE = 0.15        # écart relatif accepté à la distance cible
+MAX_SIMILARITY = 0.5             # recouvrement maximal entre deux boucles retenues
+TIME_BUDGET_S = 0.8              # au-delà, on renvoie les meilleures boucles trouvées
+
+
+class LoopCandidate:
+    """Boucle candidate : itinéraire, statistiques, score et points de passage."""
+
+    def __init__(self, route, stats, score, waypoints):
+        self.route = route
+        self.stats = stats
+        self.score = score
+        self.waypoints = waypoints
+
+    def __repr__(self):
+        return (f"LoopCandidate({self.stats['distance'] / 1000:.1f} km, "
+                f"D+ {self.stats['dplus']:.0f} m, score {self.score:.3f})")
+
+
+class LoopResult:
+    """
+    Boucles retenues (triées par score) et bilan de la recherche : truncated
+    vaut True si le budget de temps a interrompu la recherche avant que tous
+    les triangles candidats soient routés.
+    """
+
+    def __init__(self, loops, truncated, n_candidates, n_pruned, n_routed):
+        self.loops = loops
+        self.truncated = truncated
+        self.n_candidates = n_candidates
+        self.n_pruned = n_pruned
+        self.n_routed = n_routed
+
+    def __iter__(self):
+        return iter(self.loops)
+
+    def __len__(self):
+        return len(self.loops)
+
+    def __getitem__(self, i):
+        return self.loops[i]
+
+    def __repr__(self):
+        return (f"LoopResult({len(self.loops)} boucles, {self.n_routed} / {self.n_candidates} triangles routés, "
+                f"{self.n_pruned} écartés{', interrompue' if self.truncated else ''})")
+
+
+class LoopGenerator:
+    """
+    Génère des boucles autour d'un point de départ, de distance et de D+
+    cibles, sans énumérer de chemins : chaque candidat est un triangle
+    départ → A → B → départ dont les deux sommets sont placés à la distance
+    voulue dans une orientation donnée, puis reliés par trois requêtes point
+    à point (hiérarchie de contraction si chargée, A* bidirectionnel sinon).
+
+    Élagage avant tout routage : le périmètre à vol d'oiseau du triangle
+    (minorant de la distance routière) est comparé à la distance maximale
+    acceptée, et un triangle dont le périmètre, même avec MAX_DETOUR, reste
+    sous la distance minimale est écarté. Les triangles restants sont routés
+    du plus prometteur au moins prometteur (écart estimé à la cible). Puis,
+    avant chaque tronçon, la distance déjà parcourue plus la distance à vol
+    d'oiseau restante est comparée au maximum ; le D+ cumulé au budget.
+    Le facteur de détour route / vol d'oiseau est recalé au fil des
+    candidats pour viser juste.
+    """
+
+    def __init__(self, graph, method=None):
+        self.graph = graph
+        self.method = method or ("ch" if graph.hierarchy is not None else "bidirectional")
+        self._dplus = np.nan_to_num(np.asarray(graph.store.dplus, dtype=np.float64))
+        self._popularity = np.clip(
+            np.nan_to_num(np.asarray(graph.store.popularity, dtype=np.float64)) / POPULARITY_MAX, 0.0, 1.0
+        )
+
+    # === Géométrie
+    def _offset_point(self, lon, lat, bearing, distance):
+        """Point à distance (m) et cap (radians) de (lon, lat), approximation locale."""
+        dlat = distance * math.cos(bearing) / EARTH_RADIUS_M
+        dlon = distance * math.sin(bearing) / (EARTH_RADIUS_M * math.cos(math.radians(lat)))
+        return lon + math.degrees(dlon), lat + math.degrees(dlat)
+
+    def _snap(self, candidates, lon, lat):
+        """Nœud le plus proche de (lon, lat) parmi les nœuds candidats."""
+        d = haversine_m(self.graph.lon[candidates], self.graph.lat[candidates], lon, lat)
+        return int(candidates[np.argmin(d)])
+
+    def _bound(self, a, b):
+        """Minorant de la distance routière entre deux nœuds."""
+        g = self.graph
+        return HEURISTIC_SCALE * float(haversine_m(g.lon[a], g.lat[a], g.lon[b], g.lat[b]))
+
+    # === Évaluation
+    def _leg_totals(self, route):
+        return float(self.graph.distance[route.edges].sum()), float(self._dplus[route.edges].sum())
+
+    def score(self, stats, edges, target_distance, dplus_max=None, weights=None):
+        """Score d'une boucle (plus bas = meilleur)."""
+        w = {**SCORE_WEIGHTS, **(weights or {})}
+        distance_error = abs(stats["distance"] - target_distance) / target_distance
+        dplus_excess = max(0.0, stats["dplus"] - dplus_max) / max(dplus_max, 1.0) if dplus_max is not None else 0.0
+        return (w["distance"] * distance_error
+                + w["dplus"] * dplus_excess
+                + w["popularity"] * (1.0 - min(stats["popularity"] / POPULARITY_MAX, 1.0))
+                + w["surface"] * stats["surface"]
+                + w["overlap"] * self.overlap(edges))
+
+    def overlap(self, edges):
+        """Part de la distance sur des tronçons parcourus plusieurs fois (dans un sens ou l'autre)."""
+        g = self.graph
+        u, v = g.store.edge_src[edges], g.store.indices[edges]
+        pairs = np.minimum(u, v).astype(np.int64) * g.n_nodes + np.maximum(u, v)
+        _, inverse, counts = np.unique(pairs, return_inverse=True, return_counts=True)
+        distance = g.distance[edges]
+        total = distance.sum()
+        return float(distance[counts[inverse] > 1].sum() / total) if total > 0 else 0.0
+
+    @staticmethod
+    def similarity(a, b):
+        """Indice de Jaccard entre les ensembles d'arêtes de deux boucles."""
+        a, b = set(a.route.edges.tolist()), set(b.route.edges.tolist())
+        return len(a & b) / len(a | b) if a or b else 1.0
+
+    # === Génération
+    def generate(self, start, target_distance, dplus_max=None, weights=None, n_routes=3,
+                 tolerance=DISTANCE_TOLERANCE, time_budget=TIME_BUDGET_S):
+        """
+        Boucles candidates depuis start (index de nœud ou (lon, lat)), triées par
+        score et deux à deux peu similaires, dans un LoopResult (truncated :
+        recherche interrompue par time_budget).
+        target_distance en mètres, dplus_max en mètres (None : pas de budget),
+        weights : pondérations du score (voir SCORE_WEIGHTS).
+        """
+        g = self.graph
+        deadline = time.perf_counter() + time_budget
+        if not isinstance(start, (int, np.integer)):
+            start = g.nearest_node(*start)
+        start = int(start)
+        lon0, lat0 = g.lon[start], g.lat[start]
+        max_distance = target_distance * (1 + tolerance)
+        min_distance = target_distance * (1 - tolerance)
+
+        # Nœuds candidats pour les sommets : emprise du plus grand triangle
+        reach = target_distance / 3 * max(RADIUS_SCALES)
+        dlat = math.degrees(reach / EARTH_RADIUS_M)
+        dlon = dlat / math.cos(math.radians(lat0))
+        nearby = np.flatnonzero((np.abs(g.lat - lat0) <= dlat) & (np.abs(g.lon - lon0) <= dlon))
+
+        detour = INITIAL_DETOUR
+        candidates, seen = [], set()
+        n_candidates = n_pruned = n_routed = 0
+        truncated = False
+        headings = [2 * math.pi * i / N_HEADINGS for i in range(N_HEADINGS)]
+        for scale in RADIUS_SCALES:
+            # Triangles de cette échelle, élagués sur leur périmètre avant routage
+            triangles = []
+            side = scale * target_distance / (3 * detour)
+            for heading in headings:
+                # Triangle équilatéral : A et B à ±30° de l'orientation
+                a = self._snap(nearby, *self._offset_point(lon0, lat0, heading - math.pi / 6, side))
+                b = self._snap(nearby, *self._offset_point(lon0, lat0, heading + math.pi / 6, side))
+                if len({start, a, b}) < 3 or (a, b) in seen:
+                    continue
+                seen.add((a, b))
+                n_candidates += 1
+                bound = self._bound(start, a) + self._bound(a, b) + self._bound(b, start)
+                if bound > max_distance or bound / HEURISTIC_SCALE * MAX_DETOUR < min_distance:
+                    n_pruned += 1
+                    continue
+                triangles.append((abs(bound / HEURISTIC_SCALE * detour - target_distance), a, b, bound))
+
+            for _, a, b, bound in sorted(triangles):
+                if time.perf_counter() > deadline:
+                    truncated = True
+                    break
+                n_routed += 1
+                loop = self._route_triangle(start, a, b, max_distance, dplus_max, tolerance)
+                if loop is None:
+                    continue
+                edges, cost, distance = loop
+
+                # Recalage du détour sur la distance obtenue
+                if bound > 0:
+                    detour = 0.5 * detour + 0.5 * distance / (bound / HEURISTIC_SCALE)
+
+                route = Route([start] + g.store.indices[edges].tolist(), edges, cost)
+                stats = g.route_stats(route)
+                candidates.append(LoopCandidate(
+                    route, stats, self.score(stats, route.edges, target_distance, dplus_max, weights), (a, b)
+                ))
+            if truncated:
+                break
+
+        return LoopResult(self._select(candidates, n_routes), truncated, n_candidates, n_pruned, n_routed)
+
+    def _route_triangle(self, start, a, b, max_distance, dplus_max, tolerance):
+        """Relie start → a → b → start ; None dès qu'un minorant dépasse les limites."""
+        legs = ((start, a, self._bound(a, b) + self._bound(b, start)),
+                (a, b, self._bound(b, start)),
+                (b, start, 0.0))
+        edges, cost, distance, dplus = [], 0.0, 0.0, 0.0
+        dplus_limit = dplus_max * (1 + tolerance) if dplus_max is not None else math.inf
+        for src, dst, remaining in legs:
+            leg = self.graph.shortest_path(src, dst, method=self.method)
+            if leg is None:
+                return None
+            leg_distance, leg_dplus = self._leg_totals(leg)
+            distance += leg_distance
+            dplus += leg_dplus
+            if distance + remaining > max_distance or dplus > dplus_limit:
+                return None
+            edges.extend(leg.edges.tolist())
+            cost += leg.cost
+        return edges, cost, distance
+
+    def _select(self, candidates, n_routes):
+        """Meilleurs candidats par score, en écartant ceux trop proches d'un candidat retenu."""
+        selected = []
+        for candidate in sorted(candidates, key=lambda c: c.score):
+            if all(self.similarity(candidate, other) <= MAX_SIMILARITY for other in selected):
+                selected.append(candidate)
+            if len(selected) == n_routes:
+                break
+        return selected
+
+
+if __name__ == "__main__":
+    graph = RoutingGraph.load()
+    generator = LoopGenerator(graph)
+    start = time.time()
+    loops = generator.generate((2.4, 48.4), target_distance=30000, dplus_max=300)
+    print(f"⏱️  {loops} en {(time.time() - start) * 1000:.0f} ms")
+    for loop in loops:
+        print(f"  {loop}")
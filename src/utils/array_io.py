@@ -0,0 +1,32 @@
+import os
+import json
+from pathlib import Path
+import numpy as np
+
+
+def save_arrays(directory, arrays, meta):
+    """
+    Écrit un dossier d'artefact : un .npy par tableau puis meta.json (écrit en
+    dernier : sa présence signale un artefact complet).
+
+    Chaque fichier est écrit à côté (.tmp) puis substitué par os.replace :
+    un processus qui a déjà projeté l'ancien fichier en mémoire garde l'ancien
+    inode intact au lieu de lire des pages réécrites sous lui (SIGBUS), et un
+    lecteur ne voit jamais de fichier à moitié écrit.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    meta_path = directory / "meta.json"
+    if meta_path.exists():
+        meta_path.unlink()
+    for name, array in arrays.items():
+        path = directory / f"{name}.npy"
+        tmp = directory / f"{name}.npy.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp, path)
+    tmp = directory / "meta.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, meta_path)
+    return directory
@@ -0,0 +1,64 @@
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+from pyproj import Geod
+
+GEOD = Geod(ellps="WGS84")
+
+
+def flatten_geometries(geometries):
+    """
+    Aplati une séquence de LineString en un tableau unique de coordonnées.
+    Renvoie (coords, offsets) : les sommets de la géométrie i sont
+    coords[offsets[i]:offsets[i + 1]]. Une entrée sans LineString a 0 sommet.
+    """
+    geoms = np.empty(len(geometries), dtype=object)
+    geoms[:] = [g if isinstance(g, LineString) else None for g in geometries]
+    counts = shapely.get_num_coordinates(geoms)
+    offsets = np.zeros(len(geoms) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    coords = shapely.get_coordinates(geoms).astype(np.float64, copy=False)
+    return coords, offsets
+
+
+def build_linestrings(coords, offsets):
+    """
+    Opération inverse de flatten_geometries : reconstruit un tableau de
+    LineString (None pour les entrées de moins de 2 sommets).
+    """
+    counts = np.diff(offsets)
+    out = np.empty(len(counts), dtype=object)
+    valid = counts >= 2
+    if valid.any():
+        keep = np.repeat(valid, counts)
+        indices = np.repeat(np.arange(valid.sum()), counts[valid])
+        out[valid] = shapely.linestrings(coords[keep], indices=indices)
+    return out
+
+
+def geodesic_lengths(coords, offsets):
+    """
+    Longueur géodésique WGS84 (m) de chaque géométrie aplatie (coords en lon, lat),
+    calculée en un seul appel Geod.inv sur tous les segments.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    offsets = np.asarray(offsets)
+    if len(coords) < 2:
+        return np.zeros(len(offsets) - 1)
+    _, _, seg = GEOD.inv(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+    cum = np.concatenate(([0.0], np.cumsum(seg)))
+
+    # Les segments à cheval sur deux géométries sont exclus par les bornes
+    start = np.minimum(offsets[:-1], len(cum) - 1)
+    end = np.maximum(offsets[1:] - 1, start)
+    return cum[end] - cum[start]
+
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    """Distance orthodromique (m) sur la sphère moyenne, vectorisée."""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
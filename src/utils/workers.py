@@ -0,0 +1,14 @@
+import os
+
+# Variable fixée par le pipeline pour chaque étape : les étapes lancées en
+# parallèle se partagent les cœurs au lieu de prendre chacune cpu_count().
+WORKERS_ENV = "SMARTROUTE_WORKERS"
+
+
+def default_workers():
+    """Nombre de processus par défaut : SMARTROUTE_WORKERS, sinon tous les cœurs."""
+    try:
+        n = int(os.environ.get(WORKERS_ENV, 0))
+    except ValueError:
+        n = 0
+    return max(1, n or os.cpu_count() or 1)
@@ -1,25 +1,23 @@
-import pickle
-from pathlib import Path
+import os
+import sys
 
-GRAPH_PATH = Path("data/processed/graph_with_strava_and_dplus.gpickle")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-with open(GRAPH_PATH, "rb") as f:
-    G = pickle.load(f)
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.trace_store import TraceStore, CLEAN_TRACES_DIR
 
-xs = [data["x"] for _, data in G.nodes(data=True) if "x" in data]
-ys = [data["y"] for _, data in G.nodes(data=True) if "y" in data]
+store = GraphStore.load(GRAPH_STORE_DIR)
 
-lon_min, lon_max = min(xs), max(xs)
-lat_min, lat_max = min(ys), max(ys)
+lon_min, lon_max = float(store.node_x.min()), float(store.node_x.max())
+lat_min, lat_max = float(store.node_y.min()), float(store.node_y.max())
 
 print("🗺️ Bounding box du graphe enrichi :")
 print(f" - Longitude : {lon_min:.6f} → {lon_max:.6f}")
 print(f" - Latitude  : {lat_min:.6f} → {lat_max:.6f}")
 
 
-# Remplace par une trace de ton dossier gpx_clean
-with open("data/gpx_clean/fontainebleau (12).pkl", "rb") as f:
-    trace = pickle.load(f)
+# Remplace par une trace du store des traces nettoyées
+trace = TraceStore(CLEAN_TRACES_DIR).get("fontainebleau (12)").points()
 
 trace_lats = [pt[0] for pt in trace]
 trace_lons = [pt[1] for pt in trace]
@@ -32,6 +30,7 @@ from osmnx.distance import nearest_nodes
 
 lat, lon = 48.40452, 2.67791  # un point de ta trace
 
+G = store.to_networkx()
 node = nearest_nodes(G, lon, lat)
 print(f"Nœud le plus proche : {node}")
 print(G.nodes[node])
@@ -1,31 +1,32 @@
-import pickle
+import os
+import sys
+import numpy as np
 
-GRAPH_PATH = "data/processed/graph_with_strava_and_dplus.gpickle"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-with open(GRAPH_PATH, "rb") as f:
-    G = pickle.load(f)
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
 
-count_none_dplus = 0
-count_none_dist = 0
-count_none_pop = 0
-for u, v, k, data in G.edges(keys=True, data=True):
-    if data.get("dplus") is None:
-        count_none_dplus += 1
-    if data.get("distance") is None:
-        count_none_dist += 1
-    if data.get("popularity") is None:
-        count_none_pop += 1
+store = GraphStore.load(GRAPH_STORE_DIR)
 
-total = G.number_of_edges()
+count_none_dplus = int(np.isnan(store.dplus).sum())
+count_none_dist = int(np.isnan(store.distance).sum())
+count_none_pop = int(np.isnan(store.popularity).sum())
+
+total = store.n_edges
 print(f"Total edges: {total}")
 print(f"Edges with dplus=None: {count_none_dplus}")
 print(f"Edges with distance=None: {count_none_dist}")
 print(f"Edges with popularity=None: {count_none_pop}")
 
 # Affiche un exemple enrichi
-for u, v, k, data in G.edges(keys=True, data=True):
-    if data.get("dplus") is not None and data.get("distance") is not None and data.get("popularity") is not None:
-        print("\nExemple d'arête enrichie:")
-        print("Edge:", (u, v, k))
-        print("Attributs:", data)
-        break
+enriched = ~(np.isnan(store.dplus) | np.isnan(store.distance) | np.isnan(store.popularity))
+if enriched.any():
+    e = int(np.argmax(enriched))
+    print("\nExemple d'arête enrichie:")
+    print("Edge:", tuple(store.edge_ids([e])[0]))
+    print("Attributs:", {
+        "distance": float(store.distance[e]),
+        "dplus": float(store.dplus[e]),
+        "popularity": float(store.popularity[e]),
+        "surface": store.surface_names()[e],
+    })
@@ -1,30 +1,28 @@
-import pickle
+import os
+import sys
+import numpy as np
 import matplotlib.pyplot as plt
-from pathlib import Path
-from shapely.geometry import LineString
 import matplotlib.cm as cm
 import matplotlib.colors as colors
 
-GRAPH_PATH = Path("data/processed/graph_with_strava_and_dplus.gpickle")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
 
 def load_graph(path):
-    with open(path, "rb") as f:
-        return pickle.load(f)
+    return GraphStore.load(path)
 
-def plot_dplus_colormap(G, min_dplus=0.0, max_edges=2000):
+def plot_dplus_colormap(store, min_dplus=0.0, max_edges=2000):
     edges = []
     dplus_values = []
 
-    for u, v, k, d in G.edges(data=True, keys=True):
-        dplus = d.get("dplus")
-        geom = d.get("geometry")
-        if isinstance(geom, LineString) and dplus is not None and dplus >= min_dplus:
-            coords = list(geom.coords)
-            lons, lats = zip(*coords)
-            edges.append((lons, lats))
-            dplus_values.append(dplus)
-            if len(edges) >= max_edges:
-                break
+    offsets, coords = store.geom_offsets, store.geom_coords
+    has_geom = np.diff(offsets) >= 2
+    selected = np.flatnonzero(has_geom & (store.dplus >= min_dplus))[:max_edges]
+    for e in selected:
+        lons, lats = coords[offsets[e]:offsets[e + 1]].T
+        edges.append((lons, lats))
+        dplus_values.append(float(store.dplus[e]))
 
     if not edges:
         print("Aucune arête à afficher.")
@@ -51,5 +49,5 @@ def plot_dplus_colormap(G, min_dplus=0.0, max_edges=2000):
     plt.show()
 
 if __name__ == "__main__":
-    G = load_graph(GRAPH_PATH)
-    plot_dplus_colormap(G, min_dplus=0.0, max_edges=2000)
+    store = load_graph(GRAPH_STORE_DIR)
+    plot_dplus_colormap(store, min_dplus=0.0, max_edges=2000)
@@ -1,21 +1,21 @@
-import pickle
-import matplotlib.pyplot as plt
-from collections import Counter
 import os
+import sys
+import numpy as np
+import matplotlib.pyplot as plt
 
-GRAPH_PATH = "data/processed/graph_with_strava_and_dplus.gpickle"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-with open(GRAPH_PATH, "rb") as f:
-    G = pickle.load(f)
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
 
-# Extraire les surfaces valides
-surfaces = [
-    d.get("surface", "unknown")
-    for _, _, _, d in G.edges(keys=True, data=True)
-    if d.get("surface", "unknown") != "unknown"
-]
+store = GraphStore.load(GRAPH_STORE_DIR)
 
-surface_counts = Counter(surfaces)
+# Extraire les surfaces valides (comptage direct sur les codes)
+counts = np.bincount(store.surface[store.surface >= 0], minlength=len(store.surface_labels))
+surface_counts = {
+    label: int(n)
+    for label, n in zip(store.surface_labels, counts)
+    if label != "unknown" and n > 0
+}
 
 if not surface_counts:
     print("⚠️ Aucune surface trouvée.")
@@ -1,75 +1,32 @@
-import pickle
-import json
-from pathlib import Path
-import numpy as np
-from scipy.spatial import KDTree
-import pandas as pd
+import os
+import sys
 
-GRAPH_PATH = "data/processed/osm_graph_filtered_clean.gpickle"
-MATCHED_DIR = Path("data/matched_traces")
-OUT_DIR = Path("data/final_dataset")
-OUT_DIR.mkdir(exist_ok=True)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-with open(GRAPH_PATH, "rb") as fg:
-    G = pickle.load(fg)
-node_ids = []
-node_coords = []
-for nid, data in G.nodes(data=True):
-    lat = data.get("y")
-    lon = data.get("x")
-    if lat is not None and lon is not None:
-        node_ids.append(nid)
-        node_coords.append([lat, lon])
-node_coords = np.array(node_coords)
-kdtree = KDTree(node_coords)
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.snap_index import EdgeSnapIndex, SNAP_INDEX_DIR
+from src.data_collection.trace_store import TraceStore, VALHALLA_TRACES_DIR
 
-def find_nearest_node(coord):
-    dist, idx = kdtree.query(coord)
-    return node_ids[idx]
+store = GraphStore.load(GRAPH_STORE_DIR)
+snap_index = EdgeSnapIndex.load(SNAP_INDEX_DIR)
+edge_ids = store.edge_ids()
+surfaces = store.surface_names()
 
-def extract_shape_points(data):
-    points = []
-    for leg in data.get("trip", {}).get("legs", []):
-        shape_raw = leg.get("shape", "")
-        if isinstance(shape_raw, str):
-            import polyline
-            decoded = polyline.decode(shape_raw)
-            # Correction échelle si besoin :
-            if any(abs(lat) > 90 or abs(lon) > 180 for lat, lon in decoded):
-                decoded = [(lat / 10, lon / 10) for lat, lon in decoded]
-            points.extend(decoded)
-        elif isinstance(shape_raw, list):
-            points.extend(shape_raw)
-    return points
+MAX_SNAP_DIST = 30.0  # m, distance maximale entre un point de la trace et l'arête
 
-MAX_DIST = 0.002  # ~200 m, à ajuster selon densité du réseau
-
-for json_file in MATCHED_DIR.glob("*_matched.json"):
-    with open(json_file, "r") as f:
-        data = json.load(f)
-    shape_points = extract_shape_points(data)
-    if not shape_points or len(shape_points) < 2:
+for trace in TraceStore(VALHALLA_TRACES_DIR).traces():
+    if len(trace) < 2:
         continue
-    print(f"\n=== Trace : {json_file.name} ===")
+    print(f"\n=== Trace : {trace.name} ===")
+    shape_points = trace.points()
+    edges, _, dists = snap_index.nearest(trace.lon, trace.lat, MAX_SNAP_DIST)
     n_match, n_fail = 0, 0
-    for i in range(len(shape_points) - 1):
-        pt1, pt2 = shape_points[i], shape_points[i+1]
-        u = find_nearest_node(pt1)
-        v = find_nearest_node(pt2)
-        lat1, lon1 = G.nodes[u]['y'], G.nodes[u]['x']
-        lat2, lon2 = G.nodes[v]['y'], G.nodes[v]['x']
-        dist = np.hypot(lat1 - lat2, lon1 - lon2)
-        found = False
-        for dir_ in [(u, v), (v, u)]:
-            if G.has_edge(*dir_) and dist < MAX_DIST:
-                k = list(G[dir_[0]][dir_[1]].keys())[0]
-                edge_data = G[dir_[0]][dir_[1]][k]
-                print(f"[MATCH] {dir_} k={k} : dplus={edge_data.get('dplus')}, dist={edge_data.get('distance')}, surface={edge_data.get('surface')}")
-                n_match += 1
-                found = True
-                break
-        if not found:
-            print(f"[FAIL] Pas de match pour ({u}, {v}) ou trop loin (Δlat={abs(lat1-lat2):.5f}, Δlon={abs(lon1-lon2):.5f}, dist={dist:.5f})")
+    for pt, e, d in zip(shape_points, edges, dists):
+        if e < 0:
+            print(f"[FAIL] Point {tuple(pt)} à plus de {MAX_SNAP_DIST:.0f} m du graphe")
             n_fail += 1
+            continue
+        u, v, k = (int(i) for i in edge_ids[e])
+        print(f"[MATCH] ({u}, {v}) k={k} à {d:.1f} m : dplus={store.dplus[e]}, dist={store.distance[e]}, surface={surfaces[e]}")
+        n_match += 1
     print(f"Total matches: {n_match}, fails: {n_fail}")
-
@@ -1,36 +1,21 @@
-import pickle
-import json
-from pathlib import Path
+import os
+import sys
 import numpy as np
-from scipy.spatial import KDTree
 
-GRAPH_FILE = "data/processed/graph_with_strava_and_dplus.gpickle"
-MATCHED_JSON = Path("data/matched_traces") / "allee-de-maintenon_cleaned_matched.json"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-def extract_shape_points(data):
-    legs = data.get("trip", {}).get("legs", [])
-    all_points = []
-    for leg in legs:
-        shape_raw = leg.get("shape")
-        if not shape_raw:
-            continue
-        if isinstance(shape_raw, str):
-            import polyline
-            decoded = polyline.decode(shape_raw)
-            all_points.extend(decoded)
-        elif isinstance(shape_raw, list):
-            all_points.extend(shape_raw)
-    return all_points
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.snap_index import EdgeSnapIndex, SNAP_INDEX_DIR, MAX_SNAP_DISTANCE
+from src.data_collection.trace_store import TraceStore, VALHALLA_TRACES_DIR
 
-# Charger graphe
-with open(GRAPH_FILE, "rb") as fg:
-    G = pickle.load(fg)
+TRACE_NAME = "allee-de-maintenon"
 
-# Charger la trace matched
-with open(MATCHED_JSON, "r") as f:
-    valhalla_result = json.load(f)
+# Charger graphe et index d'accrochage
+store = GraphStore.load(GRAPH_STORE_DIR)
+snap_index = EdgeSnapIndex.load(SNAP_INDEX_DIR)
 
-shape_points = extract_shape_points(valhalla_result)
+# Charger la trace matched
+shape_points = TraceStore(VALHALLA_TRACES_DIR).get(TRACE_NAME).points()
 
 # --- Affiche les premiers points pour vérification
 print("Premiers points de la polyline Valhalla :")
@@ -39,33 +24,26 @@ for pt in shape_points[:5]:
 print("\n")
 
 # --- Affiche les premiers nœuds du graphe
-node_ids = []
-node_coords = []
-for nid, data in G.nodes(data=True):
-    lat = data.get("y")
-    lon = data.get("x")
-    if lat is not None and lon is not None:
-        node_ids.append(nid)
-        node_coords.append([lat, lon])
 print("Premier nœud du graphe :")
-print(node_ids[0], node_coords[0])
+print(int(store.node_ids[0]), [float(store.node_y[0]), float(store.node_x[0])])
 print("\n")
 
 # --- Compare plage de valeurs
 shape_lats = [pt[0] for pt in shape_points]
 shape_lons = [pt[1] for pt in shape_points]
-graph_lats = [c[0] for c in node_coords]
-graph_lons = [c[1] for c in node_coords]
 print(f"Latitude (Valhalla polyline) min/max: {min(shape_lats):.4f}/{max(shape_lats):.4f}")
 print(f"Longitude (Valhalla polyline) min/max: {min(shape_lons):.4f}/{max(shape_lons):.4f}")
-print(f"Latitude (graphe) min/max: {min(graph_lats):.4f}/{max(graph_lats):.4f}")
-print(f"Longitude (graphe) min/max: {min(graph_lons):.4f}/{max(graph_lons):.4f}")
-
-# --- Crée un KDTree et teste l'association sur 5 points
-node_coords_arr = np.array(node_coords)
-kdtree = KDTree(node_coords_arr)
-print("\nAssociation Valhalla → nœud du graphe :")
-for pt in shape_points[:5]:
-    dist, idx = kdtree.query(pt)
-    nid = node_ids[idx]
-    print(f"  Point polyline {pt} ➔ nœud {nid} coord: {node_coords[idx]}, dist={dist:.2f} m")
+print(f"Latitude (graphe) min/max: {np.min(store.node_y):.4f}/{np.max(store.node_y):.4f}")
+print(f"Longitude (graphe) min/max: {np.min(store.node_x):.4f}/{np.max(store.node_x):.4f}")
+
+# --- Teste l'accrochage aux arêtes sur 5 points
+first = np.asarray(shape_points[:5], dtype=np.float64)
+edges, offsets, dists = snap_index.nearest(first[:, 1], first[:, 0])
+edge_ids = store.edge_ids()
+print("\nAccrochage Valhalla → arête du graphe :")
+for pt, e, offset, dist in zip(shape_points[:5], edges, offsets, dists):
+    if e < 0:
+        print(f"  Point polyline {pt} ➔ aucune arête à moins de {MAX_SNAP_DISTANCE:.0f} m")
+        continue
+    u, v, k = (int(i) for i in edge_ids[e])
+    print(f"  Point polyline {pt} ➔ arête ({u}, {v}, {k}), abscisse={offset:.1f} m, dist={dist:.2f} m")
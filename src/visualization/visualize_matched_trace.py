@@ -1,13 +1,15 @@
-import json
+import os
+import sys
 import matplotlib.pyplot as plt
 import osmnx as ox
 from shapely.geometry import LineString
-from pathlib import Path
 import pickle
-import polyline
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.trace_store import TraceStore, VALHALLA_TRACES_DIR
 
 GRAPH_FILE = "data/processed/graph_wgs84.gpickle"
-MATCHED_DIR = Path("data/matched_traces")
 
 # Mots-clés de traces déjà vues à exclure
 SEEN_KEYWORDS = [
@@ -23,32 +25,14 @@ def load_graph(path):
     with open(path, "rb") as f:
         return pickle.load(f)
 
-def extract_shape_points(data):
-    legs = data.get("trip", {}).get("legs", [])
-    all_points = []
-    for leg in legs:
-        shape_raw = leg.get("shape")
-        if not shape_raw:
-            continue
-        if isinstance(shape_raw, str):
-            decoded = polyline.decode(shape_raw)
-            if max(abs(lat) for lat, _ in decoded) > 90:
-                decoded = [(lat / 10, lon / 10) for lat, lon in decoded]
-            all_points.extend(decoded)
-        elif isinstance(shape_raw, list):
-            all_points.extend(shape_raw)
-    return all_points
-
 def should_exclude(name):
     name = name.lower()
     return any(keyword in name for keyword in SEEN_KEYWORDS)
 
-def plot_matched_trace(matched_json_path):
-    with open(matched_json_path, "r") as f:
-        data = json.load(f)
-    shape_points = extract_shape_points(data)
+def plot_matched_trace(trace):
+    shape_points = trace.points()
     if not shape_points:
-        print(f"❌ Trace vide ou invalide : {matched_json_path}")
+        print(f"❌ Trace vide ou invalide : {trace.name}")
         return
 
     G = load_graph(GRAPH_FILE)
@@ -57,7 +41,7 @@ def plot_matched_trace(matched_json_path):
     fig, ax = ox.plot_graph(G, show=False, close=False, node_size=0, edge_color="lightgray")
 
     xs, ys = shape_line.xy
-    ax.plot(xs, ys, color="red", linewidth=2, label=Path(matched_json_path).stem)
+    ax.plot(xs, ys, color="red", linewidth=2, label=trace.name)
 
     minx, miny, maxx, maxy = shape_line.bounds
     buffer = 0.005
@@ -65,32 +49,30 @@ def plot_matched_trace(matched_json_path):
     ax.set_ylim(miny - buffer, maxy + buffer)
 
     ax.legend()
-    plt.title(f"Trace matched - {Path(matched_json_path).stem}")
+    plt.title(f"Trace matched - {trace.name}")
     plt.tight_layout()
     plt.show()
 
 def main():
-    all_jsons = list(MATCHED_DIR.glob("*.json"))
+    store = TraceStore(VALHALLA_TRACES_DIR)
     candidates = []
 
-    for path in all_jsons:
-        if should_exclude(path.stem):
+    for name in store.names():
+        if should_exclude(name):
             continue
-        with open(path, "r") as f:
-            data = json.load(f)
-        points = extract_shape_points(data)
-        if points:
-            candidates.append((len(points), path))
+        n_points = len(store.get(name))
+        if n_points:
+            candidates.append((n_points, name))
 
     # Affiche les 10 premiers candidats pour vérification
     print("Candidats après filtre :")
-    for _, p in sorted(candidates, reverse=True)[:10]:
-        print(" -", p.name)
+    for _, name in sorted(candidates, reverse=True)[:10]:
+        print(" -", name)
 
     top_3 = sorted(candidates, reverse=True)[:3]
-    for _, trace_path in top_3:
-        print(f"Affichage de la trace : {trace_path.name}")
-        plot_matched_trace(trace_path)
+    for _, name in top_3:
+        print(f"Affichage de la trace : {name}")
+        plot_matched_trace(store.get(name))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
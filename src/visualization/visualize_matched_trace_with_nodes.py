@@ -1,18 +1,20 @@
-import pickle
-from pathlib import Path
+import os
+import sys
 
-GRAPH_FILE = "data/processed/osm_graph_filtered_clean.gpickle"
-CLEAN_DIR = Path("data/gpx_clean")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from src.data_collection.graph_store import GraphStore, GRAPH_STORE_DIR
+from src.data_collection.trace_store import TraceStore, CLEAN_TRACES_DIR
 
 # Affiche les 5 premiers points de la première trace trouvée
 def print_first_points():
-    traces = list(CLEAN_DIR.glob("*.pkl"))
-    if not traces:
+    clean = TraceStore(CLEAN_TRACES_DIR)
+    if not len(clean):
         print("Aucune trace trouvée.")
         return
-    with open(traces[0], "rb") as f:
-        trace = pickle.load(f)
-    print(f"Fichier testé : {traces[0].name}")
+    name = clean.names()[0]
+    trace = clean.get(name).points()
+    print(f"Trace testée : {name}")
     print("Premiers points de la trace (lat, lon) :")
     for pt in trace[:5]:
         print(pt)
@@ -24,11 +26,8 @@ def print_first_points():
 
 # Affiche la bounding box du graphe
 def print_graph_bbox():
-    import pickle
-    with open(GRAPH_FILE, "rb") as f:
-        G = pickle.load(f)
-    xs = [d["x"] for _, d in G.nodes(data=True)]
-    ys = [d["y"] for _, d in G.nodes(data=True)]
+    store = GraphStore.load(GRAPH_STORE_DIR)
+    xs, ys = store.node_x, store.node_y
     print("\nGraphe OSM :")
     print(f"BBox x (longitude): min={min(xs):.4f}, max={max(xs):.4f}")
     print(f"BBox y (latitude) : min={min(ys):.4f}, max={max(ys):.4f}")
@@ -39,9 +38,9 @@ if __name__ == "__main__":
     xs, ys = print_graph_bbox()
 
     # Vérifie si la trace est dans la bbox
-    if lats and lons and xs and ys:
-        out_lat = any(lat < min(ys) or lat > max(ys) for lat in lats)
-        out_lon = any(lon < min(xs) or lon > max(xs) for lon in lons)
+    if lats and lons and len(xs) and len(ys):
+        out_lat = any(lat < ys.min() or lat > ys.max() for lat in lats)
+        out_lon = any(lon < xs.min() or lon > xs.max() for lon in lons)
         if out_lat or out_lon:
             print("\n⚠️  Certains points de la trace sont en dehors de la bbox du graphe OSM !")
         else: